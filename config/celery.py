@@ -1,6 +1,7 @@
 # config/celery.py
 import os
 from celery import Celery
+from kombu import Queue
 
 # Establece el módulo de configuración de Django por defecto para el programa 'celery'.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
@@ -14,4 +15,26 @@ app = Celery('config')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 # Carga automáticamente las tareas desde todos los archivos 'tasks.py' de las apps registradas.
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+# --- Colas y enrutamiento ---
+# interactive: lanzadoras de escaneo y trabajo que alguien espera en pantalla.
+# bulk_extraction: subtareas de OCR/IA por archivo (admitidas en round-robin por usuario).
+# nightly_batch: procesos programados (precios, ganancias, historial).
+app.conf.task_default_queue = 'interactive'
+app.conf.task_queues = (
+    Queue('interactive'),
+    Queue('bulk_extraction'),
+    Queue('nightly_batch'),
+)
+app.conf.task_routes = {
+    'finanzas.tasks.process_single_*': {'queue': 'bulk_extraction'},
+    'finanzas.tasks.simulate_extraction': {'queue': 'bulk_extraction'},
+    'finanzas.tasks.process_drive_*': {'queue': 'interactive'},
+    'finanzas.tasks.admit_extraction_tasks': {'queue': 'interactive'},
+    'finanzas.tasks.nightly_*': {'queue': 'nightly_batch'},
+    # Los chunks de los trabajos nocturnos viajan como celery.starmap.
+    'celery.starmap': {'queue': 'nightly_batch'},
+}
+# Un worker no acapara mensajes que otro worker libre podría tomar.
+app.conf.worker_prefetch_multiplier = 1
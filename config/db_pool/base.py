@@ -0,0 +1,64 @@
+# config/db_pool/base.py
+"""
+Backend MySQL de Django con pool de conexiones acotado.
+
+- Driver PyMySQL (puro Python): bajo gevent sus sockets ceden el hub en lugar de
+  bloquearlo como el cliente en C de mysqlclient.
+- QueuePool de SQLAlchemy por proceso: como mucho POOL_SIZE + MAX_OVERFLOW conexiones
+  abiertas, compartidas por los hilos/greenlets. Cuando Django "cierra" la conexión al
+  terminar la petición (CONN_MAX_AGE = 0) en realidad la devuelve al pool.
+- Health check al sacarla del pool: si MySQL la cerró (wait_timeout, reinicio) se
+  descarta y se abre otra. RECYCLE renueva las que llevan demasiado tiempo abiertas.
+"""
+import os
+import threading
+
+import pymysql
+
+# El backend de Django importa MySQLdb; PyMySQL se hace pasar por él.
+pymysql.install_as_MySQLdb()
+
+from django.db.backends.mysql import base as mysql_base  # noqa: E402
+from sqlalchemy import event, exc  # noqa: E402
+from sqlalchemy.pool import QueuePool  # noqa: E402
+
+# Única fuente de los defaults; settings solo pasa lo que se sobrescriba con DB_POOL_*.
+POOL_DEFAULTS = {'POOL_SIZE': 10, 'MAX_OVERFLOW': 6, 'TIMEOUT': 10, 'RECYCLE': 1800}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Un proceso hijo (workers prefork de gunicorn/Celery) no debe reutilizar los sockets del padre.
+os.register_at_fork(after_in_child=_pools.clear)
+
+
+def _verificar_conexion(dbapi_connection, connection_record, connection_proxy):
+    try:
+        dbapi_connection.ping(reconnect=False)
+    except Exception as e:
+        # Cualquier falla del ping (socket cerrado, servidor caído) descarta la conexión.
+        # DisconnectionError hace que el pool descarte esta conexión y reintente con una nueva.
+        raise exc.DisconnectionError() from e
+
+
+class DatabaseWrapper(mysql_base.DatabaseWrapper):
+
+    def _pool(self, conn_params):
+        with _pools_lock:
+            pool = _pools.get(self.alias)
+            if pool is None:
+                opciones = {**POOL_DEFAULTS, **self.settings_dict.get('POOL_OPTIONS', {})}
+                pool = QueuePool(
+                    lambda: mysql_base.Database.connect(**conn_params),
+                    pool_size=opciones['POOL_SIZE'],
+                    max_overflow=opciones['MAX_OVERFLOW'],
+                    timeout=opciones['TIMEOUT'],
+                    recycle=opciones['RECYCLE'],
+                )
+                event.listen(pool, 'checkout', _verificar_conexion)
+                _pools[self.alias] = pool
+        return pool
+
+    def get_new_connection(self, conn_params):
+        # El proxy del pool delega todo al objeto de PyMySQL; su close() lo regresa al pool.
+        return self._pool(conn_params).connect()
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 from dotenv import load_dotenv
 import os
+from celery.schedules import crontab
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -61,6 +62,9 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # request.plan: suscripción y estado premium por petición (cacheado en Redis).
+    'finanzas.middleware.SuscripcionMiddleware',
+    'finanzas.middleware.referencias_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
@@ -91,12 +95,28 @@ WSGI_APPLICATION = 'config.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        # MySQL vía PyMySQL con pool de conexiones acotado y health check (ver config/db_pool).
+        'ENGINE': 'config.db_pool',
         'NAME': os.getenv("DB_NAME"),
         'USER': os.getenv("DB_USER"),
         'PASSWORD': os.getenv("DB_PASSWORD"),
         'HOST': os.getenv("DB_HOST"),
         'PORT': os.getenv("DB_PORT"),
+        # En la web 0: al terminar la petición la conexión vuelve al pool. Los workers de
+        # Celery (prefork, sin async) pueden conservarla entre tareas con DB_CONN_MAX_AGE.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '0')),
+        'CONN_HEALTH_CHECKS': True,
+        # Conexiones por proceso: POOL_SIZE fijas + MAX_OVERFLOW temporales; TIMEOUT segundos
+        # de espera por una libre; RECYCLE por debajo del wait_timeout de MySQL. Solo lo que
+        # venga del entorno: los defaults están en config.db_pool.base.POOL_DEFAULTS.
+        'POOL_OPTIONS': {
+            opcion: int(os.environ[variable]) for opcion, variable in (
+                ('POOL_SIZE', 'DB_POOL_SIZE'),
+                ('MAX_OVERFLOW', 'DB_POOL_MAX_OVERFLOW'),
+                ('TIMEOUT', 'DB_POOL_TIMEOUT'),
+                ('RECYCLE', 'DB_POOL_RECYCLE'),
+            ) if os.getenv(variable)
+        },
     }
 }
 
@@ -189,6 +209,48 @@ CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:63
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+# Subtareas de extracción simultáneas en bulk_extraction; el resto espera turno por usuario.
+EXTRACTION_MAX_INFLIGHT = int(os.getenv('EXTRACTION_MAX_INFLIGHT', '8'))
+
+# Trabajos programados: sustituyen a cron_job.sh. Cada uno reparte tickers/usuarios entre los workers.
+CELERY_BEAT_SCHEDULE = {
+    # Vuelve a admitir subtareas de extracción aunque ningún escaneo termine (worker caído).
+    'admitir-extraccion': {
+        'task': 'finanzas.tasks.admit_extraction_tasks',
+        'schedule': 30.0,
+        'options': {'expires': 30},
+    },
+    'actualizar-tipo-cambio': {
+        'task': 'finanzas.tasks.nightly_update_exchange_rates',
+        'schedule': crontab(hour=1, minute=45),
+    },
+    'actualizar-precios': {
+        'task': 'finanzas.tasks.nightly_update_prices',
+        'schedule': crontab(hour=2, minute=0),
+    },
+    'actualizar-historial-portafolio': {
+        'task': 'finanzas.tasks.nightly_update_portfolio_history',
+        'schedule': crontab(hour=2, minute=30),
+    },
+    'actualizar-ganancias-mensuales': {
+        'task': 'finanzas.tasks.nightly_update_monthly_profits',
+        'schedule': crontab(hour=3, minute=0, day_of_month=1),
+    },
+    # Después del historial del portafolio, para que el patrimonio use su valor del día.
+    'actualizar-patrimonio': {
+        'task': 'finanzas.tasks.nightly_update_net_worth',
+        'schedule': crontab(hour=3, minute=30),
+    },
+}
+NIGHTLY_CHUNK_SIZE = int(os.getenv('NIGHTLY_CHUNK_SIZE', '10'))
+# Límite del plan de TwelveData, compartido por todos los workers (0 = sin límite).
+TWELVEDATA_CALLS_PER_MINUTE = int(os.getenv('TWELVEDATA_CALLS_PER_MINUTE', '8'))
+# Almacenamiento del historial del portafolio: 'diaria' (un renglón por día) o 'anual'
+# (un renglón comprimido por usuario y año). Al cambiarlo, compactar_portfolio_history
+# migra a todos; si no, cada usuario se migra en su siguiente reconstrucción nocturna.
+PORTFOLIO_HISTORY_STORAGE = os.getenv('PORTFOLIO_HISTORY_STORAGE', 'diaria')
+# Cómo se costean las ventas de inversiones: 'FIFO', 'LIFO' o 'PROMEDIO'.
+METODO_COSTO_VENTAS = os.getenv('METODO_COSTO_VENTAS', 'FIFO')
 
 
 SITE_ID = 1
@@ -214,6 +276,11 @@ SOCIALACCOUNT_PROVIDERS = {
 SOCIALACCOUNT_AUTO_SIGNUP = True
 SOCIALACCOUNT_STORE_TOKENS = True
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Concurrencia adaptativa (AIMD) por proveedor de IA, compartida entre workers vía Redis.
+AI_PROVIDER_LIMITS = {
+    'gemini': {'initial': 4, 'min': 1, 'max': int(os.getenv('GEMINI_MAX_CONCURRENCY', 15)), 'latency_target': 8.0},
+    'mistral': {'initial': 2, 'min': 1, 'max': int(os.getenv('MISTRAL_MAX_CONCURRENCY', 6)), 'latency_target': 12.0},
+}
 CSRF_TRUSTED_ORIGINS = os.getenv("CSRF_TRUSTED_ORIGINS", '').split(',')
 # tu_proyecto/settings.py
 
@@ -275,4 +342,27 @@ SESSION_EXPIRE_SECONDS = 1800  # 30 minutos (30 * 60)
 SESSION_EXPIRE_AFTER_LAST_ACTIVITY = True
 
 # URL a la que se redirige al usuario cuando su sesión expira.
-SESSION_TIMEOUT_REDIRECT = 'login' 
\ No newline at end of file
+SESSION_TIMEOUT_REDIRECT = 'login' 
+
+# La marca de última actividad solo se reescribe cuando pasó esta fracción de la ventana
+# (con 0.1, cada 3 minutos), no en cada petición. A cambio, la inactividad tolerada
+# queda entre 27 y 30 minutos.
+SESSION_REFRESH_FRACTION = float(os.getenv('SESSION_REFRESH_FRACTION', '0.1'))
+SESSION_EXPIRE_AFTER_LAST_ACTIVITY_GRACE_PERIOD = int(SESSION_EXPIRE_SECONDS * SESSION_REFRESH_FRACTION)
+
+# --- SESIONES ---
+# Se leen de Redis y la base queda como respaldo (cached_db); si Redis cae se sigue con la base.
+# finanzas.sessions además indexa las sesiones por usuario para revocarlas (RISC) por llave.
+SESSION_ENGINE = 'finanzas.sessions'
+SESSION_CACHE_ALIAS = 'sesiones'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sesiones': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('SESSION_REDIS_URL', CELERY_BROKER_URL),
+        'KEY_PREFIX': 'sesion',
+        'OPTIONS': {'socket_connect_timeout': 2, 'socket_timeout': 2},
+    },
+}
\ No newline at end of file
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import registro_transacciones, TransaccionPendiente, inversiones, Suscripcion, PendingInvestment, Presupuesto
+from .models import registro_transacciones, TransaccionPendiente, inversiones, Suscripcion, PendingInvestment, Presupuesto, EjecucionProgramada, EstadoCuentaTarjeta, SaldoMensualCuenta, NetWorthSnapshot, Holding, VentaInversion, TipoCambio
 
 # Registramos los modelos para que aparezcan en el panel de admin
 admin.site.register(registro_transacciones)
@@ -8,4 +8,10 @@ admin.site.register(inversiones)
 admin.site.register(Suscripcion) # <-- Esta línea es la importante
 admin.site.register(PendingInvestment)
 admin.site.register(Presupuesto)
-#admin.site.register(Venta)
\ No newline at end of file
+admin.site.register(EjecucionProgramada)
+admin.site.register(EstadoCuentaTarjeta)
+admin.site.register(SaldoMensualCuenta)
+admin.site.register(NetWorthSnapshot)
+admin.site.register(Holding)
+admin.site.register(VentaInversion)
+admin.site.register(TipoCambio)
@@ -3,6 +3,7 @@ from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 from .models import registro_transacciones, inversiones, Deuda, PagoAmortizacion
 from .models import Cuenta
+from .services.reference_data_service import ReferenceDataService
 
 class CuentaForm(forms.ModelForm):
     class Meta:
@@ -51,10 +52,10 @@ class TransaccionesForm(forms.ModelForm):
         if user:
             self.user = user
             # Obtenemos solo las cuentas que pertenecen a este usuario
-            cuentas = Cuenta.objects.filter(propietario=user)
-            opciones_origen = [(c.nombre, c.nombre) for c in cuentas]
+            refs = ReferenceDataService.de_usuario(user)
+            opciones_origen = [(c.nombre, c.nombre) for c in refs.cuentas.values()]
             
-            deudas = Deuda.objects.filter(propietario=user)
+            deudas = refs.deudas.values()
             opciones_destino = opciones_origen.copy()
             for d in deudas:
                 if (d.nombre, d.nombre) not in opciones_destino:
@@ -0,0 +1,22 @@
+from datetime import date
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from finanzas.services import NetWorthService
+
+class Command(BaseCommand):
+    help = "Calcula y guarda el patrimonio diario (NetWorthSnapshot) de cada usuario desde su primer dato hasta hoy."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', type=int, help='Solo este usuario (id).')
+        parser.add_argument('--desde', type=date.fromisoformat, help='Fecha inicial AAAA-MM-DD (por defecto, el primer dato del usuario).')
+
+    def handle(self, *args, **options):
+        ids = [options['usuario']] if options['usuario'] else NetWorthService.usuarios_con_datos()
+
+        total = 0
+        for user in User.objects.filter(id__in=ids).iterator():
+            dias = NetWorthService.respaldar(user, options['desde'])
+            total += dias
+            self.stdout.write(f"  - {user.username}: {dias} día(s)")
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Patrimonio guardado: {total} día(s) para {len(ids)} usuario(s)."))
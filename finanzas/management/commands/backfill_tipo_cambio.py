@@ -0,0 +1,28 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+
+from finanzas.models import inversiones
+from finanzas.services import ExchangeRateService
+
+
+class Command(BaseCommand):
+    help = ("Guarda el tipo de cambio USD/MXN de cada día del rango en TipoCambio, pidiendo a currencyapi "
+            "un año por llamada. Los fines de semana y feriados repiten el día anterior.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', type=date.fromisoformat, help='Fecha inicial AAAA-MM-DD (por defecto, la primera compra registrada).')
+        parser.add_argument('--hasta', type=date.fromisoformat, help='Fecha final AAAA-MM-DD (por defecto, ayer).')
+
+    def handle(self, *args, **options):
+        hasta = options['hasta'] or timezone.localdate() - timedelta(days=1)
+        desde = options['desde'] or inversiones.objects.aggregate(inicio=Min('fecha_compra'))['inicio']
+        if desde is None or desde > hasta:
+            self.stdout.write("No hay días que respaldar.")
+            return
+
+        self.stdout.write(f"Respaldando el tipo de cambio del {desde} al {hasta}...")
+        dias = ExchangeRateService().respaldar(desde, hasta)
+        self.stdout.write(self.style.SUCCESS(f"✅ Tipo de cambio guardado: {dias} día(s)."))
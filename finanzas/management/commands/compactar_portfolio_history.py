@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from finanzas.models import PortfolioHistory, PortfolioHistoryAnual
+
+
+class Command(BaseCommand):
+    help = ("Pasa el historial del portafolio de todos los usuarios al almacenamiento configurado en "
+            "PORTFOLIO_HISTORY_STORAGE ('diaria' o 'anual') sin recalcularlo. Se puede correr varias veces.")
+
+    def handle(self, *args, **options):
+        destino = settings.PORTFOLIO_HISTORY_STORAGE
+        antes = PortfolioHistory.objects.count() + PortfolioHistoryAnual.objects.count()
+        usuarios = sorted(PortfolioHistory.objects.usuarios())
+        self.stdout.write(f"Moviendo el historial de {len(usuarios)} usuarios al almacenamiento '{destino}'...")
+
+        for usuario_id in usuarios:
+            # Se lee completo antes de escribir: reemplazar() borra ambos almacenamientos.
+            filas = list(PortfolioHistory.objects.serie(usuario_id))
+            PortfolioHistory.objects.reemplazar(usuario_id, filas)
+
+        despues = PortfolioHistory.objects.count() + PortfolioHistoryAnual.objects.count()
+        self.stdout.write(self.style.SUCCESS(f"✅ Renglones de historial: {antes} → {despues}."))
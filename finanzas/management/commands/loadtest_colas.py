@@ -0,0 +1,74 @@
+import time
+import json
+import uuid
+import statistics
+from celery import group
+from django.core.management.base import BaseCommand
+from finanzas.tasks import simulate_extraction, _admit_pending
+from finanzas.services import ScanProgress, FairAdmissionQueue
+
+class Command(BaseCommand):
+    help = ("Prueba de carga de las colas de extracción: lanza un escaneo grande y varios chicos "
+            "y mide el p95 del tiempo hasta el primer resultado de los escaneos chicos.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grande', type=int, default=500, help='Archivos del escaneo grande.')
+        parser.add_argument('--chicos', type=int, default=10, help='Número de usuarios con escaneo chico.')
+        parser.add_argument('--archivos-chico', type=int, default=3, help='Archivos por escaneo chico.')
+        parser.add_argument('--segundos', type=float, default=1.0, help='Latencia simulada por archivo.')
+        parser.add_argument('--retraso', type=float, default=2.0, help='Segundos entre el escaneo grande y los chicos.')
+        parser.add_argument('--timeout', type=float, default=900.0)
+        parser.add_argument('--fifo', action='store_true', help='Despacha los grupos directo al broker (comparación sin admisión justa).')
+
+    def _lanzar(self, user_id, archivos, segundos, fifo):
+        scan_id = f"loadtest-{uuid.uuid4()}"
+        progress = ScanProgress()
+        progress.start(scan_id, user_id, archivos)
+        job = group(
+            simulate_extraction.s(user_id=user_id, file_id=f"{scan_id}-{i}", file_name=f"archivo-{i}",
+                                  mime_type='image/jpeg', scan_id=scan_id, seconds=segundos)
+            for i in range(archivos)
+        )
+        if fifo:
+            job.apply_async()
+        else:
+            job.freeze()
+            FairAdmissionQueue().enqueue(user_id, scan_id, [(sig.id, json.dumps(sig)) for sig in job.tasks])
+            _admit_pending()
+        return scan_id, time.time()
+
+    def _primer_resultado(self, scan_id):
+        """Milisegundos (epoch) del primer evento final; el id del stream lleva el timestamp."""
+        for entry_id, evento, _ in ScanProgress().read(scan_id, block_ms=None, count=1000):
+            if evento in ('done', 'failed', 'throttled'):
+                return int(entry_id.split('-')[0]) / 1000.0
+        return None
+
+    def handle(self, *args, **opts):
+        modo = 'FIFO' if opts['fifo'] else 'round-robin'
+        self.stdout.write(f"🚀 Escaneo grande de {opts['grande']} archivos + {opts['chicos']} escaneos de {opts['archivos_chico']} ({modo})...")
+
+        # Ids sintéticos fuera del rango de usuarios reales.
+        self._lanzar(990000, opts['grande'], opts['segundos'], opts['fifo'])
+        time.sleep(opts['retraso'])
+        chicos = [self._lanzar(990001 + i, opts['archivos_chico'], opts['segundos'], opts['fifo'])
+                  for i in range(opts['chicos'])]
+
+        esperas, limite = {}, time.time() + opts['timeout']
+        while len(esperas) < len(chicos) and time.time() < limite:
+            for scan_id, inicio in chicos:
+                if scan_id not in esperas:
+                    primero = self._primer_resultado(scan_id)
+                    if primero is not None:
+                        esperas[scan_id] = primero - inicio
+            time.sleep(0.5)
+
+        if not esperas:
+            self.stdout.write(self.style.ERROR("Ningún escaneo chico obtuvo resultado antes del timeout."))
+            return
+        valores = sorted(esperas.values())
+        p95 = valores[min(len(valores) - 1, int(round(0.95 * (len(valores) - 1))))]
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Tiempo al primer resultado (chicos, {len(valores)}/{len(chicos)}): "
+            f"p50={statistics.median(valores):.2f}s p95={p95:.2f}s máx={valores[-1]:.2f}s"
+        ))
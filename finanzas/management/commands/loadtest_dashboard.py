@@ -0,0 +1,78 @@
+import time
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+# Lo que pide el navegador al abrir el dashboard: la página y los endpoints de sus gráficas.
+RUTAS_DASHBOARD = [
+    'dashboard', 'api_datos_gastos', 'api_flujo_dinero', 'api_datos_inversiones',
+    'api_ganancias_mensuales', 'api_ingresos_tarjetas', 'api_datos_patrimonio',
+]
+
+
+def _percentil(valores, p):
+    return valores[min(len(valores) - 1, int(round(p * (len(valores) - 1))))]
+
+
+class Command(BaseCommand):
+    help = ("Prueba de carga del dashboard contra un servidor en marcha: N clientes concurrentes "
+            "piden la página y sus gráficas. Reporta peticiones/s y latencias p50/p95/p99. "
+            "Córrala antes y después de un cambio de configuración (pool, worker, CONN_MAX_AGE).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='URL base del servidor.')
+        parser.add_argument('--usuario', required=True, help='Usuario con datos con el que se inicia sesión.')
+        parser.add_argument('--concurrencia', type=int, default=32)
+        parser.add_argument('--peticiones', type=int, default=1000, help='Total de peticiones a enviar.')
+        parser.add_argument('--calentamiento', type=int, default=20, help='Peticiones previas que no se miden.')
+        parser.add_argument('--etiqueta', default='', help='Texto para identificar la corrida (ej. "antes").')
+
+    def _cookie_de_sesion(self, username):
+        """Crea una sesión en la misma base que usa el servidor."""
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f"No existe el usuario '{username}'.")
+        client = Client()
+        client.force_login(user)
+        return client.cookies[settings.SESSION_COOKIE_NAME].value
+
+    def handle(self, *args, **opts):
+        base = opts['url'].rstrip('/')
+        rutas = [base + reverse(nombre) for nombre in RUTAS_DASHBOARD]
+        cookies = {settings.SESSION_COOKIE_NAME: self._cookie_de_sesion(opts['usuario'])}
+
+        local = threading.local()
+
+        def pedir(i):
+            if not hasattr(local, 'http'):
+                local.http = httpx.Client(cookies=cookies, timeout=60, follow_redirects=False)
+            inicio = time.perf_counter()
+            try:
+                ok = local.http.get(rutas[i % len(rutas)]).status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            return time.perf_counter() - inicio, ok
+
+        self.stdout.write(f"🚀 {opts['peticiones']} peticiones, {opts['concurrencia']} concurrentes contra {base}...")
+        with ThreadPoolExecutor(max_workers=opts['concurrencia']) as pool:
+            list(pool.map(pedir, range(opts['calentamiento'])))
+            inicio = time.perf_counter()
+            resultados = list(pool.map(pedir, range(opts['peticiones'])))
+            duracion = time.perf_counter() - inicio
+
+        latencias = sorted(t for t, _ in resultados)
+        errores = sum(1 for _, ok in resultados if not ok)
+        etiqueta = f"[{opts['etiqueta']}] " if opts['etiqueta'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {etiqueta}{len(resultados) / duracion:.1f} req/s | "
+            f"p50={statistics.median(latencias) * 1000:.0f}ms p95={_percentil(latencias, 0.95) * 1000:.0f}ms "
+            f"p99={_percentil(latencias, 0.99) * 1000:.0f}ms máx={latencias[-1] * 1000:.0f}ms | errores={errores}"
+        ))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from finanzas.models import Deuda, EstadoCuentaTarjeta
+
+class Command(BaseCommand):
+    help = "Recalcula desde cero los estados de cuenta por ciclo de las tarjetas de crédito."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', type=int, help='Solo las tarjetas de este usuario (id).')
+
+    def handle(self, *args, **options):
+        tarjetas = Deuda.objects.filter(tipo_deuda='TARJETA_CREDITO')
+        if options['usuario']:
+            tarjetas = tarjetas.filter(propietario_id=options['usuario'])
+
+        total = 0
+        for deuda in tarjetas.iterator():
+            ciclos = EstadoCuentaTarjeta.objects.reconstruir(deuda)
+            total += ciclos
+            self.stdout.write(f"  - {deuda.nombre} (usuario {deuda.propietario_id}): {ciclos} ciclo(s)")
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Estados de cuenta reconstruidos: {total} ciclo(s)."))
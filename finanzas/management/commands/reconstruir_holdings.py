@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from finanzas.models import Holding
+
+class Command(BaseCommand):
+    help = "Recalcula las posiciones por activo (Holding) a partir de los lotes de inversiones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', type=int, help='Solo las posiciones de este usuario (id).')
+
+    def handle(self, *args, **options):
+        total = Holding.objects.reconstruir(options['usuario'])
+        self.stdout.write(self.style.SUCCESS(f"✅ {total} posiciones reconstruidas."))
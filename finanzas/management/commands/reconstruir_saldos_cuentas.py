@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from finanzas.models import Cuenta, SaldoMensualCuenta
+
+class Command(BaseCommand):
+    help = "Verifica y recalcula los cierres mensuales de saldo de cada cuenta a partir de las transacciones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', type=int, help='Solo las cuentas de este usuario (id).')
+        parser.add_argument('--verificar', action='store_true', help='Solo reporta diferencias, no modifica nada.')
+
+    def handle(self, *args, **options):
+        cuentas = Cuenta.objects.all()
+        if options['usuario']:
+            cuentas = cuentas.filter(propietario_id=options['usuario'])
+
+        con_diferencias = 0
+        for cuenta in cuentas.iterator():
+            diferencias = SaldoMensualCuenta.objects.reconstruir(cuenta, verificar=options['verificar'])
+            if not diferencias:
+                continue
+            con_diferencias += 1
+            self.stdout.write(self.style.WARNING(
+                f"  - {cuenta.nombre} (usuario {cuenta.propietario_id}): {len(diferencias)} mes(es) con diferencias"))
+            for mes, guardado, esperado in diferencias:
+                self.stdout.write(f"      {mes:%Y-%m}: guardado={guardado} esperado={esperado}")
+
+        if options['verificar'] and con_diferencias:
+            raise CommandError(f"{con_diferencias} cuenta(s) con cierres que no cuadran con el historial.")
+        accion = "verificadas" if options['verificar'] else "reconstruidas"
+        self.stdout.write(self.style.SUCCESS(f"✅ Cuentas {accion}. {con_diferencias} con diferencias."))
@@ -1,33 +1,28 @@
 # EN: finanzas/management/commands/update_monthly_profits.py
 
 from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User
-from finanzas.models import GananciaMensual
+from finanzas.services import StockPriceService
 from finanzas.services.finance_service import InvestmentService
-import time
+from finanzas.tasks import nightly_update_monthly_profits
 
 class Command(BaseCommand):
     help = 'Calcula y almacena las ganancias mensuales no realizadas para todos los usuarios.'
 
-    def handle(self, *args, **kwargs):
-        usuarios = User.objects.all()
-        for usuario in usuarios:
-            self.stdout.write(self.style.SUCCESS(f'Procesando usuario: {usuario.username}'))
-            
-            # 1. Borramos los datos antiguos para este usuario
-            GananciaMensual.objects.filter(propietario=usuario).delete()
-            
-            # 2. Calculamos los nuevos datos (aquí se hacen las llamadas a la API)
-            ganancias = InvestmentService.calculate_monthly_profit(usuario)
-            print(f'Ganancias calculadas para {usuario}: {ganancias}')
-            time.sleep(15)
-            # 3. Guardamos los nuevos datos en nuestra tabla
-            for mes, total in ganancias.items():
-                GananciaMensual.objects.create(
-                    propietario=usuario,
-                    mes=mes,
-                    total=total
-                )
-            self.stdout.write(f'Se guardaron {len(ganancias)} registros de ganancias mensuales para {usuario.username}.')
-        
-        self.stdout.write(self.style.SUCCESS('Proceso completado.'))
\ No newline at end of file
+    def add_arguments(self, parser):
+        parser.add_argument('--encolar', action='store_true', help='Reparte el trabajo entre los workers de Celery.')
+
+    def handle(self, *args, **options):
+        if options['encolar']:
+            nightly_update_monthly_profits.delay()
+            self.stdout.write(self.style.SUCCESS('Cálculo de ganancias mensuales encolado en Celery.'))
+            return
+
+        # Una serie por ticker para todos los usuarios, luego el P&L de cada uno en memoria.
+        resumen = InvestmentService.refresh_all_monthly_profits()
+        self.stdout.write(
+            f"Se guardaron {resumen['filas']} registros de ganancias mensuales para {len(resumen['usuarios'])} usuarios."
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Proceso completado. {resumen['series_descargadas']} series consultadas "
+            f"({StockPriceService.llamadas_api} llamadas reales), {resumen['llamadas_ahorradas']} llamadas ahorradas."
+        ))
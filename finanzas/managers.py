@@ -1,7 +1,13 @@
-from django.db import models
-from django.db.models import Sum, Q, F
+from django.db import models, transaction
+from django.db.models import Sum, Q, F, Count, Value, DecimalField, Min, Max
+from django.db.models.functions import Coalesce, TruncMonth, Lower, Trim
+from django.db.models.lookups import Exact
 from django.utils import timezone
-from datetime import datetime
+import logging
+from datetime import datetime, date, time, timedelta
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
 
 class TransaccionManager(models.Manager):
     """
@@ -25,8 +31,8 @@ class TransaccionManager(models.Manager):
         qs = self.del_mes(usuario, year, month)
         
         # Obtenemos los nombres de las cuentas de débito del usuario
-        from finanzas.models import Cuenta
-        cuentas_debito = list(Cuenta.objects.filter(propietario=usuario, tipo='DEBITO').values_list('nombre', flat=True))
+        from finanzas.services.reference_data_service import ReferenceDataService
+        cuentas_debito = [c.nombre for c in ReferenceDataService.de_usuario(usuario).cuentas_debito()]
         if not cuentas_debito:
             cuentas_debito = ['Efectivo Quincena']
             
@@ -67,3 +73,504 @@ class TransaccionManager(models.Manager):
                 .values('mes')
                 .annotate(total=Sum('monto'))
                 .order_by('mes'))
+
+
+def repartir_abono(saldos, monto):
+    """
+    Reparte 'monto' sobre [(numero_cuota, saldo), ...] en el orden dado con una suma acumulada.
+    Devuelve (ultima_cuota_cubierta, (cuota_parcial, abono) | None, sobrante).
+    """
+    ultima, acumulado = None, 0
+    for numero, saldo in saldos:
+        if saldo <= 0:
+            continue
+        if acumulado + saldo > monto:
+            resto = monto - acumulado
+            return ultima, ((numero, resto) if resto > 0 else None), 0
+        acumulado += saldo
+        ultima = numero
+    return ultima, None, monto - acumulado
+
+
+class AmortizacionManager(models.Manager):
+    """
+    Aplica y revierte pagos a capital sobre la tabla de amortización con operaciones
+    por conjunto: el reparto se calcula en memoria y se escribe con un UPDATE por rango
+    de cuotas (más uno para la cuota que quede cubierta parcialmente).
+    """
+
+    def aplicar_abono_capital(self, deuda, monto):
+        pendientes = self.filter(deuda=deuda, pagado=False).order_by('numero_cuota')
+        saldos = [(n, capital - abonado) for n, capital, abonado in
+                  pendientes.values_list('numero_cuota', 'capital', 'capital_abonado')]
+        ultima, parcial, sobrante = repartir_abono(saldos, monto)
+        if ultima is not None:
+            pendientes.filter(numero_cuota__lte=ultima).update(pagado=True, capital_abonado=F('capital'))
+        if parcial:
+            numero, abono = parcial
+            self.filter(deuda=deuda, numero_cuota=numero).update(capital_abonado=F('capital_abonado') + abono)
+        return sobrante
+
+    def revertir_abono_capital(self, deuda, monto):
+        """Deshace 'monto' de abonos a capital empezando por la última cuota abonada (LIFO)."""
+        # Las cuotas liquidadas con una mensualidad conservan su pago; solo se tocan abonos a capital.
+        abonadas = self.filter(deuda=deuda, transaccion_pago__isnull=True, capital_abonado__gt=0).order_by('-numero_cuota')
+        primera, parcial, sobrante = repartir_abono(abonadas.values_list('numero_cuota', 'capital_abonado'), monto)
+        if primera is not None:
+            abonadas.filter(numero_cuota__gte=primera).update(pagado=False, capital_abonado=0)
+        if parcial:
+            numero, abono = parcial
+            self.filter(deuda=deuda, numero_cuota=numero).update(pagado=False, capital_abonado=F('capital_abonado') - abono)
+        return sobrante
+
+
+class EstadoCuentaManager(models.Manager):
+    """
+    Estados de cuenta de tarjetas por ciclo de facturación. Se mantienen al vuelo:
+    cada compra o pago suma su monto en la fila de su ciclo (y lo resta al borrarse),
+    así los totales del periodo se leen sin recorrer registro_transacciones.
+    """
+
+    @staticmethod
+    def _movimientos_tarjeta(transaccion) -> list[tuple]:
+        """[(deuda_tarjeta, cargos, pagos), ...] que genera la transacción (una entrada por tarjeta)."""
+        es_tarjeta_asociada = transaccion.deuda_asociada_id and transaccion.tipo_pago == 'TARJETA_CREDITO'
+        if transaccion.tipo not in ('GASTO', 'TRANSFERENCIA') and not es_tarjeta_asociada:
+            return []
+        from finanzas.services.reference_data_service import ReferenceDataService, clave_nombre
+        refs = ReferenceDataService.de_usuario(transaccion.propietario_id)
+        tarjetas = {t.id: t for t in (refs.tarjeta(transaccion.cuenta_origen), refs.tarjeta(transaccion.cuenta_destino)) if t}
+        if es_tarjeta_asociada:
+            asociada = refs.deuda_por_id(transaccion.deuda_asociada_id)
+            if asociada is not None and asociada.tipo_deuda == 'TARJETA_CREDITO':
+                tarjetas[asociada.id] = asociada
+        tarjetas = list(tarjetas.values())
+
+        movimientos = {}
+        for tarjeta in tarjetas:
+            if transaccion.tipo == 'TRANSFERENCIA' and clave_nombre(tarjeta.nombre) == clave_nombre(transaccion.cuenta_destino):
+                movimientos[tarjeta.id] = (tarjeta, 0, transaccion.monto)
+            elif ((transaccion.tipo == 'GASTO' and clave_nombre(tarjeta.nombre) == clave_nombre(transaccion.cuenta_origen))
+                  or (es_tarjeta_asociada and tarjeta.id == transaccion.deuda_asociada_id)):
+                movimientos[tarjeta.id] = (tarjeta, transaccion.monto, 0)
+        return list(movimientos.values())
+
+    def registrar(self, deuda, fecha, cargos=0, pagos=0, movimientos=1):
+        """Suma un movimiento al ciclo de la tarjeta que contiene 'fecha' (crea el ciclo si no existe)."""
+        from finanzas.utils import ciclo_de_corte, fecha_limite_pago
+        if isinstance(fecha, str):
+            fecha = date.fromisoformat(fecha[:10])
+        inicio, corte = ciclo_de_corte(fecha, deuda.dia_corte)
+        estado, _ = self.get_or_create(deuda=deuda, fecha_corte=corte, defaults={
+            'fecha_inicio': inicio, 'fecha_pago': fecha_limite_pago(corte, deuda.dia_pago),
+        })
+        self.filter(pk=estado.pk).update(cargos=F('cargos') + cargos, pagos=F('pagos') + pagos,
+                                         movimientos=F('movimientos') + movimientos)
+
+    def aplicar_transaccion(self, transaccion, signo=1):
+        """Aplica (signo=1) o revierte (signo=-1) la transacción en los estados de cuenta."""
+        for deuda, cargos, pagos in self._movimientos_tarjeta(transaccion):
+            self.registrar(deuda, transaccion.fecha, cargos * signo, pagos * signo, signo)
+
+    def reconstruir(self, deuda) -> int:
+        """Recalcula desde cero todos los ciclos de una tarjeta (p. ej. si cambió su día de corte)."""
+        from finanzas.models import registro_transacciones
+        from finanzas.services.reference_data_service import clave_nombre
+        from finanzas.utils import ciclo_de_corte, fecha_limite_pago
+        clave = clave_nombre(deuda.nombre)
+        filas = (registro_transacciones.objects
+                 .filter(propietario_id=deuda.propietario_id)
+                 .filter(Q(Exact(nombre_normalizado('cuenta_origen'), clave), tipo='GASTO') |
+                         Q(Exact(nombre_normalizado('cuenta_destino'), clave), tipo='TRANSFERENCIA') |
+                         Q(deuda_asociada=deuda, tipo_pago='TARJETA_CREDITO'))
+                 .values_list('fecha', 'monto', 'tipo', 'cuenta_destino'))
+
+        ciclos, ciclo_por_fecha = {}, {}
+        for fecha, monto, tipo, destino in filas:
+            if fecha not in ciclo_por_fecha:
+                ciclo_por_fecha[fecha] = ciclo_de_corte(fecha, deuda.dia_corte)
+            inicio, corte = ciclo_por_fecha[fecha]
+            ciclo = ciclos.setdefault(corte, self.model(
+                deuda=deuda, fecha_inicio=inicio, fecha_corte=corte,
+                fecha_pago=fecha_limite_pago(corte, deuda.dia_pago),
+                cargos=Decimal('0'), pagos=Decimal('0'), movimientos=0,
+            ))
+            if tipo == 'TRANSFERENCIA' and clave_nombre(destino) == clave:
+                ciclo.pagos += monto
+            else:
+                ciclo.cargos += monto
+            ciclo.movimientos += 1
+
+        with transaction.atomic():
+            self.filter(deuda=deuda).delete()
+            self.bulk_create(ciclos.values(), batch_size=500)
+        return len(ciclos)
+
+
+# Tipos que sacan dinero de la cuenta origen (mismo criterio que el dashboard y api_ingresos_tarjeta).
+TIPOS_SALIDA = ('GASTO', 'PAGO_MENSUALIDAD', 'PAGO_CAPITAL', 'TRANSFERENCIA')
+
+
+def nombre_normalizado(campo):
+    """El nombre de cuenta de una columna como lo compara clave_nombre(): sin espacios de sobra ni mayúsculas."""
+    return Lower(Trim(campo))
+
+
+def efecto_en_cuentas(tipo, origen, destino, monto) -> dict:
+    """Cambio de saldo que provoca una transacción en cada cuenta, por nombre de cuenta."""
+    efecto = {}
+    if tipo == 'INGRESO':
+        efecto[origen] = monto
+    elif tipo in TIPOS_SALIDA:
+        efecto[origen] = -monto
+        if tipo == 'TRANSFERENCIA':
+            efecto[destino] = efecto.get(destino, 0) + monto
+    return {nombre: delta for nombre, delta in efecto.items() if nombre}
+
+
+def _filtros_cuenta(nombre):
+    # Mismo emparejamiento por nombre que el camino incremental (Referencias.cuenta()).
+    from finanzas.services.reference_data_service import clave_nombre
+    clave = clave_nombre(nombre)
+    origen = Exact(nombre_normalizado('cuenta_origen'), clave)
+    destino = Exact(nombre_normalizado('cuenta_destino'), clave)
+    entradas = Q(origen, tipo='INGRESO') | Q(destino, tipo='TRANSFERENCIA')
+    salidas = Q(origen, tipo__in=TIPOS_SALIDA)
+    return entradas, salidas
+
+
+def flujo_de_cuenta(nombre):
+    """Equivalente en SQL de efecto_en_cuentas para una cuenta: entradas - salidas."""
+    entradas, salidas = _filtros_cuenta(nombre)
+    cero = Value(Decimal('0'), output_field=DecimalField(max_digits=20, decimal_places=3))
+    return Coalesce(Sum('monto', filter=entradas), cero) - Coalesce(Sum('monto', filter=salidas), cero)
+
+
+class SaldoCuentaManager(models.Manager):
+    """
+    Cierres mensuales de saldo por Cuenta. Cada transacción ajusta el movimiento de su
+    mes y, con un solo UPDATE, el saldo de cierre de ese mes y los siguientes. El saldo a
+    cualquier fecha es el último cierre anterior más las transacciones de ese mes.
+    """
+
+    def registrar(self, cuenta, fecha, delta, movimientos=1):
+        if isinstance(fecha, str):
+            fecha = date.fromisoformat(fecha[:10])
+        mes = fecha.replace(day=1)
+        with transaction.atomic():
+            previo = (self.filter(cuenta=cuenta, mes__lt=mes).order_by('-mes')
+                      .values_list('saldo_cierre', flat=True).first())
+            self.get_or_create(cuenta=cuenta, mes=mes, defaults={'saldo_cierre': previo or 0})
+            self.filter(cuenta=cuenta, mes=mes).update(movimiento_neto=F('movimiento_neto') + delta,
+                                                       movimientos=F('movimientos') + movimientos)
+            self.filter(cuenta=cuenta, mes__gte=mes).update(saldo_cierre=F('saldo_cierre') + delta)
+            if movimientos < 0:
+                # Un mes sin movimientos no necesita cierre propio: el anterior ya lo cubre.
+                self.filter(cuenta=cuenta, mes=mes, movimientos__lte=0).delete()
+
+    def aplicar_transaccion(self, transaccion, signo=1):
+        """Aplica (signo=1) o revierte (signo=-1) la transacción en los cierres de sus cuentas."""
+        efecto = efecto_en_cuentas(transaccion.tipo, transaccion.cuenta_origen,
+                                   transaccion.cuenta_destino, transaccion.monto)
+        if not efecto:
+            return
+        from finanzas.services.reference_data_service import ReferenceDataService
+        refs = ReferenceDataService.de_usuario(transaccion.propietario_id)
+        for nombre, delta in efecto.items():
+            cuenta = refs.cuenta(nombre)
+            if cuenta is not None:
+                self.registrar(cuenta, transaccion.fecha, delta * signo, signo)
+
+    def saldo_al(self, cuenta, fecha) -> Decimal:
+        """Saldo de la cuenta al cierre del día 'fecha': un cierre más el tramo del mes en curso."""
+        from finanzas.models import registro_transacciones
+        mes = fecha.replace(day=1)
+        base = (self.filter(cuenta=cuenta, mes__lt=mes).order_by('-mes')
+                .values_list('saldo_cierre', flat=True).first()) or Decimal('0')
+        tramo = (registro_transacciones.objects
+                 .filter(propietario_id=cuenta.propietario_id, fecha__gte=mes, fecha__lte=fecha)
+                 .aggregate(neto=flujo_de_cuenta(cuenta.nombre))['neto'])
+        return base + tramo
+
+    def calcular_desde_libro(self, cuenta) -> list:
+        """Cierres mensuales recalculados desde registro_transacciones: [(mes, neto, saldo, movimientos)]."""
+        from finanzas.models import registro_transacciones
+        entradas, salidas = _filtros_cuenta(cuenta.nombre)
+        filas = (registro_transacciones.objects
+                 .filter(entradas | salidas, propietario_id=cuenta.propietario_id)
+                 .annotate(mes=TruncMonth('fecha'))
+                 .values('mes')
+                 .annotate(neto=flujo_de_cuenta(cuenta.nombre), movimientos=Count('id'))
+                 .order_by('mes'))
+        cierres, saldo = [], Decimal('0')
+        for fila in filas:
+            saldo += fila['neto']
+            cierres.append((fila['mes'], fila['neto'], saldo, fila['movimientos']))
+        return cierres
+
+    def reconstruir(self, cuenta, verificar=False) -> list:
+        """
+        Compara los cierres guardados con el libro y devuelve las diferencias
+        [(mes, guardado, esperado)]. Si verificar=False además los reescribe.
+        """
+        esperados = self.calcular_desde_libro(cuenta)
+        guardados = {mes: saldo for mes, saldo in self.filter(cuenta=cuenta).values_list('mes', 'saldo_cierre')}
+        por_mes = {mes: saldo for mes, _, saldo, _ in esperados}
+        diferencias = [(mes, guardados.get(mes), por_mes.get(mes))
+                       for mes in sorted(set(guardados) | set(por_mes))
+                       if guardados.get(mes) != por_mes.get(mes)]
+        if not verificar and diferencias:
+            with transaction.atomic():
+                self.filter(cuenta=cuenta).delete()
+                self.bulk_create([
+                    self.model(cuenta=cuenta, mes=mes, movimiento_neto=neto, saldo_cierre=saldo, movimientos=n)
+                    for mes, neto, saldo, n in esperados
+                ], batch_size=500)
+        return diferencias
+
+
+# Tope para el estado "no premium" en caché: pasar a premium siempre pasa por save(), que invalida.
+PREMIUM_CACHE_MAX_TTL = 86400
+
+
+class SuscripcionManager(models.Manager):
+    """
+    Estado premium por usuario cacheado en Redis (compartido por todos los workers).
+    Si es premium la clave expira justo cuando is_active() dejaría de serlo (fin del día
+    de fecha_fin); Suscripcion.save() la invalida, así que el webhook de Mercado Pago
+    se refleja de inmediato. Si Redis no responde se consulta la base.
+    """
+
+    def clave_premium(self, user_id) -> str:
+        return f"premium:{user_id}"
+
+    def de_usuario(self, user):
+        """Suscripción del usuario sin escribir: si no tiene, una instancia 'pendiente' sin guardar."""
+        return self.filter(usuario=user).first() or self.model(usuario=user)
+
+    def ttl_premium(self, suscripcion) -> int:
+        if not suscripcion.is_active():
+            return PREMIUM_CACHE_MAX_TTL
+        fin = datetime.combine(suscripcion.fecha_fin.date() + timedelta(days=1), time.min,
+                               tzinfo=suscripcion.fecha_fin.tzinfo)
+        return max(1, int((fin - timezone.now()).total_seconds()))
+
+    def es_premium(self, user, suscripcion=None, client=None) -> bool:
+        from .utils import get_redis_client
+
+        clave = self.clave_premium(user.pk)
+        try:
+            client = client or get_redis_client()
+            guardado = client.get(clave)
+            if guardado is not None:
+                return guardado in (b'1', '1')
+        except Exception as e:
+            logger.warning(f"Estado premium: Redis no disponible ({e}), se consulta la base.")
+            client = None
+
+        suscripcion = suscripcion or self.de_usuario(user)
+        activo = suscripcion.is_active()
+        if client is not None:
+            try:
+                client.set(clave, '1' if activo else '0', ex=self.ttl_premium(suscripcion))
+            except Exception as e:
+                logger.warning(f"Estado premium: no se pudo guardar en Redis ({e}).")
+        return activo
+
+    def invalidar_premium(self, user_id, client=None):
+        from .utils import get_redis_client
+
+        try:
+            (client or get_redis_client()).delete(self.clave_premium(user_id))
+        except Exception as e:
+            logger.warning(f"Estado premium: no se pudo invalidar en Redis ({e}).")
+
+
+class PortfolioHistoryManager(models.Manager):
+    """
+    Historial del portafolio en cualquiera de los dos almacenamientos: renglón por día
+    (PortfolioHistory) o bloque comprimido por año (PortfolioHistoryAnual), según
+    settings.PORTFOLIO_HISTORY_STORAGE. Se lee del activo y, si el usuario todavía no
+    tiene nada ahí (no se ha reconstruido desde el cambio), del otro. Las filas son
+    (fecha, valor_total, capital_invertido, ganancia_no_realizada) en orden de fecha.
+    """
+
+    def _anual(self):
+        from django.apps import apps
+        return apps.get_model('finanzas', 'PortfolioHistoryAnual')
+
+    def compacto(self) -> bool:
+        from django.conf import settings
+        return getattr(settings, 'PORTFOLIO_HISTORY_STORAGE', 'diaria') == 'anual'
+
+    def _filas_diarias(self, usuario_id, desde, hasta):
+        qs = self.filter(usuario_id=usuario_id)
+        if desde:
+            qs = qs.filter(fecha__gte=desde)
+        if hasta:
+            qs = qs.filter(fecha__lte=hasta)
+        return qs.order_by('fecha').values_list('fecha', 'valor_total', 'capital_invertido', 'ganancia_no_realizada')
+
+    def _filas_anuales(self, usuario_id, desde, hasta):
+        qs = self._anual().objects.filter(usuario_id=usuario_id)
+        if desde:
+            qs = qs.filter(ultima_fecha__gte=desde)
+        if hasta:
+            qs = qs.filter(primera_fecha__lte=hasta)
+        # Un bloque a la vez: el rango se decodifica conforme se consume.
+        for bloque in qs.order_by('anio').iterator():
+            yield from bloque.filas(desde, hasta)
+
+    def _tiene_anual(self, usuario_id) -> bool:
+        return self._anual().objects.filter(usuario_id=usuario_id).exists()
+
+    def serie(self, usuario_id, desde=None, hasta=None):
+        """Genera las filas del usuario entre 'desde' y 'hasta' (ambos opcionales)."""
+        if self.compacto():
+            anual = self._tiene_anual(usuario_id) or not self.filter(usuario_id=usuario_id).exists()
+        else:
+            anual = not self.filter(usuario_id=usuario_id).exists() and self._tiene_anual(usuario_id)
+        if anual:
+            return self._filas_anuales(usuario_id, desde, hasta)
+        return iter(self._filas_diarias(usuario_id, desde, hasta))
+
+    def existe(self, usuario_id) -> bool:
+        return self.filter(usuario_id=usuario_id).exists() or self._tiene_anual(usuario_id)
+
+    def primera_fecha(self, usuario_id):
+        return min(filter(None, [
+            self.filter(usuario_id=usuario_id).aggregate(f=models.Min('fecha'))['f'],
+            self._anual().objects.filter(usuario_id=usuario_id).aggregate(f=models.Min('primera_fecha'))['f'],
+        ]), default=None)
+
+    def usuarios(self) -> set:
+        return (set(self.values_list('usuario_id', flat=True).distinct()) |
+                set(self._anual().objects.values_list('usuario_id', flat=True).distinct()))
+
+    def reemplazar(self, usuario_id, filas: list) -> int:
+        """
+        Sustituye todo el historial del usuario en el almacenamiento activo y borra lo que
+        tuviera en el otro (así el cambio de modo se completa con la reconstrucción nocturna).
+        Devuelve cuántos renglones se escribieron.
+        """
+        Anual = self._anual()
+        with transaction.atomic():
+            self.filter(usuario_id=usuario_id).delete()
+            Anual.objects.filter(usuario_id=usuario_id).delete()
+            if not self.compacto():
+                return len(self.bulk_create(
+                    (self.model(usuario_id=usuario_id, fecha=f, valor_total=v, capital_invertido=c,
+                                ganancia_no_realizada=g) for f, v, c, g in filas),
+                    batch_size=1000,
+                ))
+            por_anio = {}
+            for fila in filas:
+                por_anio.setdefault(fila[0].year, []).append(fila)
+            return len(Anual.objects.bulk_create(
+                [Anual.empaquetar(usuario_id, anio, filas_anio) for anio, filas_anio in por_anio.items()]
+            ))
+
+
+class HoldingManager(models.Manager):
+    """
+    Posiciones por (usuario, activo, tipo de inversión) sobre los lotes de inversiones.
+    Guardar o borrar un lote recalcula solo su posición (un aggregate sobre sus lotes);
+    una actualización de precio toca un renglón por usuario con ese ticker. Así el
+    portafolio y los trabajos leen O(activos) renglones en vez de O(lotes).
+    """
+
+    @staticmethod
+    def clave(emisora_ticker, nombre_activo) -> str:
+        return (emisora_ticker or '').upper() or nombre_activo
+
+    @staticmethod
+    def filtro_activo(clave) -> Q:
+        """Lotes o ventas de un activo: por ticker o, si no tienen ticker, por nombre."""
+        sin_ticker = Q(emisora_ticker__isnull=True) | Q(emisora_ticker='')
+        return Q(emisora_ticker__iexact=clave) | (sin_ticker & Q(nombre_activo=clave))
+
+    def recalcular(self, propietario_id, clave, tipo_inversion):
+        """
+        Rehace la posición desde sus lotes. Si el activo tiene ventas, lo vendido sale de
+        la posición según el emparejamiento de lotes (y se guarda su ganancia realizada).
+        Si ya no quedan títulos, la borra.
+        """
+        from .models import inversiones, VentaInversion
+        llave = {'propietario_id': propietario_id, 'tipo_inversion': tipo_inversion}
+        filtro = self.filtro_activo(clave)
+        lotes = inversiones.objects.filter(filtro, **llave)
+        # Valor a precio actual de todos los títulos comprados: el de cada lote ya descuenta lo vendido.
+        agg = lotes.aggregate(
+            cantidad=Sum('cantidad_titulos'), costo=Sum('costo_total_adquisicion'),
+            valor=Sum(F('cantidad_titulos') * F('precio_actual_titulo')), lotes=Count('id'), primera_compra=Min('fecha_compra'),
+            ticker=Max('emisora_ticker'), nombre=Max('nombre_activo'),
+        )
+        llave['clave'] = clave
+        if not agg['lotes']:
+            self.filter(**llave).delete()
+            return None
+        cantidad, costo, valor = agg['cantidad'], agg['costo'], agg['valor']
+        if not VentaInversion.objects.filter(filtro, propietario_id=propietario_id, tipo_inversion=tipo_inversion).exists():
+            # Sin ventas cada lote vale por todos sus títulos (p. ej. tras borrar la última venta).
+            lotes.exclude(valor_actual_mercado=F('cantidad_titulos') * F('precio_actual_titulo')).update(
+                valor_actual_mercado=F('cantidad_titulos') * F('precio_actual_titulo'),
+                ganancia_perdida_no_realizada=F('cantidad_titulos') * F('precio_actual_titulo') - F('costo_total_adquisicion'),
+            )
+        else:
+            from .services.lot_matching_service import LotMatchingService
+            precio = valor / cantidad if cantidad else Decimal('0')
+            cantidad, costo = LotMatchingService.recalcular(propietario_id, clave, tipo_inversion)
+            valor = cantidad * precio
+            if cantidad <= 0:
+                self.filter(**llave).delete()
+                return None
+        holding, _ = self.update_or_create(**llave, defaults={
+            'emisora_ticker': clave if agg['ticker'] else None,
+            'nombre_activo': agg['nombre'],
+            'cantidad_titulos': cantidad,
+            'costo_total_adquisicion': costo,
+            'precio_promedio': costo / cantidad if cantidad else Decimal('0'),
+            'precio_actual_titulo': valor / cantidad if cantidad else Decimal('0'),
+            'valor_actual_mercado': valor,
+            'ganancia_perdida_no_realizada': valor - costo,
+            'lotes': agg['lotes'],
+            'primera_compra': agg['primera_compra'],
+        })
+        return holding
+
+    def aplicar_lote(self, lote, anterior=None):
+        """Tras guardar o borrar un lote o una venta: recalcula su posición (y la anterior si cambió de activo)."""
+        posiciones = {(lote.propietario_id, self.clave(lote.emisora_ticker, lote.nombre_activo), lote.tipo_inversion)}
+        if anterior is not None:
+            posiciones.add((anterior.propietario_id, self.clave(anterior.emisora_ticker, anterior.nombre_activo),
+                            anterior.tipo_inversion))
+        for posicion in posiciones:
+            self.recalcular(*posicion)
+
+    def actualizar_precio(self, ticker: str, precio: Decimal) -> list:
+        """Aplica el precio a las posiciones con ese ticker (un UPDATE). Devuelve los usuarios tocados."""
+        posiciones = self.filter(emisora_ticker=ticker.upper())
+        usuarios = list(posiciones.order_by().values_list('propietario_id', flat=True).distinct())
+        posiciones.update(
+            precio_actual_titulo=precio,
+            valor_actual_mercado=F('cantidad_titulos') * precio,
+            ganancia_perdida_no_realizada=F('cantidad_titulos') * precio - F('costo_total_adquisicion'),
+        )
+        return usuarios
+
+    def reconstruir(self, propietario_id=None) -> int:
+        """Rehace todas las posiciones (de un usuario o de todos) desde los lotes. Devuelve cuántas quedaron."""
+        from .models import inversiones
+        lotes = inversiones.objects.all() if propietario_id is None else inversiones.objects.filter(propietario_id=propietario_id)
+        posiciones = {
+            (p, self.clave(ticker, nombre), tipo) for p, ticker, nombre, tipo in
+            lotes.values_list('propietario_id', 'emisora_ticker', 'nombre_activo', 'tipo_inversion').distinct()
+        }
+        with transaction.atomic():
+            sobrantes = self.all() if propietario_id is None else self.filter(propietario_id=propietario_id)
+            for p, clave, tipo in sobrantes.values_list('propietario_id', 'clave', 'tipo_inversion'):
+                if (p, clave, tipo) not in posiciones:
+                    self.filter(propietario_id=p, clave=clave, tipo_inversion=tipo).delete()
+            for posicion in posiciones:
+                self.recalcular(*posicion)
+        return len(posiciones)
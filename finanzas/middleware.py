@@ -0,0 +1,59 @@
+# finanzas/middleware.py
+from functools import cached_property
+
+from asgiref.sync import sync_to_async, iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.deprecation import MiddlewareMixin
+
+from .models import Suscripcion
+from .services.reference_data_service import ReferenceDataService
+
+
+class PlanUsuario:
+    """Suscripción y estado premium del usuario, resueltos como mucho una vez por petición."""
+
+    def __init__(self, request):
+        self._request = request
+
+    @cached_property
+    def suscripcion(self):
+        """La fila de Suscripcion (o una 'pendiente' sin guardar); solo la piden las vistas que la muestran."""
+        return Suscripcion.objects.de_usuario(self._request.user)
+
+    @cached_property
+    def es_premium(self) -> bool:
+        user = self._request.user
+        if not user.is_authenticated:
+            return False
+        # Si la vista ya cargó la suscripción no hace falta ir a Redis.
+        if 'suscripcion' in self.__dict__:
+            return self.suscripcion.is_active()
+        return Suscripcion.objects.es_premium(user)
+
+    async def aes_premium(self) -> bool:
+        if 'es_premium' not in self.__dict__:
+            user = await self._request.auser()
+            self.__dict__['es_premium'] = bool(user.is_authenticated and
+                                               await sync_to_async(Suscripcion.objects.es_premium)(user))
+        return self.es_premium
+
+
+class SuscripcionMiddleware(MiddlewareMixin):
+    """Expone request.plan; nada se consulta hasta que una vista lo usa."""
+
+    def process_request(self, request):
+        request.plan = PlanUsuario(request)
+
+
+@sync_and_async_middleware
+def referencias_middleware(get_response):
+    """Memo de cuentas y deudas por petición: formularios, vistas y save() comparten una carga."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            with ReferenceDataService.alcance():
+                return await get_response(request)
+    else:
+        def middleware(request):
+            with ReferenceDataService.alcance():
+                return get_response(request)
+    return middleware
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finanzas', '0023_presupuesto_monto_real'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EjecucionProgramada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trabajo', models.CharField(max_length=50)),
+                ('estado', models.CharField(choices=[('en_curso', 'En curso'), ('completada', 'Completada'), ('con_errores', 'Completada con errores')], default='en_curso', max_length=15)),
+                ('inicio', models.DateTimeField(auto_now_add=True)),
+                ('fin', models.DateTimeField(blank=True, null=True)),
+                ('duracion_segundos', models.FloatField(blank=True, null=True)),
+                ('unidades_totales', models.PositiveIntegerField(default=0)),
+                ('usuarios_procesados', models.PositiveIntegerField(default=0)),
+                ('llamadas_api', models.PositiveIntegerField(default=0)),
+                ('errores', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-inicio'],
+            },
+        ),
+    ]
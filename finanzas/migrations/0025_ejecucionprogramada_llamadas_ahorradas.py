@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finanzas', '0024_ejecucionprogramada'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ejecucionprogramada',
+            name='llamadas_ahorradas',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
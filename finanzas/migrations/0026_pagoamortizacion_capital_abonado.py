@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:42
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def marcar_cuotas_abonadas(apps, schema_editor):
+    # Las cuotas liquidadas por pagos a capital no tienen transacción asociada.
+    PagoAmortizacion = apps.get_model('finanzas', 'PagoAmortizacion')
+    PagoAmortizacion.objects.filter(pagado=True, transaccion_pago__isnull=True).update(capital_abonado=F('capital'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finanzas', '0025_ejecucionprogramada_llamadas_ahorradas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pagoamortizacion',
+            name='capital_abonado',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(marcar_cuotas_abonadas, migrations.RunPython.noop),
+    ]
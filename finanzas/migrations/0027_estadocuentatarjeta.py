@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finanzas', '0026_pagoamortizacion_capital_abonado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadoCuentaTarjeta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_inicio', models.DateField()),
+                ('fecha_corte', models.DateField()),
+                ('fecha_pago', models.DateField(blank=True, null=True)),
+                ('cargos', models.DecimalField(decimal_places=3, default=0, max_digits=20)),
+                ('pagos', models.DecimalField(decimal_places=3, default=0, max_digits=20)),
+                ('movimientos', models.IntegerField(default=0)),
+                ('deuda', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estados_cuenta', to='finanzas.deuda')),
+            ],
+            options={
+                'ordering': ['-fecha_corte'],
+                'unique_together': {('deuda', 'fecha_corte')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finanzas', '0027_estadocuentatarjeta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoMensualCuenta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField(help_text='Primer día del mes')),
+                ('movimiento_neto', models.DecimalField(decimal_places=3, default=0, max_digits=20)),
+                ('saldo_cierre', models.DecimalField(decimal_places=3, default=0, max_digits=20)),
+                ('movimientos', models.IntegerField(default=0)),
+                ('cuenta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_mensuales', to='finanzas.cuenta')),
+            ],
+            options={
+                'ordering': ['mes'],
+                'unique_together': {('cuenta', 'mes')},
+            },
+        ),
+    ]
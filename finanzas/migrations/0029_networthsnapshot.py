@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finanzas', '0028_saldomensualcuenta'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NetWorthSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('cuentas', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('inversiones', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('deudas', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('patrimonio', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['fecha'],
+                'unique_together': {('usuario', 'fecha')},
+            },
+        ),
+    ]
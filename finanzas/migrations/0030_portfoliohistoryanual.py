@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finanzas', '0029_networthsnapshot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioHistoryAnual',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('anio', models.PositiveSmallIntegerField()),
+                ('primera_fecha', models.DateField()),
+                ('ultima_fecha', models.DateField()),
+                ('dias', models.PositiveSmallIntegerField()),
+                ('datos', models.BinaryField()),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['anio'],
+                'unique_together': {('usuario', 'anio')},
+            },
+        ),
+    ]
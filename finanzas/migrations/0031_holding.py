@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:30
+
+import django.db.models.deletion
+from django.conf import settings
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def crear_posiciones(apps, schema_editor):
+    # Las posiciones de los lotes que ya existen (lo mismo que HoldingManager.reconstruir).
+    inversiones = apps.get_model('finanzas', 'inversiones')
+    Holding = apps.get_model('finanzas', 'Holding')
+    posiciones = {}
+    for lote in inversiones.objects.order_by('fecha_compra').iterator():
+        clave = (lote.emisora_ticker or '').upper() or lote.nombre_activo
+        p = posiciones.get((lote.propietario_id, clave, lote.tipo_inversion))
+        if p is None:
+            p = posiciones[(lote.propietario_id, clave, lote.tipo_inversion)] = Holding(
+                propietario_id=lote.propietario_id, clave=clave, tipo_inversion=lote.tipo_inversion,
+                nombre_activo=lote.nombre_activo, cantidad_titulos=Decimal('0'), costo_total_adquisicion=Decimal('0'),
+                valor_actual_mercado=Decimal('0'), lotes=0, primera_compra=lote.fecha_compra,
+            )
+        if lote.emisora_ticker:
+            p.emisora_ticker = clave
+        p.nombre_activo = max(p.nombre_activo, lote.nombre_activo)
+        p.cantidad_titulos += lote.cantidad_titulos
+        p.costo_total_adquisicion += lote.costo_total_adquisicion
+        p.valor_actual_mercado += lote.valor_actual_mercado
+        p.lotes += 1
+    for p in posiciones.values():
+        p.precio_promedio = p.costo_total_adquisicion / p.cantidad_titulos if p.cantidad_titulos else Decimal('0')
+        p.precio_actual_titulo = p.valor_actual_mercado / p.cantidad_titulos if p.cantidad_titulos else Decimal('0')
+        p.ganancia_perdida_no_realizada = p.valor_actual_mercado - p.costo_total_adquisicion
+    Holding.objects.bulk_create(posiciones.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finanzas', '0030_portfoliohistoryanual'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Holding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=100)),
+                ('tipo_inversion', models.CharField(choices=[('ACCION', 'Acción'), ('CRIPTO', 'Criptomoneda'), ('FONDO', 'Fondo de Inversión'), ('BONOS', 'Bonos'), ('FIBRAS', 'Fibras'), ('BIENES_RAICES', 'Bienes Raíces')], max_length=30)),
+                ('emisora_ticker', models.CharField(blank=True, db_index=True, max_length=10, null=True)),
+                ('nombre_activo', models.CharField(max_length=100)),
+                ('cantidad_titulos', models.DecimalField(decimal_places=10, max_digits=19)),
+                ('costo_total_adquisicion', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('precio_promedio', models.DecimalField(decimal_places=10, max_digits=19)),
+                ('precio_actual_titulo', models.DecimalField(decimal_places=10, max_digits=19)),
+                ('valor_actual_mercado', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('ganancia_perdida_no_realizada', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('lotes', models.PositiveIntegerField(default=0)),
+                ('primera_compra', models.DateField()),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('propietario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-valor_actual_mercado'],
+                'unique_together': {('propietario', 'clave', 'tipo_inversion')},
+            },
+        ),
+        migrations.RunPython(crear_posiciones, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finanzas', '0031_holding'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VentaInversion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo_inversion', models.CharField(choices=[('ACCION', 'Acción'), ('CRIPTO', 'Criptomoneda'), ('FONDO', 'Fondo de Inversión'), ('BONOS', 'Bonos'), ('FIBRAS', 'Fibras'), ('BIENES_RAICES', 'Bienes Raíces')], default='ACCION', max_length=30)),
+                ('emisora_ticker', models.CharField(blank=True, max_length=10, null=True)),
+                ('nombre_activo', models.CharField(max_length=100)),
+                ('fecha_venta', models.DateField()),
+                ('cantidad_titulos', models.DecimalField(decimal_places=10, max_digits=19)),
+                ('precio_venta_titulo', models.DecimalField(decimal_places=10, max_digits=19)),
+                ('comision', models.DecimalField(decimal_places=10, default=0, max_digits=20)),
+                ('ingreso_neto', models.DecimalField(decimal_places=10, default=0, max_digits=20)),
+                ('costo_base', models.DecimalField(decimal_places=10, default=0, max_digits=20)),
+                ('ganancia_realizada', models.DecimalField(decimal_places=10, default=0, max_digits=20)),
+                ('metodo', models.CharField(choices=[('FIFO', 'Primeras entradas, primeras salidas'), ('LIFO', 'Últimas entradas, primeras salidas'), ('PROMEDIO', 'Costo promedio')], default='FIFO', max_length=10)),
+                ('detalle', models.JSONField(blank=True, default=list)),
+                ('propietario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['fecha_venta', 'id'],
+                'indexes': [models.Index(fields=['propietario', 'fecha_venta'], name='finanzas_ve_propiet_7e69a9_idx')],
+            },
+        ),
+    ]
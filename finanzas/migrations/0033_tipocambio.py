@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finanzas', '0032_ventainversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TipoCambio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(unique=True)),
+                ('usd_mxn', models.DecimalField(decimal_places=6, max_digits=12)),
+                ('arrastrado', models.BooleanField(default=False)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['fecha'],
+            },
+        ),
+    ]
@@ -1,8 +1,17 @@
-from django.db import models
+import sys
+import zlib
+from array import array
+from datetime import date, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import accumulate
+
+from django.db import models, transaction
 from django.db.models import F
 from django.conf import settings
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.contrib.auth.models import User
+from .utils import proxima_fecha_con_dia
 
 
 class registro_transacciones(models.Model):
@@ -45,59 +54,47 @@ class registro_transacciones(models.Model):
     def __str__(self):
         return f"{self.id} - {self.descripcion}"
 
+    def _referencias(self):
+        """Cuentas y deudas del propietario por nombre (memo de la petición/tarea)."""
+        from .services.reference_data_service import ReferenceDataService
+        return ReferenceDataService.de_usuario(self.propietario_id)
+
     def delete(self, *args, **kwargs):
         ya_procesado_transferencia_tc = False
+        refs = self._referencias()
         # BUG1 FIX: reversión del pago a TC vía TRANSFERENCIA
-        if self.tipo == 'TRANSFERENCIA' and self.cuenta_destino:
-            try:
-                deuda_tarjeta = Deuda.objects.get(
-                    propietario=self.propietario,
-                    nombre=self.cuenta_destino,
-                    tipo_deuda='TARJETA_CREDITO'
-                )
-                deuda_tarjeta.saldo_pendiente -= self.monto
-                deuda_tarjeta.save()
-                ya_procesado_transferencia_tc = True
-            except Deuda.DoesNotExist:
-                pass
+        deuda_tarjeta = refs.tarjeta(self.cuenta_destino) if self.tipo == 'TRANSFERENCIA' and self.cuenta_destino else None
+        if deuda_tarjeta:
+            deuda_tarjeta.mover_saldo(-self.monto)
+            ya_procesado_transferencia_tc = True
 
         # 1. Revertimos el saldo si afectó a la cuenta de tarjeta de crédito (por su nombre)
-        if self.tipo == 'GASTO':
-            try:
-                deuda_tarjeta = Deuda.objects.get(
-                    propietario=self.propietario,
-                    nombre=self.cuenta_origen,
-                    tipo_deuda='TARJETA_CREDITO'
-                )
-                if not (self.deuda_asociada == deuda_tarjeta and self.tipo_pago == 'TARJETA_CREDITO'):
-                    deuda_tarjeta.saldo_pendiente = (deuda_tarjeta.saldo_pendiente or 0) + self.monto
-                    deuda_tarjeta.save()
-            except Deuda.DoesNotExist:
-                pass
+        deuda_tarjeta = refs.tarjeta(self.cuenta_origen) if self.tipo == 'GASTO' else None
+        if deuda_tarjeta:
+            if not (self.deuda_asociada_id == deuda_tarjeta.id and self.tipo_pago == 'TARJETA_CREDITO'):
+                deuda_tarjeta.mover_saldo(self.monto)
 
         # 2. Revertimos el saldo si la transacción estaba explícitamente asociada a una deuda
         if self.deuda_asociada:
             deuda = self.deuda_asociada
             if self.tipo_pago == 'TARJETA_CREDITO':
-                deuda.saldo_pendiente = (deuda.saldo_pendiente or 0) + self.monto
-                deuda.save()
+                deuda.mover_saldo(self.monto)
             elif self.tipo_pago == 'CAPITAL':
-                deuda.saldo_pendiente = (deuda.saldo_pendiente or 0) + self.monto
-                deuda.save()
+                deuda.mover_saldo(self.monto)
+                PagoAmortizacion.objects.revertir_abono_capital(deuda, self.monto)
             elif deuda.tipo_deuda == 'TARJETA_CREDITO' and not ya_procesado_transferencia_tc:
-                deuda.saldo_pendiente = (deuda.saldo_pendiente or 0) + self.monto
-                deuda.save()
+                deuda.mover_saldo(self.monto)
             elif deuda.tipo_deuda == 'PRESTAMO' and self.tipo_pago == 'MENSUALIDAD':
                 cuota_pagada = PagoAmortizacion.objects.filter(transaccion_pago=self).first()
                 if cuota_pagada:
                     cuota_pagada.pagado = False
                     cuota_pagada.transaccion_pago = None
                     cuota_pagada.save()
-                    # Revertimos restando usando la función F importada
-                    # O simplemente sumando el capital
-                    deuda.saldo_pendiente = F('saldo_pendiente') + cuota_pagada.capital
-                    deuda.save()
-        
+                    # Lo abonado a capital antes de la mensualidad ya se había descontado del saldo
+                    deuda.mover_saldo(cuota_pagada.capital - cuota_pagada.capital_abonado)
+
+        EstadoCuentaTarjeta.objects.aplicar_transaccion(self, signo=-1)
+        SaldoMensualCuenta.objects.aplicar_transaccion(self, signo=-1)
         super().delete(*args, **kwargs)
 
     # Tu método save que modificamos anteriormente va aquí...
@@ -105,50 +102,36 @@ class registro_transacciones(models.Model):
         is_new = self.pk is None
         ya_restado_por_nombre = False
         ya_procesado_transferencia_tc = False
+        refs = self._referencias()
 
         # Mapeo de los nuevos tipos de pago a la lógica interna (deuda_asociada y tipo_pago)
-        if self.tipo in ['PAGO_MENSUALIDAD', 'PAGO_CAPITAL'] and self.cuenta_destino:
-            try:
-                self.deuda_asociada = Deuda.objects.get(
-                    propietario=self.propietario,
-                    nombre=self.cuenta_destino
-                )
-                self.tipo_pago = 'MENSUALIDAD' if self.tipo == 'PAGO_MENSUALIDAD' else 'CAPITAL'
-            except Deuda.DoesNotExist:
-                pass
-                
+        deuda_pagada = refs.deuda(self.cuenta_destino) if self.tipo in ['PAGO_MENSUALIDAD', 'PAGO_CAPITAL'] else None
+        if deuda_pagada:
+            self.deuda_asociada = deuda_pagada
+            self.tipo_pago = 'MENSUALIDAD' if self.tipo == 'PAGO_MENSUALIDAD' else 'CAPITAL'
+
+        # Si se edita, la versión anterior sale de su estado de cuenta y de los saldos antes de aplicar la nueva.
+        anterior = None if is_new else registro_transacciones.objects.filter(pk=self.pk).first()
         super().save(*args, **kwargs)
+        if anterior:
+            EstadoCuentaTarjeta.objects.aplicar_transaccion(anterior, signo=-1)
+            SaldoMensualCuenta.objects.aplicar_transaccion(anterior, signo=-1)
+        EstadoCuentaTarjeta.objects.aplicar_transaccion(self)
+        SaldoMensualCuenta.objects.aplicar_transaccion(self)
 
         # BUG1 FIX: pago a TC vía TRANSFERENCIA restaura el saldo disponible de la tarjeta
-        if is_new and self.tipo == 'TRANSFERENCIA' and self.cuenta_destino:
-            try:
-                deuda_tarjeta = Deuda.objects.get(
-                    propietario=self.propietario,
-                    nombre=self.cuenta_destino,
-                    tipo_deuda='TARJETA_CREDITO'
-                )
-                deuda_tarjeta.saldo_pendiente += self.monto
-                deuda_tarjeta.save()
-                ya_procesado_transferencia_tc = True
-            except Deuda.DoesNotExist:
-                pass
+        deuda_tarjeta = refs.tarjeta(self.cuenta_destino) if is_new and self.tipo == 'TRANSFERENCIA' and self.cuenta_destino else None
+        if deuda_tarjeta:
+            deuda_tarjeta.mover_saldo(self.monto)
+            ya_procesado_transferencia_tc = True
 
         # Si la transacción es un GASTO nuevo y su cuenta origen es una tarjeta de crédito en Deudas
-        if is_new and self.tipo == 'GASTO':
-            try:
-                # Buscamos la Deuda tipo Tarjeta de Crédito con el mismo nombre que la cuenta origen
-                deuda_tarjeta = Deuda.objects.get(
-                    propietario=self.propietario,
-                    nombre=self.cuenta_origen,
-                    tipo_deuda='TARJETA_CREDITO'
-                )
-                # Evitamos restar 2 veces si ya estuviera manejado por deuda_asociada (precaución)
-                if not (self.deuda_asociada == deuda_tarjeta and self.tipo_pago == 'TARJETA_CREDITO'):
-                    deuda_tarjeta.saldo_pendiente -= self.monto
-                    deuda_tarjeta.save()
-                    ya_restado_por_nombre = True
-            except Deuda.DoesNotExist:
-                pass
+        deuda_tarjeta = refs.tarjeta(self.cuenta_origen) if is_new and self.tipo == 'GASTO' else None
+        if deuda_tarjeta:
+            # Evitamos restar 2 veces si ya estuviera manejado por deuda_asociada (precaución)
+            if not (self.deuda_asociada_id == deuda_tarjeta.id and self.tipo_pago == 'TARJETA_CREDITO'):
+                deuda_tarjeta.mover_saldo(-self.monto)
+                ya_restado_por_nombre = True
 
         if self.deuda_asociada:
             deuda = self.deuda_asociada
@@ -157,38 +140,18 @@ class registro_transacciones(models.Model):
             if self.tipo_pago == 'TARJETA_CREDITO':
                 # Si es una compra, RESTATAMOS al saldo disponible (o aumentamos la deuda si se viera así)
                 # Dado el requerimiento: "se haga la resta... se actualice el saldo", asumimos que reduce el 'Disponible'.
-                deuda.saldo_pendiente -= self.monto
-                deuda.save()
+                deuda.mover_saldo(-self.monto)
 
             elif self.tipo_pago == 'CAPITAL':
-                deuda.saldo_pendiente -= self.monto
-                deuda.save()
-
-                monto_pago_capital = self.monto
-                # --- ¡AQUÍ ESTÁ LA CORRECCIÓN CLAVE! ---
-                # Ordenamos de la primera a la última para pagar las cuotas en orden.
-                cuotas_pendientes = PagoAmortizacion.objects.filter(
-                    deuda=deuda, pagado=False
-                ).order_by('numero_cuota') # Quitamos el signo '-'
-
-                for cuota in cuotas_pendientes:
-                    if monto_pago_capital <= 0:
-                        break
-                    
-                    # Comparamos con el capital de la cuota
-                    if monto_pago_capital >= cuota.capital:
-                        cuota.pagado = True
-                        cuota.save()
-                        monto_pago_capital -= cuota.capital
-                    else:
-                        # Si el pago no cubre toda la cuota, nos detenemos.
-                        # Una mejora futura podría ser manejar pagos parciales a capital.
-                        break
+                deuda.mover_saldo(-self.monto)
+
+                # Reparto en memoria y un UPDATE por rango de cuotas; la cuota que no alcance a
+                # cubrirse completa queda con su abono parcial registrado.
+                PagoAmortizacion.objects.aplicar_abono_capital(deuda, self.monto)
 
             elif deuda.tipo_deuda == 'TARJETA_CREDITO' and not ya_restado_por_nombre and not ya_procesado_transferencia_tc:
                 # Esta lógica sigue igual
-                deuda.saldo_pendiente -= self.monto
-                deuda.save()
+                deuda.mover_saldo(-self.monto)
 
             elif deuda.tipo_deuda == 'PRESTAMO' and self.tipo_pago == 'MENSUALIDAD':
                 # Esta lógica sigue igual
@@ -197,8 +160,7 @@ class registro_transacciones(models.Model):
                     cuota_a_pagar.pagado = True
                     cuota_a_pagar.transaccion_pago = self
                     cuota_a_pagar.save()
-                    deuda.saldo_pendiente = F('saldo_pendiente') - cuota_a_pagar.capital
-                    deuda.save()
+                    deuda.mover_saldo(-(cuota_a_pagar.capital - cuota_a_pagar.capital_abonado))
  
 class GoogleCredentials(models.Model):
     # Un enlace uno-a-uno con el usuario de Django. Cada usuario solo puede tener un set de credenciales.
@@ -290,7 +252,109 @@ class inversiones(models.Model):
         self.costo_total_adquisicion = self.cantidad_titulos * self.precio_compra_titulo
         self.valor_actual_mercado = self.cantidad_titulos * self.precio_actual_titulo
         self.ganancia_perdida_no_realizada = self.valor_actual_mercado - self.costo_total_adquisicion
-        super().save(*args, **kwargs)
+        # Si se edita y cambia de activo, la posición anterior también se recalcula.
+        anterior = None if self.pk is None else inversiones.objects.filter(pk=self.pk).only(
+            'propietario_id', 'emisora_ticker', 'nombre_activo', 'tipo_inversion').first()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Holding.objects.aplicar_lote(self, anterior)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            resultado = super().delete(*args, **kwargs)
+            Holding.objects.aplicar_lote(self)
+        return resultado
+
+class Holding(models.Model):
+    """
+    Posición agregada de un activo: la suma de los lotes (inversiones) del usuario con el
+    mismo ticker (o nombre, si no tiene ticker) y tipo de inversión. La mantiene
+    HoldingManager al guardar o borrar un lote y al actualizar precios; no se edita a mano.
+    """
+    propietario = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Ticker en mayúsculas o, si los lotes no tienen, el nombre del activo.
+    clave = models.CharField(max_length=100)
+    tipo_inversion = models.CharField(max_length=30, choices=inversiones.TIPO_INVERSION_CHOICES)
+    emisora_ticker = models.CharField(max_length=10, blank=True, null=True, db_index=True)
+    nombre_activo = models.CharField(max_length=100)
+
+    cantidad_titulos = models.DecimalField(max_digits=19, decimal_places=10)
+    costo_total_adquisicion = models.DecimalField(max_digits=20, decimal_places=10)
+    # Costo promedio ponderado por título
+    precio_promedio = models.DecimalField(max_digits=19, decimal_places=10)
+    precio_actual_titulo = models.DecimalField(max_digits=19, decimal_places=10)
+    valor_actual_mercado = models.DecimalField(max_digits=20, decimal_places=10)
+    ganancia_perdida_no_realizada = models.DecimalField(max_digits=20, decimal_places=10)
+    lotes = models.PositiveIntegerField(default=0)
+    primera_compra = models.DateField()
+    actualizado = models.DateTimeField(auto_now=True)
+
+    from .managers import HoldingManager
+    objects = HoldingManager()
+
+    class Meta:
+        unique_together = ['propietario', 'clave', 'tipo_inversion']
+        ordering = ['-valor_actual_mercado']
+
+    def __str__(self):
+        return f"{self.propietario_id} - {self.clave} ({self.tipo_inversion}): {self.cantidad_titulos}"
+
+    @property
+    def porcentaje_rendimiento(self):
+        if self.costo_total_adquisicion and self.costo_total_adquisicion > 0:
+            return (self.ganancia_perdida_no_realizada / self.costo_total_adquisicion) * 100
+        return 0
+
+class VentaInversion(models.Model):
+    """
+    Venta (total o parcial) de un activo. El costo base y la ganancia realizada no se
+    capturan: los calcula LotMatchingService al emparejarla con los lotes comprados.
+    """
+    METODOS = (
+        ('FIFO', 'Primeras entradas, primeras salidas'),
+        ('LIFO', 'Últimas entradas, primeras salidas'),
+        ('PROMEDIO', 'Costo promedio'),
+    )
+
+    propietario = models.ForeignKey(User, on_delete=models.CASCADE)
+    tipo_inversion = models.CharField(max_length=30, choices=inversiones.TIPO_INVERSION_CHOICES, default='ACCION')
+    emisora_ticker = models.CharField(max_length=10, blank=True, null=True)
+    nombre_activo = models.CharField(max_length=100)
+    fecha_venta = models.DateField()
+    cantidad_titulos = models.DecimalField(max_digits=19, decimal_places=10)
+    precio_venta_titulo = models.DecimalField(max_digits=19, decimal_places=10)
+    comision = models.DecimalField(max_digits=20, decimal_places=10, default=0)
+
+    # Campos calculados
+    ingreso_neto = models.DecimalField(max_digits=20, decimal_places=10, default=0)
+    costo_base = models.DecimalField(max_digits=20, decimal_places=10, default=0)
+    ganancia_realizada = models.DecimalField(max_digits=20, decimal_places=10, default=0)
+    metodo = models.CharField(max_length=10, choices=METODOS, default='FIFO')
+    # Lotes consumidos: [{'lote': id, 'cantidad': '...', 'costo': '...'}]
+    detalle = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        ordering = ['fecha_venta', 'id']
+        indexes = [models.Index(fields=['propietario', 'fecha_venta'])]
+
+    def __str__(self):
+        return f"Venta de {self.cantidad_titulos} {self.emisora_ticker or self.nombre_activo} ({self.fecha_venta})"
+
+    def save(self, *args, **kwargs):
+        self.ingreso_neto = self.cantidad_titulos * self.precio_venta_titulo - self.comision
+        anterior = None if self.pk is None else VentaInversion.objects.filter(pk=self.pk).only(
+            'propietario_id', 'emisora_ticker', 'nombre_activo', 'tipo_inversion').first()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Holding.objects.aplicar_lote(self, anterior)
+        # El emparejamiento escribe con bulk_update: se trae lo calculado a esta instancia.
+        self.refresh_from_db(fields=['costo_base', 'ganancia_realizada', 'metodo', 'detalle'])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            resultado = super().delete(*args, **kwargs)
+            Holding.objects.aplicar_lote(self)
+        return resultado
 
 class Suscripcion(models.Model):
     """
@@ -309,6 +373,20 @@ class Suscripcion(models.Model):
     fecha_fin = models.DateTimeField(null=True, blank=True)
     id_suscripcion_mercadopago = models.CharField(max_length=100, blank=True, null=True)
 
+    from .managers import SuscripcionManager
+    objects = SuscripcionManager()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # El estado premium cacheado (webhook, admin, etc.) deja de ser válido.
+        Suscripcion.objects.invalidar_premium(self.usuario_id)
+
+    def delete(self, *args, **kwargs):
+        usuario_id = self.usuario_id
+        resultado = super().delete(*args, **kwargs)
+        Suscripcion.objects.invalidar_premium(usuario_id)
+        return resultado
+
     def is_active(self):
         """
         Verifica si la suscripción está activa.
@@ -406,54 +484,42 @@ class Deuda(models.Model):
         if not self.pk:
             self.saldo_pendiente = self.monto_total
         super().save(*args, **kwargs)
+        self._invalidar_referencias()
+
+    def delete(self, *args, **kwargs):
+        resultado = super().delete(*args, **kwargs)
+        self._invalidar_referencias()
+        return resultado
+
+    def _invalidar_referencias(self):
+        from .services.reference_data_service import ReferenceDataService
+        ReferenceDataService.invalidar(self.propietario_id)
+
+    def mover_saldo(self, delta):
+        """
+        Suma delta a saldo_pendiente con un UPDATE atómico: no depende del valor en memoria,
+        que puede venir del memo de referencias o de otro worker.
+        """
+        Deuda.objects.filter(pk=self.pk).update(saldo_pendiente=F('saldo_pendiente') + delta)
+        if not hasattr(self.saldo_pendiente, 'resolve_expression'):
+            self.saldo_pendiente = (self.saldo_pendiente or 0) + delta
+        self._invalidar_referencias()
 
     @property
     def total_gastado(self):
         return (self.monto_total or 0) - (self.saldo_pendiente or 0)
 
-    @property
+    @cached_property
     def proxima_fecha_corte(self):
         if not self.dia_corte:
             return None
-        import calendar
-        from datetime import timedelta
-        hoy = timezone.now().date()
-        try:
-            fecha_este_mes = hoy.replace(day=self.dia_corte)
-        except ValueError:
-            _, last_day = calendar.monthrange(hoy.year, hoy.month)
-            fecha_este_mes = hoy.replace(day=last_day)
-            
-        if fecha_este_mes < hoy:
-            mes_siguiente = (fecha_este_mes.replace(day=1) + timedelta(days=32)).replace(day=1)
-            try:
-                return mes_siguiente.replace(day=self.dia_corte)
-            except ValueError:
-                _, last_day = calendar.monthrange(mes_siguiente.year, mes_siguiente.month)
-                return mes_siguiente.replace(day=last_day)
-        return fecha_este_mes
+        return proxima_fecha_con_dia(timezone.now().date(), self.dia_corte)
 
-    @property
+    @cached_property
     def proxima_fecha_pago(self):
         if not self.dia_pago:
             return None
-        import calendar
-        from datetime import timedelta
-        hoy = timezone.now().date()
-        try:
-            fecha_este_mes = hoy.replace(day=self.dia_pago)
-        except ValueError:
-            _, last_day = calendar.monthrange(hoy.year, hoy.month)
-            fecha_este_mes = hoy.replace(day=last_day)
-            
-        if fecha_este_mes < hoy:
-            mes_siguiente = (fecha_este_mes.replace(day=1) + timedelta(days=32)).replace(day=1)
-            try:
-                return mes_siguiente.replace(day=self.dia_pago)
-            except ValueError:
-                _, last_day = calendar.monthrange(mes_siguiente.year, mes_siguiente.month)
-                return mes_siguiente.replace(day=last_day)
-        return fecha_este_mes
+        return proxima_fecha_con_dia(timezone.now().date(), self.dia_pago)
 
 class PagoAmortizacion(models.Model):
     deuda = models.ForeignKey(Deuda, on_delete=models.CASCADE, related_name='amortizacion')
@@ -466,6 +532,11 @@ class PagoAmortizacion(models.Model):
     pago_total = models.DecimalField(max_digits=10, decimal_places=2, help_text="Suma de capital + interés + IVA")
     pagado = models.BooleanField(default=False)
     transaccion_pago = models.OneToOneField(registro_transacciones, on_delete=models.SET_NULL, null=True, blank=True)
+    # Capital ya cubierto por pagos a capital (igual a 'capital' si la cuota quedó liquidada por abonos)
+    capital_abonado = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    from .managers import AmortizacionManager
+    objects = AmortizacionManager()
 
     class Meta:
         ordering = ['numero_cuota']
@@ -480,6 +551,29 @@ class PagoAmortizacion(models.Model):
     def __str__(self):
         return f"Cuota {self.numero_cuota} de {self.deuda.nombre}"
     
+class EstadoCuentaTarjeta(models.Model):
+    """
+    Totales de una tarjeta de crédito por ciclo de facturación (del día siguiente al
+    corte anterior hasta dia_corte). Se actualiza con cada compra y pago registrados.
+    """
+    deuda = models.ForeignKey(Deuda, on_delete=models.CASCADE, related_name='estados_cuenta')
+    fecha_inicio = models.DateField()
+    fecha_corte = models.DateField()
+    fecha_pago = models.DateField(null=True, blank=True)
+    cargos = models.DecimalField(max_digits=20, decimal_places=3, default=0)
+    pagos = models.DecimalField(max_digits=20, decimal_places=3, default=0)
+    movimientos = models.IntegerField(default=0)
+
+    from .managers import EstadoCuentaManager
+    objects = EstadoCuentaManager()
+
+    class Meta:
+        unique_together = ['deuda', 'fecha_corte']
+        ordering = ['-fecha_corte']
+
+    def __str__(self):
+        return f"{self.deuda.nombre} - corte {self.fecha_corte}"
+
 class AmortizacionPendiente(models.Model):
     """
     Almacena una tabla de amortización completa extraída por la IA,
@@ -608,6 +702,10 @@ class PortfolioHistory(models.Model):
     
     # Ganancia no realizada (valor_total - capital_invertido)
     ganancia_no_realizada = models.DecimalField(max_digits=20, decimal_places=2)
+
+    # Lee y escribe en el almacenamiento activo (diario o anual); ver PORTFOLIO_HISTORY_STORAGE.
+    from .managers import PortfolioHistoryManager
+    objects = PortfolioHistoryManager()
     
     class Meta:
         unique_together = ['usuario', 'fecha']
@@ -616,6 +714,108 @@ class PortfolioHistory(models.Model):
     def __str__(self):
         return f"{self.usuario.username} - {self.fecha}: ${self.valor_total}"
 
+class PortfolioHistoryAnual(models.Model):
+    """
+    Almacenamiento compacto del PortfolioHistory: un renglón por usuario y año con las
+    tres series en centavos (enteros de 64 bits), codificadas por diferencias y comprimidas
+    con zlib. Un año diario son ~365 renglones en la tabla normal y uno solo aquí.
+    Se lee y escribe a través de PortfolioHistory.objects.
+    """
+    FORMATO = 1
+    COLUMNAS = 4  # día del año, valor_total, capital_invertido, ganancia_no_realizada
+
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE)
+    anio = models.PositiveSmallIntegerField()
+    primera_fecha = models.DateField()
+    ultima_fecha = models.DateField()
+    dias = models.PositiveSmallIntegerField()
+    datos = models.BinaryField()
+
+    class Meta:
+        unique_together = ['usuario', 'anio']
+        ordering = ['anio']
+
+    def __str__(self):
+        return f"{self.usuario_id} - {self.anio}: {self.dias} días"
+
+    @staticmethod
+    def _centavos(valor) -> int:
+        return int((Decimal(valor) * 100).to_integral_value(ROUND_HALF_UP))
+
+    @classmethod
+    def empaquetar(cls, usuario_id, anio: int, filas: list) -> 'PortfolioHistoryAnual':
+        """filas: (fecha, valor_total, capital_invertido, ganancia_no_realizada) del año, en orden."""
+        columnas = [
+            [f.timetuple().tm_yday for f, _, _, _ in filas],
+            [cls._centavos(v) for _, v, _, _ in filas],
+            [cls._centavos(c) for _, _, c, _ in filas],
+            [cls._centavos(g) for _, _, _, g in filas],
+        ]
+        enteros = array('q')
+        for columna in columnas:
+            # Diferencias: días consecutivos y saldos que cambian poco se vuelven enteros chicos.
+            enteros.extend(b - a for a, b in zip([0] + columna, columna))
+        if sys.byteorder == 'big':
+            enteros.byteswap()
+        return cls(
+            usuario_id=usuario_id, anio=anio, primera_fecha=filas[0][0], ultima_fecha=filas[-1][0],
+            dias=len(filas), datos=bytes([cls.FORMATO]) + zlib.compress(enteros.tobytes(), 6),
+        )
+
+    def filas(self, desde=None, hasta=None):
+        """Decodifica el bloque y genera las filas dentro de [desde, hasta] como Decimal."""
+        datos = bytes(self.datos)
+        if datos[0] != self.FORMATO:
+            raise ValueError(f"Formato de PortfolioHistoryAnual desconocido: {datos[0]}")
+        enteros = array('q')
+        enteros.frombytes(zlib.decompress(datos[1:]))
+        if sys.byteorder == 'big':
+            enteros.byteswap()
+        n = self.dias
+        dias, valores, capitales, ganancias = (accumulate(enteros[i * n:(i + 1) * n]) for i in range(self.COLUMNAS))
+        enero = date(self.anio, 1, 1)
+        for dia, v, c, g in zip(dias, valores, capitales, ganancias):
+            fecha = enero + timedelta(days=dia - 1)
+            if (desde is None or fecha >= desde) and (hasta is None or fecha <= hasta):
+                yield fecha, Decimal(v).scaleb(-2), Decimal(c).scaleb(-2), Decimal(g).scaleb(-2)
+
+class NetWorthSnapshot(models.Model):
+    """
+    Patrimonio del usuario al cierre de cada día: cuentas + inversiones - deudas.
+    Lo llena el trabajo nocturno (y backfill_patrimonio hacia atrás) para que la
+    gráfica no tenga que cruzar transacciones, deudas y portafolio al vuelo.
+    """
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE)
+    fecha = models.DateField()
+    cuentas = models.DecimalField(max_digits=20, decimal_places=2)
+    inversiones = models.DecimalField(max_digits=20, decimal_places=2)
+    deudas = models.DecimalField(max_digits=20, decimal_places=2)
+    patrimonio = models.DecimalField(max_digits=20, decimal_places=2)
+
+    class Meta:
+        unique_together = ['usuario', 'fecha']
+        ordering = ['fecha']
+
+    def __str__(self):
+        return f"{self.usuario.username} - {self.fecha}: ${self.patrimonio}"
+
+class TipoCambio(models.Model):
+    """
+    USD/MXN de cada día. Lo llena backfill_tipo_cambio por rangos y ExchangeRateService
+    cuando le piden un día que falta. Los huecos entre dos días con dato del proveedor
+    (fines de semana, feriados) repiten el anterior y quedan marcados como arrastrados.
+    """
+    fecha = models.DateField(unique=True)
+    usd_mxn = models.DecimalField(max_digits=12, decimal_places=6)
+    arrastrado = models.BooleanField(default=False)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['fecha']
+
+    def __str__(self):
+        return f"{self.fecha}: {self.usd_mxn} MXN/USD"
+
 class Cuenta(models.Model):
     TIPO_CUENTA = (
         ('EFECTIVO', 'Efectivo'),
@@ -643,6 +843,37 @@ class Cuenta(models.Model):
             # Desmarcar otras cuentas del mismo propietario como principal
             Cuenta.objects.filter(propietario=self.propietario).exclude(pk=self.pk).update(es_principal=False)
         super().save(*args, **kwargs)
+        self._invalidar_referencias()
+
+    def delete(self, *args, **kwargs):
+        resultado = super().delete(*args, **kwargs)
+        self._invalidar_referencias()
+        return resultado
+
+    def _invalidar_referencias(self):
+        from .services.reference_data_service import ReferenceDataService
+        ReferenceDataService.invalidar(self.propietario_id)
+
+class SaldoMensualCuenta(models.Model):
+    """
+    Cierre de saldo de una Cuenta al final de cada mes con movimientos. Se mantiene con
+    cada transacción; reconstruir_saldos_cuentas lo verifica contra registro_transacciones.
+    """
+    cuenta = models.ForeignKey(Cuenta, on_delete=models.CASCADE, related_name='saldos_mensuales')
+    mes = models.DateField(help_text="Primer día del mes")
+    movimiento_neto = models.DecimalField(max_digits=20, decimal_places=3, default=0)
+    saldo_cierre = models.DecimalField(max_digits=20, decimal_places=3, default=0)
+    movimientos = models.IntegerField(default=0)
+
+    from .managers import SaldoCuentaManager
+    objects = SaldoCuentaManager()
+
+    class Meta:
+        unique_together = ['cuenta', 'mes']
+        ordering = ['mes']
+
+    def __str__(self):
+        return f"{self.cuenta.nombre} - {self.mes:%Y-%m}: {self.saldo_cierre}"
 
 class Presupuesto(models.Model):
     propietario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='presupuestos')
@@ -675,4 +906,33 @@ class HistorialReciboServicio(models.Model):
     fecha_creacion = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Recibo de {self.presupuesto.categoria} - {self.fecha_emision} - ${self.monto_total}"
\ No newline at end of file
+        return f"Recibo de {self.presupuesto.categoria} - {self.fecha_emision} - ${self.monto_total}"
+
+
+class EjecucionProgramada(models.Model):
+    """
+    Resumen de cada corrida de un trabajo programado (Celery beat):
+    cuánto tardó, a cuántos usuarios tocó y cuántas llamadas hizo a APIs externas.
+    """
+    ESTADOS = (
+        ('en_curso', 'En curso'),
+        ('completada', 'Completada'),
+        ('con_errores', 'Completada con errores'),
+    )
+    trabajo = models.CharField(max_length=50)
+    estado = models.CharField(max_length=15, choices=ESTADOS, default='en_curso')
+    inicio = models.DateTimeField(auto_now_add=True)
+    fin = models.DateTimeField(null=True, blank=True)
+    duracion_segundos = models.FloatField(null=True, blank=True)
+    unidades_totales = models.PositiveIntegerField(default=0)
+    usuarios_procesados = models.PositiveIntegerField(default=0)
+    llamadas_api = models.PositiveIntegerField(default=0)
+    # Llamadas que se habrían hecho calculando usuario por usuario (p. ej. series compartidas entre usuarios).
+    llamadas_ahorradas = models.PositiveIntegerField(default=0)
+    errores = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-inicio']
+
+    def __str__(self):
+        return f"{self.trabajo} - {self.inicio:%Y-%m-%d %H:%M} ({self.get_estado_display()})"
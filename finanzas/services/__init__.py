@@ -1,11 +1,24 @@
 # finanzas/services/__init__.py
 # Facade exporting all services
+# Los workers web importan este facade (vía tasks); los SDK pesados (IA, OCR, Google,
+# Mercado Pago, numpy) se importan dentro de los servicios que los usan, no a nivel de módulo.
 
 from .ai_service import GeminiService, get_gemini_service, MistralOCRService
 from .market_data_service import StockPriceService, ExchangeRateService
 from .finance_service import TransactionService, InvestmentService
 from .billing_service import BillingService
 from .integration_service import GoogleDriveService, MercadoPagoService, RISCService
+from .scheduler_service import ProviderScheduler, ProviderThrottled, get_provider_scheduler
+from .progress_service import ScanProgress
+from .admission_service import FairAdmissionQueue
+from .debt_simulation_service import DebtPayoffSimulator
+from .net_worth_service import NetWorthService
+from .card_metrics_service import CardMetricsService
+from .reference_data_service import ReferenceDataService
+from .data_version_service import DataVersionService
+from .portfolio_series_service import PortfolioSeriesService
+from .lot_matching_service import LotMatchingService
+from .portfolio_metrics_service import PortfolioMetricsService
 
 __all__ = [
     "GeminiService",
@@ -18,5 +31,18 @@ __all__ = [
     "BillingService",
     "GoogleDriveService",
     "MercadoPagoService",
-    "RISCService"
+    "RISCService",
+    "ProviderScheduler",
+    "ProviderThrottled",
+    "get_provider_scheduler",
+    "ScanProgress",
+    "FairAdmissionQueue",
+    "DebtPayoffSimulator",
+    "NetWorthService",
+    "CardMetricsService",
+    "ReferenceDataService",
+    "DataVersionService",
+    "PortfolioSeriesService",
+    "LotMatchingService",
+    "PortfolioMetricsService",
 ]
@@ -0,0 +1,126 @@
+# finanzas/services/admission_service.py
+import time
+import logging
+from django.conf import settings
+from ..utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Subtareas de extracción admitidas a la vez en la cola bulk_extraction (todos los usuarios).
+DEFAULT_MAX_INFLIGHT = 8
+# Tope de ejecución de cada subtarea de extracción (time_limit de Celery).
+EXTRACTION_TIME_LIMIT_SECONDS = 300
+# Cada cupo es una concesión por task_id con vencimiento (ZSET task_id -> vence): si un
+# worker muere antes de task_postrun, ese cupo vuelve poco después del time_limit aunque
+# sigan admitiéndose otras subtareas. Cada corrida (también los reintentos) la renueva.
+INFLIGHT_TTL_SECONDS = EXTRACTION_TIME_LIMIT_SECONDS + 60
+
+_ENQUEUE_LUA = """
+local was_empty = redis.call('LLEN', KEYS[2]) == 0
+for i = 2, #ARGV do redis.call('RPUSH', KEYS[2], ARGV[i]) end
+if was_empty then redis.call('RPUSH', KEYS[1], ARGV[1]) end
+return redis.call('LLEN', KEYS[2])
+"""
+
+# Round-robin: cada vuelta saca UNA subtarea por usuario activo hasta agotar el cupo.
+# Un usuario está en la lista de activos si y solo si su cola tiene elementos.
+# Cada elemento es "scan_id\ntask_id\npayload": el cupo se concede a ese task_id.
+_ADMIT_LUA = """
+local now = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+local budget = tonumber(ARGV[1]) - redis.call('ZCARD', KEYS[2])
+local admitted = {}
+while budget > 0 do
+    local uid = redis.call('LPOP', KEYS[1])
+    if not uid then break end
+    local queue = ARGV[2] .. uid
+    local item = redis.call('LPOP', queue)
+    if item then
+        local a = string.find(item, '\\n', 1, true)
+        local b = string.find(item, '\\n', a + 1, true)
+        redis.call('ZADD', KEYS[2], now + tonumber(ARGV[4]), string.sub(item, a + 1, b - 1))
+        table.insert(admitted, string.sub(item, b + 1))
+        budget = budget - 1
+    end
+    if redis.call('LLEN', queue) > 0 then redis.call('RPUSH', KEYS[1], uid) end
+end
+if #admitted > 0 then redis.call('EXPIRE', KEYS[2], ARGV[4]) end
+return admitted
+"""
+
+# Quita de la cola del usuario solo las subtareas del escaneo cancelado. Si la cola queda
+# vacía el usuario sale de los activos en el mismo paso: si quedara en la lista, el
+# siguiente enqueue lo volvería a meter y tendría dos turnos por vuelta.
+_DISCARD_LUA = """
+local prefijo = ARGV[2] .. '\\n'
+local quedan, quitados = {}, 0
+for _, item in ipairs(redis.call('LRANGE', KEYS[2], 0, -1)) do
+    if string.sub(item, 1, #prefijo) == prefijo then
+        quitados = quitados + 1
+    else
+        table.insert(quedan, item)
+    end
+end
+if quitados > 0 then
+    redis.call('DEL', KEYS[2])
+    for _, item in ipairs(quedan) do redis.call('RPUSH', KEYS[2], item) end
+end
+if #quedan == 0 then redis.call('LREM', KEYS[1], 0, ARGV[1]) end
+return quitados
+"""
+
+
+class FairAdmissionQueue:
+    """
+    Admisión justa de subtareas de extracción. Los escaneos no mandan su grupo
+    completo al broker: encolan sus subtareas por usuario y se despachan
+    en round-robin con un cupo global, así un escaneo de 1,000 recibos no deja
+    esperando al que solo subió 3.
+    """
+    active_key = "fairq:active"
+    # ZSET de concesiones (antes un contador; otro nombre para no chocar con el tipo viejo).
+    inflight_key = "fairq:leases"
+    user_prefix = "fairq:user:"
+
+    def __init__(self, client=None):
+        self.client = client or get_redis_client()
+        self.max_inflight = int(getattr(settings, "EXTRACTION_MAX_INFLIGHT", DEFAULT_MAX_INFLIGHT))
+
+    def enqueue(self, user_id: int, scan_id: str, items: list[tuple[str, str]]) -> int:
+        """Encola subtareas (task_id, firma serializada) de un escaneo. Devuelve la cola pendiente del usuario."""
+        if not items:
+            return 0
+        return self.client.eval(_ENQUEUE_LUA, 2, self.active_key, f"{self.user_prefix}{user_id}", user_id,
+                                *(f"{scan_id}\n{task_id}\n{payload}" for task_id, payload in items))
+
+    def admit(self) -> list[str]:
+        """Saca las subtareas que caben en el cupo libre, alternando entre usuarios."""
+        admitted = self.client.eval(_ADMIT_LUA, 2, self.active_key, self.inflight_key,
+                                    self.max_inflight, self.user_prefix, time.time(), INFLIGHT_TTL_SECONDS)
+        return [item.decode() if isinstance(item, bytes) else item for item in admitted]
+
+    def renew(self, task_id: str):
+        """Al arrancar una subtarea admitida (o su reintento) su concesión vuelve a correr completa."""
+        try:
+            self.client.zadd(self.inflight_key, {task_id: time.time() + INFLIGHT_TTL_SECONDS})
+        except Exception as e:
+            logger.warning(f"No se pudo renovar cupo de extracción: {e}")
+
+    def release(self, task_id: str):
+        """Devuelve el cupo de la subtarea; liberar dos veces o uno ya vencido no hace nada."""
+        try:
+            self.client.zrem(self.inflight_key, task_id)
+        except Exception as e:
+            logger.warning(f"No se pudo liberar cupo de extracción: {e}")
+
+    def discard(self, user_id: int, scan_id: str) -> int:
+        """Descarta las subtareas aún no admitidas de un escaneo cancelado; las de otros escaneos siguen."""
+        return self.client.eval(_DISCARD_LUA, 2, self.active_key, f"{self.user_prefix}{user_id}", user_id, scan_id)
+
+    def stats(self) -> dict:
+        users = [u.decode() for u in self.client.lrange(self.active_key, 0, -1)]
+        return {
+            "inflight": self.client.zcount(self.inflight_key, time.time(), '+inf'),
+            "max_inflight": self.max_inflight,
+            "pending_by_user": {u: self.client.llen(f"{self.user_prefix}{u}") for u in users},
+        }
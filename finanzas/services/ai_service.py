@@ -3,22 +3,25 @@ import os
 import json
 import logging
 import base64
-import numpy as np
-import cv2
 from functools import lru_cache
-import google.generativeai as genai
-from mistralai import Mistral
 from django.conf import settings
 from .prompts import PROMPTS
+from .scheduler_service import ProviderThrottled, get_provider_scheduler
 
 logger = logging.getLogger(__name__)
 
+# Los SDK (google.generativeai, mistralai) y cv2/numpy se importan dentro de los métodos:
+# los workers web cargan este módulo vía el facade pero nunca hacen OCR, y solo esos
+# imports suman más de un segundo y cientos de MB por proceso.
+
 class GeminiService:
     """
     Service for interacting with Google Gemini API.
     Optimized for JSON output and minimal token usage.
     """
     def __init__(self):
+        import google.generativeai as genai
+
         genai.configure(api_key=settings.GEMINI_API_KEY)
         self.model = genai.GenerativeModel(
             "gemini-2.5-flash-lite",
@@ -39,15 +42,25 @@ class GeminiService:
         return {"mime_type": mime_type, "data": file_data}
 
     def _generate_and_parse(self, prompt: str, content) -> dict:
+        from google.api_core.exceptions import ResourceExhausted
+
         inputs = [prompt, content] if content else prompt
         try:
-            # ponytail: timeout duro para que un cuelgue de la API no deje el request colgado
-            response = self.model.generate_content(
-                inputs, safety_settings=self.safety_settings,
-                request_options={"timeout": 30}
-            )
+            # El scheduler reparte los slots entre workers y aprende del 429 (AIMD).
+            with get_provider_scheduler("gemini").slot():
+                try:
+                    # ponytail: timeout duro para que un cuelgue de la API no deje el request colgado
+                    response = self.model.generate_content(
+                        inputs, safety_settings=self.safety_settings,
+                        request_options={"timeout": 30}
+                    )
+                except ResourceExhausted as e:
+                    raise ProviderThrottled("gemini") from e
             # Since response_mime_type="application/json", response.text is guaranteed valid JSON
             return json.loads(response.text)
+        except ProviderThrottled:
+            # El 429 no se traga: la tarea que llamó debe reencolar el archivo.
+            raise
         except Exception as e:
             logger.error(f"Gemini API Error: {e}")
             return {"error": str(e)}
@@ -85,10 +98,14 @@ def get_gemini_service() -> GeminiService:
 class MistralOCRService:
     """Service for Mistral OCR processing."""
     def __init__(self):
+        from mistralai import Mistral
+
         self.api_key = os.getenv("MISTRAL_API_KEY") 
         self.client = Mistral(api_key=self.api_key) if self.api_key else None
 
     def _order_points(self, pts):
+        import numpy as np
+
         rect = np.zeros((4, 2), dtype="float32")
         s = pts.sum(axis=1)
         rect[0] = pts[np.argmin(s)]
@@ -99,6 +116,9 @@ class MistralOCRService:
         return rect
 
     def _four_point_transform(self, image, pts):
+        import cv2
+        import numpy as np
+
         rect = self._order_points(pts)
         (tl, tr, br, bl) = rect
         widthA = np.sqrt(((br[0] - bl[0]) ** 2) + ((br[1] - bl[1]) ** 2))
@@ -112,6 +132,9 @@ class MistralOCRService:
         return cv2.warpPerspective(image, M, (maxWidth, maxHeight))
 
     def _preprocess_image_advanced(self, file_bytes):
+        import cv2
+        import numpy as np
+
         try:
             nparr = np.frombuffer(file_bytes, np.uint8)
             img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
@@ -169,15 +192,23 @@ class MistralOCRService:
             base64_image = base64.b64encode(file_content_bytes).decode('utf-8')
 
         try:
-            ocr_response = self.client.ocr.process(
-                model="mistral-ocr-latest",
-                document={"type": "image_url", "image_url": f"data:image/jpeg;base64,{base64_image}"},
-                include_image_base64=False
-            )
+            with get_provider_scheduler("mistral").slot():
+                try:
+                    ocr_response = self.client.ocr.process(
+                        model="mistral-ocr-latest",
+                        document={"type": "image_url", "image_url": f"data:image/jpeg;base64,{base64_image}"},
+                        include_image_base64=False
+                    )
+                except Exception as e:
+                    if getattr(e, "status_code", None) == 429:
+                        raise ProviderThrottled("mistral") from e
+                    raise
             json_data = json.loads(ocr_response.model_dump_json())
             
             full_markdown = "".join([page.get("markdown", "") + "\n" for page in json_data.get("pages", [])])
             return {"text_content": full_markdown, "raw_json": json_data}
+        except ProviderThrottled:
+            raise
         except Exception as e:
             logger.error(f"Mistral API Error: {e}")
             return {"error": str(e)}
@@ -0,0 +1,121 @@
+# finanzas/services/card_metrics_service.py
+from datetime import date
+from decimal import Decimal
+
+from django.db.models import Q, F, Sum, Count, Case, When, Value, CharField
+from django.db.models.functions import TruncMonth
+
+from ..managers import nombre_normalizado
+from ..models import registro_transacciones
+from .reference_data_service import clave_nombre
+
+
+def _mes_anterior(year: int, month: int) -> tuple[int, int]:
+    return (year - 1, 12) if month == 1 else (year, month - 1)
+
+
+def _mes_siguiente(year: int, month: int) -> tuple[int, int]:
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+class CardMetricsService:
+    """
+    Métricas mes contra mes del widget de tarjetas (entradas, salidas y balance por cuenta).
+    Todas las cuentas y ambos meses salen de una sola consulta agrupada por cuenta, mes y sentido.
+    """
+    VACIO = {'total': Decimal('0.00'), 'transactions': 0, 'categories': 0}
+
+    @staticmethod
+    def flujos(user, cuentas: list[str], year: int, month: int) -> dict:
+        """
+        {(clave_nombre(cuenta), (año, mes), 'entrada'|'salida'): {'total', 'transactions', 'categories'}}.
+        Entradas: ingresos de la cuenta y transferencias hacia ella; salidas: gastos y
+        transferencias desde ella. Es un UNION ALL de dos SELECT agrupados (un solo viaje a
+        la base) porque una transferencia entre dos cuentas del widget cuenta en ambas.
+        """
+        inicio = date(*_mes_anterior(year, month), 1)
+        fin = date(*_mes_siguiente(year, month), 1)
+        claves = {clave_nombre(c) for c in cuentas}
+        base = (registro_transacciones.objects
+                .filter(propietario=user, fecha__gte=inicio, fecha__lt=fin)
+                .alias(origen=nombre_normalizado('cuenta_origen'), destino=nombre_normalizado('cuenta_destino')))
+        agregados = {
+            'total': Sum('monto'),
+            'transactions': Count('id'),
+            'categories': Count('categoria', distinct=True),
+        }
+        entradas = (base
+                    .filter(Q(tipo='INGRESO', origen__in=claves) |
+                            Q(tipo='TRANSFERENCIA', destino__in=claves))
+                    .annotate(cuenta=Case(When(tipo='INGRESO', then=F('origen')), default=F('destino')),
+                              mes=TruncMonth('fecha'), sentido=Value('entrada', output_field=CharField()))
+                    .values('cuenta', 'mes', 'sentido')
+                    .annotate(**agregados))
+        salidas = (base
+                   .filter(tipo__in=['GASTO', 'TRANSFERENCIA'], origen__in=claves)
+                   .annotate(cuenta=F('origen'), mes=TruncMonth('fecha'),
+                             sentido=Value('salida', output_field=CharField()))
+                   .values('cuenta', 'mes', 'sentido')
+                   .annotate(**agregados))
+
+        resultado = {}
+        for fila in entradas.union(salidas, all=True):
+            clave = (fila['cuenta'], (fila['mes'].year, fila['mes'].month), fila['sentido'])
+            resultado[clave] = {
+                'total': fila['total'] or Decimal('0.00'),
+                'transactions': fila['transactions'],
+                'categories': fila['categories'] or 0,
+            }
+        return resultado
+
+    @staticmethod
+    def _comparar(act: dict, prev: dict) -> dict:
+        dif = act['total'] - prev['total']
+        if prev['total'] > 0:
+            pct = (dif / prev['total']) * Decimal('100.0')
+        else:
+            pct = Decimal('100.0') if act['total'] > 0 else Decimal('0.0')
+        return {
+            'total': f"{act['total']:,.2f}",
+            'transactions': act['transactions'],
+            'categories': act['categories'],
+            'diferencia_monto': f"{abs(dif):,.2f}",
+            'porcentaje': round(float(abs(pct)), 1),
+            'es_positivo': bool(dif >= 0),
+        }
+
+    @staticmethod
+    def metricas(user, cuentas: list[str], year: int, month: int) -> dict:
+        """{cuenta: {'ingresos', 'gastos', 'balance'}} con el mismo formato que api_ingresos_tarjeta."""
+        flujos = CardMetricsService.flujos(user, cuentas, year, month)
+        actual, anterior = (year, month), _mes_anterior(year, month)
+        vacio = CardMetricsService.VACIO
+        metricas = {}
+        for cuenta in cuentas:
+            clave = clave_nombre(cuenta)
+            ent_act = flujos.get((clave, actual, 'entrada'), vacio)
+            sal_act = flujos.get((clave, actual, 'salida'), vacio)
+            ent_prev = flujos.get((clave, anterior, 'entrada'), vacio)
+            sal_prev = flujos.get((clave, anterior, 'salida'), vacio)
+
+            balance_act = float(ent_act['total']) - float(sal_act['total'])
+            balance_prev = float(ent_prev['total']) - float(sal_prev['total'])
+            dif_balance = balance_act - balance_prev
+            if balance_prev > 0:
+                pct_balance = (dif_balance / balance_prev) * 100.0
+            else:
+                pct_balance = 100.0 if balance_act > 0 else 0.0
+
+            metricas[cuenta] = {
+                'ingresos': CardMetricsService._comparar(ent_act, ent_prev),
+                'gastos': CardMetricsService._comparar(sal_act, sal_prev),
+                'balance': {
+                    'total': f"{balance_act:,.2f}",
+                    'transactions': ent_act['transactions'] + sal_act['transactions'],
+                    'categories': ent_act['categories'] + sal_act['categories'],
+                    'diferencia_monto': f"{abs(dif_balance):,.2f}",
+                    'porcentaje': round(float(abs(pct_balance)), 1),
+                    'es_positivo': bool(dif_balance >= 0),
+                },
+            }
+        return metricas
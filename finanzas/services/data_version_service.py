@@ -0,0 +1,56 @@
+# finanzas/services/data_version_service.py
+import time
+import logging
+
+from django.db import transaction
+
+from ..utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Sin escrituras en este tiempo la versión expira y se genera otra (una sola recarga de gráficas).
+VERSION_TTL = 30 * 86400
+
+
+class DataVersionService:
+    """
+    Versión por usuario de los datos que alimentan las gráficas. Cambia (al confirmarse la
+    transacción) con cada escritura de sus modelos, vía señales o desde los upserts masivos,
+    y las gráficas la usan como ETag: si no cambió, responden 304 sin consultar la base.
+    El valor es un timestamp y no un contador para que un Redis vaciado no repita versiones.
+    """
+
+    @staticmethod
+    def clave(user_id) -> str:
+        return f"datos:{user_id}:v"
+
+    @staticmethod
+    def actual(user_id) -> str | None:
+        """Versión vigente (se crea si no existe); None si Redis no responde."""
+        clave = DataVersionService.clave(user_id)
+        try:
+            pipe = get_redis_client().pipeline()
+            pipe.set(clave, time.time_ns(), ex=VERSION_TTL, nx=True)
+            pipe.get(clave)
+            _, version = pipe.execute()
+        except Exception as e:
+            logger.warning(f"Versión de datos: Redis no disponible ({e}).")
+            return None
+        return version.decode() if isinstance(version, bytes) else version
+
+    @staticmethod
+    def avanzar(*user_ids):
+        """Cambia la versión de los usuarios cuando la transacción en curso se confirme."""
+        user_ids = {u for u in user_ids if u}
+        if not user_ids:
+            return
+
+        def _avanzar():
+            try:
+                pipe = get_redis_client().pipeline()
+                for user_id in user_ids:
+                    pipe.set(DataVersionService.clave(user_id), time.time_ns(), ex=VERSION_TTL)
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"Versión de datos: no se pudo avanzar ({e}).")
+        transaction.on_commit(_avanzar)
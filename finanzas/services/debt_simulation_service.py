@@ -0,0 +1,210 @@
+# finanzas/services/debt_simulation_service.py
+import json
+import hashlib
+import logging
+
+from dateutil.relativedelta import relativedelta
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from ..models import Deuda, PagoAmortizacion
+from .finance_service import IVA_INTERESES
+
+logger = logging.getLogger(__name__)
+
+# Pago mínimo de tarjeta: el mayor entre 1.5% del saldo + intereses con IVA y 1.25% de la línea de crédito.
+PAGO_MINIMO_PCT_SALDO = 0.015
+PAGO_MINIMO_PCT_LIMITE = 0.0125
+MAX_MESES_SIMULACION = 600
+SIMULACION_CACHE_TTL = 600
+SALDO_LIQUIDADO = 0.005
+
+ESTRATEGIAS = ('minimos', 'avalancha', 'bola_de_nieve')
+
+
+def tasa_mensual_efectiva(tasa_anual) -> float:
+    """Tasa mensual con IVA sobre intereses, a partir de la tasa anual en %."""
+    return float(tasa_anual) / 100 / 12 * (1 + float(IVA_INTERESES))
+
+
+def pago_minimo_tarjeta(saldo: float, tasa_mensual: float, limite: float) -> float:
+    """Pago mínimo de una tarjeta, sin pasar del saldo más sus intereses."""
+    if saldo <= 0:
+        return 0.0
+    minimo = max(saldo * (PAGO_MINIMO_PCT_SALDO + tasa_mensual), limite * PAGO_MINIMO_PCT_LIMITE)
+    return round(min(minimo, saldo * (1 + tasa_mensual)), 2)
+
+
+class DebtPayoffSimulator:
+    """
+    Simulador de liquidación de deudas. Trabaja solo con arreglos: todas las
+    estrategias (y cada monto extra del "what-if") avanzan juntas mes a mes como
+    una matriz estrategias x deudas, sin tocar las tablas de PagoAmortizacion.
+    """
+
+    @staticmethod
+    def cargar_deudas(user) -> list[dict]:
+        """Estado inicial de cada deuda con adeudo: saldo, tasa mensual efectiva y pago mínimo."""
+        deudas = list(Deuda.objects.filter(propietario=user, requiere_configuracion_adicional=False).order_by('id'))
+        # Próxima cuota sin pagar de cada préstamo con tabla, en una sola consulta.
+        proximas = {}
+        for cuota in (PagoAmortizacion.objects
+                      .filter(deuda__in=deudas, pagado=False)
+                      .order_by('deuda_id', 'numero_cuota')
+                      .values('deuda_id', 'pago_total', 'capital', 'capital_abonado')):
+            proximas.setdefault(cuota['deuda_id'], cuota)
+        pagadas = dict(PagoAmortizacion.objects
+                       .filter(deuda__in=deudas, pagado=True)
+                       .values_list('deuda_id')
+                       .annotate(n=Count('id')))
+
+        estado = []
+        for d in deudas:
+            # En tarjetas saldo_pendiente es el crédito disponible; lo adeudado es lo gastado.
+            saldo = float(d.total_gastado if d.tipo_deuda == 'TARJETA_CREDITO' else d.saldo_pendiente or 0)
+            if saldo <= 0:
+                continue
+            tasa = tasa_mensual_efectiva(d.tasa_interes)
+            cuota = proximas.get(d.id)
+            if d.tipo_deuda == 'TARJETA_CREDITO':
+                pago_minimo = pago_minimo_tarjeta(saldo, tasa, float(d.monto_total))
+            elif cuota:
+                pago_minimo = float(cuota['pago_total'] - cuota['capital_abonado'])
+            else:
+                restantes = max(1, d.plazo_meses - pagadas.get(d.id, 0))
+                pago_minimo = (saldo * tasa / (1 - (1 + tasa) ** -restantes)) if tasa > 0 else saldo / restantes
+            estado.append({
+                'id': d.id,
+                'nombre': d.nombre,
+                'tipo': d.tipo_deuda,
+                'saldo': round(saldo, 2),
+                'tasa_mensual': round(tasa, 8),
+                'pago_minimo': round(min(pago_minimo, saldo * (1 + tasa)), 2),
+                'dia_pago': d.dia_pago,
+            })
+        return estado
+
+    @staticmethod
+    def huella(deudas: list[dict], escenarios: list[tuple], inicio) -> str:
+        """Huella de las entradas: misma huella -> mismo resultado."""
+        carga = json.dumps({'deudas': deudas, 'escenarios': escenarios, 'inicio': str(inicio)},
+                           sort_keys=True, default=str)
+        return hashlib.sha256(carga.encode()).hexdigest()
+
+    @staticmethod
+    def _orden(estrategia: str, saldos: 'np.ndarray', tasas: 'np.ndarray') -> 'np.ndarray':
+        """Prioridad de las deudas (índices) para recibir el excedente."""
+        import numpy as np
+        if estrategia == 'avalancha':
+            return np.lexsort((saldos, -tasas))
+        # bola_de_nieve (y minimos, que no usa el excedente)
+        return np.lexsort((-tasas, saldos))
+
+    @staticmethod
+    def simular(deudas: list[dict], escenarios: list[tuple], max_meses: int = MAX_MESES_SIMULACION) -> dict:
+        """
+        Corre todos los escenarios (estrategia, extra_mensual) a la vez.
+
+        Cada mes: se capitalizan intereses, se cubren los mínimos y el resto del presupuesto
+        (mínimos originales + extra) se reparte en cascada según la prioridad de la estrategia.
+        Al liquidarse una deuda su mínimo se suma al excedente, salvo en 'minimos'.
+        """
+        import numpy as np
+        n_esc, n_deu = len(escenarios), len(deudas)
+        saldo = np.tile(np.array([d['saldo'] for d in deudas], dtype=float), (n_esc, 1))
+        tasas = np.array([d['tasa_mensual'] for d in deudas], dtype=float)
+        minimos = np.array([d['pago_minimo'] for d in deudas], dtype=float)
+        extra = np.array([e for _, e in escenarios], dtype=float)
+        reinvierte = np.array([est != 'minimos' for est, _ in escenarios])
+        presupuesto = np.where(reinvierte, minimos.sum() + extra, 0.0)
+
+        orden = np.array([DebtPayoffSimulator._orden(est, saldo[0], tasas) for est, _ in escenarios],
+                         dtype=int).reshape(n_esc, n_deu)
+        filas = np.arange(n_esc)[:, None]
+
+        intereses = np.zeros((n_esc, n_deu))
+        pagado = np.zeros((n_esc, n_deu))
+        mes_liquidacion = np.where(saldo <= SALDO_LIQUIDADO, 0, -1)
+
+        for mes in range(1, max_meses + 1):
+            activas = saldo > SALDO_LIQUIDADO
+            if not activas.any():
+                break
+            interes = np.where(activas, saldo * tasas, 0.0)
+            saldo = saldo + interes
+            intereses += interes
+
+            pago = np.minimum(np.where(activas, minimos, 0.0), saldo)
+            excedente = np.where(reinvierte, presupuesto - pago.sum(axis=1), extra)
+            excedente = np.maximum(excedente, 0.0)
+
+            # Reparto en cascada vectorizado: cada deuda (en orden de prioridad) recibe
+            # lo que queda del excedente después de las anteriores, hasta su saldo.
+            resto = (saldo - pago)[filas, orden]
+            previo = np.cumsum(resto, axis=1) - resto
+            abono_ordenado = np.clip(excedente[:, None] - previo, 0.0, resto)
+            abono = np.empty_like(abono_ordenado)
+            abono[filas, orden] = abono_ordenado
+
+            pago += abono
+            saldo = saldo - pago
+            pagado += pago
+            recien = activas & (saldo <= SALDO_LIQUIDADO)
+            mes_liquidacion[recien] = mes
+
+        return {
+            'meses': mes_liquidacion,
+            'intereses': intereses,
+            'pagado': pagado,
+            'saldo_final': np.where(saldo > SALDO_LIQUIDADO, saldo, 0.0),
+        }
+
+    @staticmethod
+    def resultado(user, escenarios: list[tuple], inicio=None) -> dict:
+        """Simula para un usuario con memo por huella de entradas (Django cache)."""
+        inicio = inicio or timezone.now().date()
+        deudas = DebtPayoffSimulator.cargar_deudas(user)
+        clave = f"simdeuda:{DebtPayoffSimulator.huella(deudas, escenarios, inicio)}"
+        cached = cache.get(clave)
+        if cached is not None:
+            return cached
+
+        respuesta = {'deudas': deudas, 'escenarios': []}
+        if deudas:
+            sim = DebtPayoffSimulator.simular(deudas, escenarios)
+            for i, (estrategia, extra) in enumerate(escenarios):
+                meses = sim['meses'][i]
+                por_deuda = []
+                for j, d in enumerate(deudas):
+                    mes = int(meses[j])
+                    por_deuda.append({
+                        'id': d['id'],
+                        'meses': mes if mes >= 0 else None,
+                        'fecha_liquidacion': DebtPayoffSimulator._fecha(inicio, d['dia_pago'], mes),
+                        'intereses': round(float(sim['intereses'][i, j]), 2),
+                    })
+                liquidada = bool((meses >= 0).all())
+                total_meses = int(meses.max()) if liquidada else None
+                respuesta['escenarios'].append({
+                    'estrategia': estrategia,
+                    'extra_mensual': extra,
+                    'meses': total_meses,
+                    'fecha_liquidacion': max((p['fecha_liquidacion'] for p in por_deuda), default=None) if liquidada else None,
+                    'intereses_totales': round(float(sim['intereses'][i].sum()), 2),
+                    'pagado_total': round(float(sim['pagado'][i].sum()), 2),
+                    'saldo_sin_liquidar': round(float(sim['saldo_final'][i].sum()), 2),
+                    'deudas': por_deuda,
+                })
+        cache.set(clave, respuesta, SIMULACION_CACHE_TTL)
+        return respuesta
+
+    @staticmethod
+    def _fecha(inicio, dia_pago, meses: int):
+        if meses < 0:
+            return None
+        fecha = inicio + relativedelta(months=meses)
+        if dia_pago:
+            # relativedelta ajusta al último día si el mes es más corto.
+            fecha = fecha + relativedelta(day=dia_pago)
+        return fecha.isoformat()
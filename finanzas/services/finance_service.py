@@ -1,17 +1,26 @@
 # finanzas/services/finance_service.py
 import re
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 import logging
-from datetime import datetime, date
+from datetime import datetime
 from collections import defaultdict
 from dateutil.relativedelta import relativedelta
 from .market_data_service import StockPriceService
-from ..models import TransaccionPendiente, registro_transacciones, User, inversiones, PendingInvestment, Deuda, PagoAmortizacion
+from .data_version_service import DataVersionService
+from .portfolio_series_service import PortfolioSeriesService
+from .lot_matching_service import LotMatchingService
+from django.db import transaction
+from django.db.models import Min, F
+from ..models import TransaccionPendiente, registro_transacciones, User, inversiones, PendingInvestment, Deuda, PagoAmortizacion, GananciaMensual, PortfolioHistory, Holding, VentaInversion
 from ..utils import parse_date_safely
-import time
 
 logger = logging.getLogger(__name__)
 
+IVA_INTERESES = Decimal('0.16')
+
+def _centavos(valor: Decimal) -> Decimal:
+    return valor.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
 class TransactionService:
     """Service for handling transaction business logic."""
     
@@ -110,50 +119,59 @@ class InvestmentService:
         )
 
     @staticmethod
-    def calculate_monthly_profit(user, price_service=None):
-        """Calcula la ganancia mensual no realizada de las inversiones de un usuario."""
+    def monthly_series_plan(inversiones_qs) -> dict:
+        """Tickers a consultar y el primer mes que se necesita de cada uno (sobre todas las inversiones dadas)."""
+        plan = {}
+        for ticker, inicio in inversiones_qs.values_list('emisora_ticker').annotate(inicio=Min('fecha_compra')):
+            if ticker:
+                plan[ticker] = inicio.replace(day=1)
+        return plan
+
+    @staticmethod
+    def fetch_monthly_closes(ticker: str, inicio, price_service=None) -> dict:
+        """Serie mensual de cierres {'YYYY-MM': Decimal} desde 'inicio' hasta hoy."""
         servicio_precios = price_service or StockPriceService()
-        ganancias_mensuales = defaultdict(Decimal)
-        
-        inversiones_usuario = inversiones.objects.filter(propietario=user)
-        if not inversiones_usuario:
-            return {}
+        series = servicio_precios.get_monthly_series(ticker, inicio, datetime.now().date())
+        return {p["datetime"][:7]: Decimal(str(p["close"])) for p in series}
 
-        hoy = datetime.now().date()
-        inversiones_por_ticker = defaultdict(list)
-        inicio_por_ticker = {}
+    @staticmethod
+    def consumos_de_ventas(ventas_qs) -> dict:
+        """Lo vendido de cada lote según el emparejamiento ya guardado en las ventas."""
+        return LotMatchingService.consumos_por_lote(ventas_qs.values_list('fecha_venta', 'detalle'))
 
-        for inv in inversiones_usuario:
-            inversiones_por_ticker[inv.emisora_ticker].append(inv)
-            inicio = inv.fecha_compra.replace(day=1)
-            if inv.emisora_ticker not in inicio_por_ticker or inicio < inicio_por_ticker[inv.emisora_ticker]:
-                inicio_por_ticker[inv.emisora_ticker] = inicio
-
-        series_cache = {}
-        for ticker, inicio in inicio_por_ticker.items():
-            series = servicio_precios.get_monthly_series(ticker, inicio, hoy)
-            series_cache[ticker] = {p["datetime"][:7]: Decimal(str(p["close"])) for p in series}
-            time.sleep(12)
-
-        for ticker, inversiones_list in inversiones_por_ticker.items():
-            precios_por_mes = series_cache.get(ticker, {})
-            for inv in inversiones_list:
-                fecha_iter = inv.fecha_compra.replace(day=1)
-                while fecha_iter <= hoy:
-                    mes_str = fecha_iter.strftime("%Y-%m")
-                    precio_cierre = precios_por_mes.get(mes_str)
-                    if precio_cierre is not None:
-                        costo_total_adquisicion = inv.cantidad_titulos * inv.precio_compra_titulo
-                        valor_actual_mercado = inv.cantidad_titulos * precio_cierre
-                        ganancia_perdida_no_realizada = valor_actual_mercado - costo_total_adquisicion
-                        ganancias_mensuales[mes_str] += ganancia_perdida_no_realizada
-                        
-                    if fecha_iter.month == 12:
-                        fecha_iter = date(fecha_iter.year + 1, 1, 1)
-                    else:
-                        fecha_iter = date(fecha_iter.year, fecha_iter.month + 1, 1)
+    @staticmethod
+    def monthly_profit_from_series(inversiones_list, series_por_ticker: dict, hoy=None, consumos=None) -> dict:
+        """
+        Ganancia no realizada por mes a partir de series ya descargadas (no llama a la API),
+        sobre los títulos que seguían en cartera al cierre de cada mes.
+        """
+        hoy = hoy or datetime.now().date()
+        consumos = consumos or {}
+        ganancias_mensuales = defaultdict(Decimal)
+        for inv in inversiones_list:
+            precios_por_mes = series_por_ticker.get(inv.emisora_ticker, {})
+            fecha_iter = inv.fecha_compra.replace(day=1)
+            while fecha_iter <= hoy:
+                mes_str = fecha_iter.strftime("%Y-%m")
+                precio_cierre = precios_por_mes.get(mes_str)
+                if precio_cierre is not None:
+                    cierre_mes = fecha_iter + relativedelta(months=1, days=-1)
+                    cantidad, costo = LotMatchingService.abierto_al(inv, consumos, cierre_mes)
+                    ganancias_mensuales[mes_str] += cantidad * precio_cierre - costo
+                fecha_iter += relativedelta(months=1)
         return dict(sorted(ganancias_mensuales.items()))
 
+    @staticmethod
+    def calculate_monthly_profit(user, price_service=None):
+        """Calcula la ganancia mensual no realizada de las inversiones de un usuario."""
+        inversiones_usuario = list(inversiones.objects.filter(propietario=user))
+        if not inversiones_usuario:
+            return {}
+        plan = InvestmentService.monthly_series_plan(inversiones.objects.filter(propietario=user))
+        series = {t: InvestmentService.fetch_monthly_closes(t, inicio, price_service) for t, inicio in plan.items()}
+        consumos = InvestmentService.consumos_de_ventas(VentaInversion.objects.filter(propietario=user))
+        return InvestmentService.monthly_profit_from_series(inversiones_usuario, series, consumos=consumos)
+
     @staticmethod
     def calculate_daily_portfolio_history(user, price_service=None):
         """
@@ -183,7 +201,7 @@ class InvestmentService:
             precios_diarios_cache[ticker] = {
                 p["datetime"]: Decimal(str(p["close"])) for p in series
             }
-            time.sleep(12)
+        consumos = InvestmentService.consumos_de_ventas(VentaInversion.objects.filter(propietario=user))
 
         historial = []
         fecha_iter = fecha_inicio
@@ -198,8 +216,10 @@ class InvestmentService:
                 
                 for inv in lista_inv:
                     if inv.fecha_compra <= fecha_iter:
-                        cantidad_acumulada_ticker += inv.cantidad_titulos
-                        costo_acumulado_ticker += inv.costo_total_adquisicion
+                        # Lo vendido hasta ese día ya no está en cartera.
+                        cantidad, costo = LotMatchingService.abierto_al(inv, consumos, fecha_iter)
+                        cantidad_acumulada_ticker += cantidad
+                        costo_acumulado_ticker += costo
                 
                 if cantidad_acumulada_ticker > 0:
                     capital_invertido_dia += costo_acumulado_ticker
@@ -231,9 +251,170 @@ class InvestmentService:
 
         return historial
 
+    # --- Unidades idempotentes de los trabajos nocturnos (una por ticker o por usuario) ---
+
+    @staticmethod
+    def refresh_ticker_price(ticker: str, price_service=None) -> list:
+        """
+        Consulta el precio de un ticker UNA vez y lo aplica a todos sus lotes y posiciones con
+        un UPDATE cada uno (en vez de guardar lote por lote); solo los lotes con ventas se
+        corrigen aparte, por lo que les queda. Devuelve los usuarios tocados.
+        """
+        precio = (price_service or StockPriceService()).get_current_price(ticker)
+        if precio is None:
+            raise ValueError(f"Sin precio para {ticker}")
+        precio = Decimal(str(precio))
+        with transaction.atomic():
+            lotes = inversiones.objects.filter(emisora_ticker__iexact=ticker)
+            lotes.update(
+                precio_actual_titulo=precio,
+                valor_actual_mercado=F('cantidad_titulos') * precio,
+                ganancia_perdida_no_realizada=F('cantidad_titulos') * precio - F('costo_total_adquisicion'),
+            )
+            consumos = InvestmentService.consumos_de_ventas(VentaInversion.objects.filter(emisora_ticker__iexact=ticker))
+            vendidos = list(lotes.filter(id__in=consumos)) if consumos else []
+            for lote in vendidos:
+                cantidad, costo = LotMatchingService.abierto_al(lote, consumos)
+                lote.valor_actual_mercado = cantidad * precio
+                lote.ganancia_perdida_no_realizada = cantidad * precio - costo
+            if vendidos:
+                inversiones.objects.bulk_update(vendidos, ['valor_actual_mercado', 'ganancia_perdida_no_realizada'])
+            usuarios = Holding.objects.actualizar_precio(ticker, precio)
+            # El UPDATE masivo no dispara señales.
+            DataVersionService.avanzar(*usuarios)
+        return usuarios
+
+    @staticmethod
+    def refresh_all_monthly_profits(series_por_ticker: dict | None = None, user_ids=None, price_service=None) -> dict:
+        """
+        Recalcula GananciaMensual en dos fases: (1) una sola descarga de la serie mensual por
+        ticker, desde el mes más antiguo que necesite cualquier usuario; (2) el P&L de cada usuario
+        en memoria sobre esas series compartidas. Escribe con un upsert masivo sobre (propietario, mes).
+        """
+        qs = inversiones.objects.all() if user_ids is None else inversiones.objects.filter(propietario_id__in=user_ids)
+        if series_por_ticker is None:
+            series_por_ticker = {
+                ticker: InvestmentService.fetch_monthly_closes(ticker, inicio, price_service)
+                for ticker, inicio in InvestmentService.monthly_series_plan(qs).items()
+            }
+
+        por_usuario = defaultdict(list)
+        for inv in qs:
+            por_usuario[inv.propietario_id].append(inv)
+        ventas = VentaInversion.objects.all() if user_ids is None else VentaInversion.objects.filter(propietario_id__in=user_ids)
+        consumos = InvestmentService.consumos_de_ventas(ventas)
+
+        filas = []
+        for propietario_id, inversiones_list in por_usuario.items():
+            for mes, total in InvestmentService.monthly_profit_from_series(inversiones_list, series_por_ticker, consumos=consumos).items():
+                filas.append(GananciaMensual(propietario_id=propietario_id, mes=mes, total=total))
+        vigentes = {(f.propietario_id, f.mes) for f in filas}
+
+        existentes = GananciaMensual.objects.all() if user_ids is None else GananciaMensual.objects.filter(propietario_id__in=user_ids)
+        obsoletas, afectados = [], set(por_usuario)
+        for pk, propietario_id, mes in existentes.values_list('id', 'propietario_id', 'mes'):
+            if (propietario_id, mes) not in vigentes:
+                obsoletas.append(pk)
+                afectados.add(propietario_id)
+
+        with transaction.atomic():
+            GananciaMensual.objects.bulk_create(
+                filas, batch_size=1000, update_conflicts=True,
+                unique_fields=['propietario', 'mes'], update_fields=['total'],
+            )
+            if obsoletas:
+                GananciaMensual.objects.filter(id__in=obsoletas).delete()
+            # El upsert masivo no dispara señales.
+            DataVersionService.avanzar(*afectados)
+
+        # Lo que costaba el cálculo por usuario: una serie por cada ticker distinto de cada usuario.
+        llamadas_por_usuario = sum(len({inv.emisora_ticker for inv in invs if inv.emisora_ticker}) for invs in por_usuario.values())
+        return {
+            'usuarios': list(por_usuario),
+            'filas': len(filas),
+            'series_descargadas': len(series_por_ticker),
+            'llamadas_ahorradas': max(0, llamadas_por_usuario - len(series_por_ticker)),
+        }
+
+    @staticmethod
+    def refresh_monthly_profits(user, price_service=None) -> int:
+        """Recalcula las GananciaMensual de un solo usuario."""
+        return InvestmentService.refresh_all_monthly_profits(user_ids=[user.id], price_service=price_service)['filas']
+
+    @staticmethod
+    def refresh_portfolio_history(user, price_service=None) -> int:
+        """Recalcula y reemplaza el historial del portafolio del usuario en una sola transacción."""
+        historial = InvestmentService.calculate_daily_portfolio_history(user, price_service)
+        if not historial:
+            return 0
+        filas = [(d['fecha'], d['valor_total'], d['capital_invertido'], d['ganancia_no_realizada']) for d in historial]
+        with transaction.atomic():
+            PortfolioHistory.objects.reemplazar(user.id, filas)
+            DataVersionService.avanzar(user.id)
+            transaction.on_commit(lambda: PortfolioSeriesService.precalcular(user.id, filas))
+        return len(historial)
+
 class DebtService:
     """Service for handling debt operations like amortizations."""
 
+    @staticmethod
+    def calcular_tabla_francesa(monto, tasa_anual, plazo: int, fecha_inicio) -> list:
+        """
+        Tabla de amortización francesa en una sola pasada, redondeando cada cuota al centavo
+        (ROUND_HALF_UP). El saldo se arrastra ya redondeado, así que no acumula error y la
+        última cuota absorbe el residuo exacto.
+        """
+        tasa_mensual = (Decimal(tasa_anual) / Decimal(100)) / Decimal(12)
+        monto = Decimal(monto)
+        if tasa_mensual > 0:
+            factor = (1 + tasa_mensual) ** plazo
+            cuota = _centavos(monto * tasa_mensual * factor / (factor - 1))
+        else:
+            cuota = _centavos(monto / plazo)
+
+        saldo = _centavos(monto)
+        cuotas = []
+        for i in range(1, plazo + 1):
+            interes = _centavos(saldo * tasa_mensual)
+            capital = saldo if i == plazo else min(cuota - interes, saldo)
+            saldo -= capital
+            cuotas.append({
+                'numero_cuota': i,
+                'fecha_vencimiento': fecha_inicio + relativedelta(months=i),
+                'capital': capital,
+                'interes': interes,
+                'iva': _centavos(interes * IVA_INTERESES),
+                'saldo_insoluto': saldo,
+            })
+        return cuotas
+
+    @staticmethod
+    def reemplazar_tabla_amortizacion(deuda: Deuda, cuotas: list) -> int:
+        """
+        Sustituye la tabla de la deuda de forma atómica con un solo bulk_create.
+        pago_total se precalcula aquí porque bulk_create no pasa por PagoAmortizacion.save().
+        """
+        pagos = [
+            PagoAmortizacion(deuda=deuda, pago_total=c['capital'] + c['interes'] + c['iva'], **c)
+            for c in cuotas
+        ]
+        with transaction.atomic():
+            PagoAmortizacion.objects.filter(deuda=deuda).delete()
+            PagoAmortizacion.objects.bulk_create(pagos, batch_size=500)
+        return len(pagos)
+
+    @staticmethod
+    def cuotas_desde_json(cuotas_json: list) -> list:
+        """Normaliza las cuotas extraídas por la IA al formato de reemplazar_tabla_amortizacion."""
+        return [{
+            'numero_cuota': i,
+            'fecha_vencimiento': parse_date_safely(c.get("fecha_vencimiento")),
+            'capital': _centavos(Decimal(str(c.get("capital", 0.0)))),
+            'interes': _centavos(Decimal(str(c.get("interes", 0.0)))),
+            'iva': _centavos(Decimal(str(c.get("iva", 0.0)))),
+            'saldo_insoluto': _centavos(Decimal(str(c.get("saldo_insoluto", 0.0)))),
+        } for i, c in enumerate(cuotas_json, 1)]
+
     @staticmethod
     def generar_tabla_amortizacion(deuda: Deuda):
         '''
@@ -241,37 +422,7 @@ class DebtService:
         '''
         if deuda.tipo_deuda != 'PRESTAMO' or deuda.plazo_meses == 0:
             return
-
-        tasa_interes_mensual = (deuda.tasa_interes / Decimal(100)) / Decimal(12)
-        plazo = deuda.plazo_meses
-        monto_prestamo = deuda.monto_total
-        saldo_pendiente = monto_prestamo
-        
-        if tasa_interes_mensual > 0:
-            factor = (tasa_interes_mensual * (1 + tasa_interes_mensual) ** plazo) / (((1 + tasa_interes_mensual) ** plazo) - 1)
-            cuota_mensual = monto_prestamo * factor
-        else:
-            cuota_mensual = monto_prestamo / plazo
-
-        fecha_pago = deuda.fecha_adquisicion
-
-        for i in range(1, plazo + 1):
-            fecha_pago += relativedelta(months=1)
-            
-            intereses_cuota = saldo_pendiente * tasa_interes_mensual
-            capital_cuota = cuota_mensual - intereses_cuota
-            saldo_pendiente -= capital_cuota
-
-            if i == plazo:
-                capital_cuota += saldo_pendiente
-                saldo_pendiente = Decimal(0)
-
-            PagoAmortizacion.objects.create(
-                deuda=deuda,
-                numero_cuota=i,
-                fecha_vencimiento=fecha_pago,
-                capital=capital_cuota.quantize(Decimal('0.01')),
-                interes=intereses_cuota.quantize(Decimal('0.01')),
-                iva=(intereses_cuota * Decimal('0.16')).quantize(Decimal('0.01')),
-                saldo_insoluto=saldo_pendiente.quantize(Decimal('0.01'))
-            )
+        cuotas = DebtService.calcular_tabla_francesa(
+            deuda.monto_total, deuda.tasa_interes, deuda.plazo_meses, deuda.fecha_adquisicion
+        )
+        DebtService.reemplazar_tabla_amortizacion(deuda, cuotas)
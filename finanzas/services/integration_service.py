@@ -1,23 +1,23 @@
 # finanzas/services/integration_service.py
 import os
 import requests
-import jwt
 from io import BytesIO
 import logging
-from jwt import PyJWKClient
-import mercadopago
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from google.oauth2.credentials import Credentials
 from allauth.socialaccount.models import SocialApp, SocialToken, SocialAccount
-from django.contrib.sessions.models import Session
+from ..sessions import revocar_sesiones_usuario
 from ..models import User
 
 logger = logging.getLogger(__name__)
 
+# googleapiclient, mercadopago y jwt se importan al usarse: la web los necesita solo en
+# unas cuantas vistas y el cliente de Google es de los imports más pesados.
+
 class GoogleDriveService:
     """Service to interact with Google Drive API."""
     def __init__(self, user: User):
+        from googleapiclient.discovery import build
+        from google.oauth2.credentials import Credentials
+
         try:
             app = SocialApp.objects.get(provider='google')
             google_token = SocialToken.objects.get(account__user=user, account__provider='google')
@@ -33,6 +33,8 @@ class GoogleDriveService:
             raise ConnectionError("Google account link or Social App config missing.") from e
 
     def _get_folder_id(self, folder_name: str) -> str | None:
+        from googleapiclient.errors import HttpError
+
         try:
             query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
             response = self.service.files().list(q=query, spaces='drive', fields='files(id)').execute()
@@ -42,6 +44,8 @@ class GoogleDriveService:
             return None
 
     def list_files_in_folder(self, folder_name: str, mimetypes: list[str]) -> list[dict]:
+        from googleapiclient.errors import HttpError
+
         folder_id = self._get_folder_id(folder_name)
         if not folder_id: return []
         
@@ -62,6 +66,8 @@ class GoogleDriveService:
 class MercadoPagoService:
     """Service for Mercado Pago business logic."""
     def __init__(self):
+        import mercadopago
+
         self.sdk = mercadopago.SDK(os.getenv('MERCADOPAGO_ACCESS_TOKEN'))
         self.plan_id = os.getenv('MERCADOPAGO_PLAN_ID')
         if not self.sdk or not self.plan_id:
@@ -82,12 +88,16 @@ class RISCService:
             logger.warning("GOOGLE_CLIENT_ID missing in .env")
 
     def _get_jwk_client(self):
+        from jwt import PyJWKClient
+
         if self._jwk_client is None:
             config = requests.get(self.GOOGLE_RISC_CONFIG_URL, timeout=5).json()
             self._jwk_client = PyJWKClient(config.get("jwks_uri"))
         return self._jwk_client
 
     def validate_token(self, token: str) -> dict:
+        import jwt
+
         jwk_client = self._get_jwk_client()
         try:
             signing_key = jwk_client.get_signing_key_from_jwt(token)
@@ -119,11 +129,11 @@ class RISCService:
                 if event_type == "https://schemas.openid.net/secevent/risc/event-type/account-disabled":
                     user.is_active = False
                     user.save()
-                    Session.objects.filter(session_key__in=user.session_set.values_list('session_key', flat=True)).delete()
+                    revocar_sesiones_usuario(user)
                     logger.warning(f"User {user.username} deactivated (Google account disabled via RISC).")
 
                 elif event_type == "https://schemas.openid.net/secevent/risc/event-type/sessions-revoked":
-                    Session.objects.filter(session_key__in=user.session_set.values_list('session_key', flat=True)).delete()
-                    logger.warning(f"User {user.username} sessions revoked via RISC.")
+                    n = revocar_sesiones_usuario(user)
+                    logger.warning(f"User {user.username} sessions revoked via RISC ({n}).")
             except SocialAccount.DoesNotExist:
                 logger.warning(f"RISC event for unknown Google ID {user_google_id}.")
@@ -0,0 +1,170 @@
+# finanzas/services/lot_matching_service.py
+import logging
+from collections import deque, defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Sum
+
+from ..models import inversiones, VentaInversion, Holding
+
+logger = logging.getLogger(__name__)
+
+CERO = Decimal('0')
+# La escala de los DecimalField de inversiones: comparar ya redondeado evita reescrituras.
+ESCALA = Decimal('1e-10')
+
+
+class LotMatchingService:
+    """
+    Ganancia realizada de las ventas: empareja cada venta con los lotes comprados del mismo
+    activo (FIFO, LIFO o costo promedio) en una sola pasada ordenada por fecha, con una
+    deque de lotes abiertos. Al guardar una venta o un lote se rehace la pasada del activo
+    en memoria y solo se escriben las ventas y lotes cuyo resultado cambió.
+    """
+
+    METODOS = ('FIFO', 'LIFO', 'PROMEDIO')
+
+    @staticmethod
+    def emparejar(compras: list, ventas: list, metodo: str = 'FIFO') -> tuple[dict, list]:
+        """
+        compras: (lote_id, fecha, cantidad, costo_total); ventas: (venta_id, fecha, cantidad).
+        Devuelve ({venta_id: (costo_base, detalle)}, lotes abiertos [lote_id, cantidad, costo]).
+        El detalle lista {'lote', 'cantidad', 'costo'} por lote consumido; lo vendido de más
+        (sin lote que lo cubra) va con 'lote': None y costo cero.
+        En el mismo día las compras van antes que las ventas.
+        """
+        if metodo not in LotMatchingService.METODOS:
+            raise ValueError(f"Método de costeo desconocido: {metodo}")
+        eventos = sorted([(f, 0, i, Decimal(q), Decimal(c)) for i, f, q, c in compras] +
+                         [(f, 1, i, Decimal(q), CERO) for i, f, q in ventas],
+                         key=lambda e: (e[0], e[1], e[2]))
+        abiertos = deque()
+        pool_cantidad, pool_costo = CERO, CERO
+        resultados = {}
+        for _, es_venta, ident, cantidad, costo in eventos:
+            if not es_venta:
+                abiertos.append([ident, cantidad, costo])
+                pool_cantidad += cantidad
+                pool_costo += costo
+                continue
+
+            pendiente, costo_venta, detalle = cantidad, CERO, []
+            # Con costo promedio la cantidad se descuenta FIFO, pero el costo sale del promedio.
+            promedio = pool_costo / pool_cantidad if metodo == 'PROMEDIO' and pool_cantidad > 0 else None
+            while pendiente > 0 and abiertos:
+                lote = abiertos[-1] if metodo == 'LIFO' else abiertos[0]
+                tomada = min(pendiente, lote[1])
+                # Si se agota el lote se toma su costo restante completo: no arrastra redondeos.
+                costo_lote = lote[2] if tomada == lote[1] else lote[2] * tomada / lote[1]
+                costo = promedio * tomada if promedio is not None else costo_lote
+                lote[1] -= tomada
+                lote[2] -= costo_lote
+                if lote[1] == 0 and metodo == 'LIFO':
+                    abiertos.pop()
+                elif lote[1] == 0:
+                    abiertos.popleft()
+                detalle.append({'lote': lote[0], 'cantidad': str(tomada), 'costo': str(costo.quantize(ESCALA))})
+                costo_venta += costo
+                pendiente -= tomada
+            if pendiente > 0:
+                detalle.append({'lote': None, 'cantidad': str(pendiente), 'costo': '0'})
+            pool_cantidad -= cantidad - pendiente
+            pool_costo -= costo_venta
+            resultados[ident] = (costo_venta, detalle)
+
+        if metodo == 'PROMEDIO' and pool_cantidad > 0:
+            # Lo que queda vale el costo promedio restante, no el original de cada lote.
+            for lote in abiertos:
+                lote[2] = pool_costo * lote[1] / pool_cantidad
+        return resultados, list(abiertos)
+
+    @staticmethod
+    def consumos_por_lote(ventas) -> dict:
+        """{lote_id: [(fecha_venta, cantidad, costo)]}: lo que cada venta (fecha_venta, detalle) sacó de cada lote."""
+        consumos = defaultdict(list)
+        for fecha_venta, detalle in ventas:
+            for parte in detalle:
+                if parte['lote'] is not None:
+                    consumos[parte['lote']].append((fecha_venta, Decimal(parte['cantidad']), Decimal(parte['costo'])))
+        return consumos
+
+    @staticmethod
+    def abierto_al(lote, consumos: dict, fecha=None) -> tuple[Decimal, Decimal]:
+        """(cantidad, costo) del lote que seguía en cartera al cierre de 'fecha' (sin fecha: hoy)."""
+        cantidad, costo = lote.cantidad_titulos, lote.costo_total_adquisicion
+        for fecha_venta, vendida, costo_vendido in consumos.get(lote.id, ()):
+            if fecha is None or fecha_venta <= fecha:
+                cantidad -= vendida
+                costo -= costo_vendido
+        return cantidad, costo
+
+    @staticmethod
+    def recalcular(propietario_id, clave: str, tipo_inversion: str, metodo: str | None = None) -> tuple[Decimal, Decimal]:
+        """
+        Empareja las ventas del activo y guarda su costo y ganancia (y la ganancia realizada
+        de cada lote). Devuelve (cantidad, costo) que siguen abiertos para la posición.
+        """
+        metodo = metodo or settings.METODO_COSTO_VENTAS
+        filtro = Holding.objects.filtro_activo(clave)
+        lotes = {l.id: l for l in inversiones.objects.filter(filtro, propietario_id=propietario_id, tipo_inversion=tipo_inversion)}
+        ventas = list(VentaInversion.objects.filter(filtro, propietario_id=propietario_id, tipo_inversion=tipo_inversion))
+
+        resultados, abiertos = LotMatchingService.emparejar(
+            [(l.id, l.fecha_compra, l.cantidad_titulos, l.costo_total_adquisicion) for l in lotes.values()],
+            [(v.id, v.fecha_venta, v.cantidad_titulos) for v in ventas],
+            metodo,
+        )
+
+        realizada_por_lote = defaultdict(lambda: CERO)
+        ventas_cambiadas = []
+        for venta in ventas:
+            costo, detalle = resultados[venta.id]
+            costo = costo.quantize(ESCALA)
+            ganancia = venta.ingreso_neto - costo
+            ingreso_unitario = venta.ingreso_neto / venta.cantidad_titulos if venta.cantidad_titulos else CERO
+            for parte in detalle:
+                if parte['lote'] is not None:
+                    realizada_por_lote[parte['lote']] += ingreso_unitario * Decimal(parte['cantidad']) - Decimal(parte['costo'])
+            if (venta.costo_base, venta.ganancia_realizada, venta.metodo, venta.detalle) != (costo, ganancia, metodo, detalle):
+                venta.costo_base, venta.ganancia_realizada, venta.metodo, venta.detalle = costo, ganancia, metodo, detalle
+                ventas_cambiadas.append(venta)
+            if any(p['lote'] is None for p in detalle):
+                logger.warning(f"Venta {venta.id}: se vendieron más títulos de {clave} de los comprados.")
+
+        # El valor de mercado de cada lote es solo por lo que sigue en cartera.
+        consumos = LotMatchingService.consumos_por_lote((v.fecha_venta, resultados[v.id][1]) for v in ventas)
+        lotes_cambiados = []
+        for lote_id, lote in lotes.items():
+            realizada = realizada_por_lote[lote_id].quantize(ESCALA) if lote_id in realizada_por_lote else None
+            cantidad, costo = LotMatchingService.abierto_al(lote, consumos)
+            valor = (cantidad * lote.precio_actual_titulo).quantize(ESCALA)
+            no_realizada = (valor - costo).quantize(ESCALA)
+            if (lote.ganancia_perdida, lote.valor_actual_mercado, lote.ganancia_perdida_no_realizada) != (realizada, valor, no_realizada):
+                lote.ganancia_perdida, lote.valor_actual_mercado, lote.ganancia_perdida_no_realizada = realizada, valor, no_realizada
+                lotes_cambiados.append(lote)
+
+        # bulk_update no pasa por save(): ni recalcula la posición ni vuelve a entrar aquí.
+        if ventas_cambiadas:
+            VentaInversion.objects.bulk_update(ventas_cambiadas, ['costo_base', 'ganancia_realizada', 'metodo', 'detalle'])
+        if lotes_cambiados:
+            inversiones.objects.bulk_update(lotes_cambiados, ['ganancia_perdida', 'valor_actual_mercado', 'ganancia_perdida_no_realizada'])
+        return sum((l[1] for l in abiertos), CERO), sum((l[2] for l in abiertos), CERO)
+
+    @staticmethod
+    def reporte(user_id, anio: int) -> dict:
+        """Ganancia realizada del año por activo, desde lo ya guardado (una consulta)."""
+        por_activo = list(
+            VentaInversion.objects.filter(propietario_id=user_id, fecha_venta__year=anio)
+            .values('emisora_ticker', 'nombre_activo', 'tipo_inversion')
+            .annotate(cantidad=Sum('cantidad_titulos'), ingreso=Sum('ingreso_neto'),
+                      costo=Sum('costo_base'), ganancia=Sum('ganancia_realizada'))
+            .order_by('nombre_activo')
+        )
+        return {
+            'anio': anio,
+            'activos': por_activo,
+            'ingreso': sum((a['ingreso'] for a in por_activo), CERO),
+            'costo': sum((a['costo'] for a in por_activo), CERO),
+            'ganancia': sum((a['ganancia'] for a in por_activo), CERO),
+        }
@@ -1,24 +1,50 @@
 # finanzas/services/market_data_service.py
 import os
+import time
+import threading
 import requests
+from datetime import date, datetime, timedelta
 from decimal import Decimal
-from twelvedata import TDClient
-from cachetools import TTLCache
+from cachetools import TTLCache, LRUCache
+from django.conf import settings
 import logging
+from .scheduler_service import wait_for_rate_slot
+from ..models import TipoCambio
+from ..utils import get_redis_client
 
 logger = logging.getLogger(__name__)
 
+# Tipo de cambio: lo que tarda a lo más una llamada a currencyapi, y cuánto se espera al ganador.
+CANDADO_TTL = 15
+ESPERA_SONDEO = 0.1
+PUBLICADO_TTL = 3600
+# currencyapi entrega hasta un año de días por llamada al endpoint de rangos.
+DIAS_POR_LLAMADA = 366
+# Un fin de semana largo con feriado; más que esto ya no es arrastre sino falta de datos.
+ARRASTRE_MAX_DIAS = 7
+
 class StockPriceService:
     """Service to fetch stock prices using TwelveData with caching mechanisms."""
     
     _price_cache = TTLCache(maxsize=100, ttl=300)   # 5 mins
     _series_cache = TTLCache(maxsize=50, ttl=86400) # 1 day
+    # Llamadas reales a TwelveData hechas por este proceso (las métricas de los trabajos usan el delta).
+    llamadas_api = 0
 
     def __init__(self):
         self.api_key = os.getenv("TWELVEDATA_API_KEY")
         if not self.api_key:
             logger.warning("TWELVEDATA_API_KEY missing.")
-        self.client = TDClient(apikey=self.api_key) if self.api_key else None
+        if self.api_key:
+            from twelvedata import TDClient
+            self.client = TDClient(apikey=self.api_key)
+        else:
+            self.client = None
+
+    def _antes_de_llamar(self):
+        """Respeta el límite por minuto del plan (compartido entre workers) y cuenta la llamada."""
+        wait_for_rate_slot("twelvedata", getattr(settings, "TWELVEDATA_CALLS_PER_MINUTE", 8))
+        StockPriceService.llamadas_api += 1
 
     def get_current_price(self, ticker: str):
         if not self.client or not ticker: return None
@@ -28,6 +54,7 @@ class StockPriceService:
             return self._price_cache[cache_key]
         
         try:
+            self._antes_de_llamar()
             quote = self.client.quote(symbol=ticker)
             data = quote.as_json()
             if isinstance(data, list):
@@ -54,6 +81,7 @@ class StockPriceService:
             return self._series_cache[cache_key]
             
         try:
+            self._antes_de_llamar()
             series = self.client.time_series(
                 symbol=ticker,
                 interval=interval,
@@ -81,20 +109,176 @@ class StockPriceService:
         return float(series[0]["close"]) if series else None
 
 class ExchangeRateService:
-    """Service to fetch USD/MXN historical exchange rates."""
-    
-    def get_usd_mxn_rate(self, date_obj):
-        token = os.getenv("CURRENCYAPI_API_KEY")
-        if not token:
+    """
+    USD/MXN por día. Se consulta en orden: LRU del proceso, tabla TipoCambio y, solo si el
+    día falta, currencyapi. La llamada al proveedor es single-flight: un candado en Redis
+    por fecha hace que entre tareas concurrentes solo una llame; las demás esperan el
+    valor que esa publica. Los rangos completos se llenan con respaldar() (una llamada por
+    año de datos) y tasas() valúa series sin tocar la red.
+    """
+
+    URL = "https://api.currencyapi.com/v3"
+    # Días con dato real ya guardado: no cambian, así que no necesitan TTL.
+    _cache = LRUCache(maxsize=4096)
+    _cache_lock = threading.Lock()
+
+    def __init__(self, client=None):
+        self.token = os.getenv("CURRENCYAPI_API_KEY")
+        self._client = client
+
+    def _redis(self):
+        return self._client or get_redis_client()
+
+    # --- Proveedor ---
+
+    def _pedir(self, endpoint: str, **params):
+        if not self.token:
             logger.warning("CURRENCYAPI_API_KEY missing.")
             return None
-            
-        url = f"https://api.currencyapi.com/v3/historical?apikey={token}&currencies=MXN&base_currency=USD&date={date_obj}"
+        params.update(apikey=self.token, currencies="MXN", base_currency="USD")
+        response = requests.get(f"{self.URL}/{endpoint}", params=params, timeout=10)
+        response.raise_for_status()
+        return response.json().get('data')
+
+    def _pedir_dia(self, fecha):
+        data = self._pedir("historical", date=fecha.isoformat()) or {}
+        rate = data.get('MXN', {}).get('value')
+        return Decimal(str(rate)) if rate is not None else None
+
+    def _pedir_rango(self, desde, hasta) -> dict:
+        """{fecha: tasa} de los días que el proveedor tiene entre desde y hasta."""
+        data = self._pedir("range", datetime_start=f"{desde.isoformat()}T00:00:00Z",
+                           datetime_end=f"{hasta.isoformat()}T23:59:59Z", accuracy="day") or []
+        tasas = {}
+        for dia in data:
+            rate = dia.get('currencies', {}).get('MXN', {}).get('value')
+            if rate is not None:
+                tasas[date.fromisoformat(dia['datetime'][:10])] = Decimal(str(rate))
+        return tasas
+
+    # --- Lectura ---
+
+    def get_usd_mxn_rate(self, date_obj):
+        fecha = date_obj.date() if isinstance(date_obj, datetime) else date_obj
+        if fecha is None:
+            return None
+        with self._cache_lock:
+            if fecha in self._cache:
+                return self._cache[fecha]
+
+        fila = TipoCambio.objects.filter(fecha=fecha).values_list('usd_mxn', 'arrastrado').first()
+        if fila is not None and fila[1]:
+            # Arrastrado de otro día: tampoco va al LRU, el dato real puede llegar después.
+            return fila[0]
+        rate = fila[0] if fila is not None else self._single_flight(fecha)
+        if rate is None:
+            # Sin dato del proveedor (feriado, día en curso): el último conocido de la semana.
+            # No se guarda en el LRU para que el dato real entre en cuanto exista.
+            return TipoCambio.objects.filter(fecha__lt=fecha, fecha__gte=fecha - timedelta(days=ARRASTRE_MAX_DIAS)) \
+                .order_by('-fecha').values_list('usd_mxn', flat=True).first()
+
+        with self._cache_lock:
+            self._cache[fecha] = rate
+        return rate
+
+    def tasas(self, desde, hasta) -> dict:
+        """{fecha: tasa} de cada día del rango, con arrastre del último dato. Solo lee la tabla."""
+        filas = list(TipoCambio.objects.filter(fecha__range=(desde, hasta)).values_list('fecha', 'usd_mxn'))
+        if not filas or filas[0][0] != desde:
+            previa = TipoCambio.objects.filter(fecha__lt=desde).order_by('-fecha').values_list('fecha', 'usd_mxn').first()
+            if previa is not None:
+                filas.insert(0, previa)
+
+        resultado, conocidas, ultima = {}, dict(filas), None
+        dia = filas[0][0] if filas else hasta + timedelta(days=1)
+        while dia <= hasta:
+            ultima = conocidas.get(dia, ultima)
+            if dia >= desde and ultima is not None:
+                resultado[dia] = ultima
+            dia += timedelta(days=1)
+        return resultado
+
+    # --- Escritura ---
+
+    def _single_flight(self, fecha):
+        """Un solo llamado al proveedor por fecha entre todos los procesos."""
+        candado, valor = f"fx:usd_mxn:{fecha}:candado", f"fx:usd_mxn:{fecha}"
         try:
-            response = requests.get(url, timeout=5) # Added timeout
-            response.raise_for_status()
-            rate = response.json().get('data', {}).get('MXN', {}).get('value')
-            return Decimal(str(rate)) if rate is not None else None
+            client = self._redis()
+            publicado = client.get(valor)
+            if publicado is not None:
+                return Decimal(publicado.decode()) if publicado else None
+            ganador = client.set(candado, 1, ex=CANDADO_TTL, nx=True)
         except Exception as e:
+            logger.warning(f"Tipo de cambio: Redis no disponible ({e}), se llama sin candado.")
+            client, ganador = None, True
+
+        if not ganador:
+            # Otra tarea ya llamó: se espera lo que publique (vacío = el proveedor no tenía dato).
+            # Si suelta el candado sin publicar, su llamada falló y no hay nada que esperar.
+            limite = time.monotonic() + CANDADO_TTL
+            while time.monotonic() < limite:
+                time.sleep(ESPERA_SONDEO)
+                try:
+                    publicado = client.get(valor)
+                    if publicado is None and client.get(candado) is None:
+                        break
+                except Exception:
+                    break
+                if publicado is not None:
+                    return Decimal(publicado.decode()) if publicado else None
+            return None
+
+        try:
+            rate = self._pedir_dia(fecha)
+        except Exception as e:
+            # Falla pasajera: no se publica nada, así la siguiente llamada vuelve a intentar.
             logger.error(f"Exchange Rate error: {e}")
+            if client is not None:
+                try:
+                    client.delete(candado)
+                except Exception as e:
+                    logger.warning(f"Tipo de cambio: no se pudo soltar el candado de {fecha} ({e}).")
             return None
+        if rate is not None:
+            TipoCambio.objects.update_or_create(fecha=fecha, defaults={'usd_mxn': rate, 'arrastrado': False})
+        if client is not None:
+            try:
+                # El valor se publica en Redis: la tabla puede no verse aún si hay una transacción abierta.
+                client.set(valor, str(rate) if rate is not None else '', ex=PUBLICADO_TTL)
+                client.delete(candado)
+            except Exception as e:
+                logger.warning(f"Tipo de cambio: no se pudo publicar {fecha} ({e}).")
+        return rate
+
+    def respaldar(self, desde, hasta) -> int:
+        """
+        Guarda cada día entre desde y hasta pidiendo el rango por bloques de un año. Los huecos
+        entre dos datos del proveedor repiten el anterior (arrastrado); los días al final sin
+        dato se quedan fuera para no tapar el real cuando llegue. Devuelve los días escritos.
+        """
+        tasas, inicio = {}, desde
+        while inicio <= hasta:
+            fin = min(inicio + timedelta(days=DIAS_POR_LLAMADA - 1), hasta)
+            tasas.update(self._pedir_rango(inicio, fin))
+            inicio = fin + timedelta(days=1)
+        if not tasas:
+            return 0
+
+        reales = set(TipoCambio.objects.filter(fecha__range=(desde, hasta), arrastrado=False).values_list('fecha', flat=True))
+        previa = TipoCambio.objects.filter(fecha__lt=desde).order_by('-fecha').values_list('usd_mxn', flat=True).first()
+        filas, ultima, dia = [], previa, desde
+        while dia <= max(tasas):
+            if dia in tasas:
+                ultima = tasas[dia]
+                filas.append(TipoCambio(fecha=dia, usd_mxn=ultima, arrastrado=False))
+            elif ultima is not None and dia not in reales:
+                filas.append(TipoCambio(fecha=dia, usd_mxn=ultima, arrastrado=True))
+            dia += timedelta(days=1)
+
+        TipoCambio.objects.bulk_create(filas, batch_size=1000, update_conflicts=True,
+                                       unique_fields=['fecha'], update_fields=['usd_mxn', 'arrastrado', 'actualizado'])
+        with self._cache_lock:
+            for fila in filas:
+                self._cache.pop(fila.fecha, None)
+        return len(filas)
@@ -0,0 +1,172 @@
+# finanzas/services/net_worth_service.py
+import bisect
+import logging
+from decimal import Decimal
+from datetime import date, timedelta
+from collections import defaultdict
+
+from django.db.models import Q, Sum, Min
+from django.utils import timezone
+
+from ..managers import efecto_en_cuentas
+from .data_version_service import DataVersionService
+from ..models import (
+    Cuenta, Deuda, PagoAmortizacion, PortfolioHistory, registro_transacciones,
+    SaldoMensualCuenta, NetWorthSnapshot,
+)
+
+logger = logging.getLogger(__name__)
+
+# El trabajo nocturno rellena como máximo este hueco; para más atrás está backfill_patrimonio.
+MAX_DIAS_RELLENO = 31
+
+
+def _escalon(fechas: list, valores: list, dia: date, antes=Decimal('0')):
+    """Valor vigente en 'dia' de una serie escalonada (último punto <= dia)."""
+    i = bisect.bisect_right(fechas, dia)
+    return valores[i - 1] if i else antes
+
+
+class NetWorthService:
+    """
+    Patrimonio diario por usuario: saldo de cuentas + valor del portafolio - deudas.
+    serie_diaria() arma cualquier rango con un número fijo de consultas (no una por día),
+    así que sirve igual para el snapshot nocturno que para un respaldo de años.
+    """
+
+    @staticmethod
+    def serie_diaria(user, desde: date, hasta: date) -> list[dict]:
+        hoy = timezone.now().date()
+        dias = [desde + timedelta(days=i) for i in range((hasta - desde).days + 1)]
+        if not dias:
+            return []
+
+        # --- Cuentas (las de crédito se cuentan como deuda) ---
+        cuentas = list(Cuenta.objects.filter(propietario=user).exclude(tipo='CREDITO'))
+        nombres_cuentas = {c.nombre for c in cuentas}
+        base_cuentas = sum((SaldoMensualCuenta.objects.saldo_al(c, desde - timedelta(days=1)) for c in cuentas), Decimal('0'))
+
+        # --- Deudas ---
+        deudas = list(Deuda.objects.filter(propietario=user))
+        tarjetas = {d.nombre: d for d in deudas if d.tipo_deuda == 'TARJETA_CREDITO'}
+        tarjetas_por_id = {d.id: d for d in tarjetas.values()}
+        prestamos = [d for d in deudas if d.tipo_deuda == 'PRESTAMO']
+        # Saldo programado de cada préstamo: saldo_insoluto tras cada vencimiento.
+        calendario = defaultdict(lambda: ([], []))
+        for deuda_id, vence, saldo in (PagoAmortizacion.objects.filter(deuda__in=prestamos)
+                                       .order_by('deuda_id', 'fecha_vencimiento')
+                                       .values_list('deuda_id', 'fecha_vencimiento', 'saldo_insoluto')):
+            calendario[deuda_id][0].append(vence)
+            calendario[deuda_id][1].append(saldo)
+
+        # --- Movimientos diarios de cuentas y tarjetas en el rango, en una consulta ---
+        nombres = nombres_cuentas | set(tarjetas)
+        flujo_cuentas = defaultdict(Decimal)
+        flujo_tarjetas = defaultdict(Decimal)
+        movimientos = (registro_transacciones.objects
+                       .filter(propietario=user, fecha__gte=desde)
+                       .filter(Q(cuenta_origen__in=nombres) | Q(cuenta_destino__in=nombres) |
+                               Q(deuda_asociada_id__in=tarjetas_por_id, tipo_pago='TARJETA_CREDITO'))
+                       .values('fecha', 'tipo', 'cuenta_origen', 'cuenta_destino', 'deuda_asociada_id', 'tipo_pago')
+                       .annotate(total=Sum('monto')))
+        for m in movimientos:
+            if m['fecha'] <= hasta:
+                for nombre, delta in efecto_en_cuentas(m['tipo'], m['cuenta_origen'], m['cuenta_destino'], m['total']).items():
+                    if nombre in nombres_cuentas:
+                        flujo_cuentas[m['fecha']] += delta
+            # Lo que cambió el adeudo de las tarjetas (hasta hoy) para reconstruirlo hacia atrás.
+            if m['tipo'] == 'TRANSFERENCIA' and m['cuenta_destino'] in tarjetas:
+                flujo_tarjetas[m['fecha']] -= m['total']
+            elif ((m['tipo'] == 'GASTO' and m['cuenta_origen'] in tarjetas) or
+                  (m['tipo_pago'] == 'TARJETA_CREDITO' and m['deuda_asociada_id'] in tarjetas_por_id)):
+                flujo_tarjetas[m['fecha']] += m['total']
+
+        # Adeudo de tarjetas al cierre de 'desde - 1': el actual menos todo lo movido desde entonces.
+        adeudo_tarjetas = sum((d.total_gastado for d in tarjetas.values()), Decimal('0')) - sum(flujo_tarjetas.values(), Decimal('0'))
+
+        # --- Portafolio (se arrastra el último valor conocido) ---
+        historial = [(f, v) for f, v, _, _ in PortfolioHistory.objects.serie(user.pk, hasta=hasta)]
+        fechas_port = [f for f, _ in historial]
+        valores_port = [v for _, v in historial]
+
+        serie, saldo_cuentas = [], base_cuentas
+        for dia in dias:
+            saldo_cuentas += flujo_cuentas.get(dia, 0)
+            adeudo_tarjetas += flujo_tarjetas.get(dia, 0)
+            deuda_prestamos = Decimal('0')
+            for p in prestamos:
+                if dia >= hoy or p.id not in calendario:
+                    deuda_prestamos += p.saldo_pendiente or 0
+                elif dia >= p.fecha_adquisicion:
+                    deuda_prestamos += _escalon(*calendario[p.id], dia, antes=p.monto_total)
+            inversion = _escalon(fechas_port, valores_port, dia)
+            deuda_total = deuda_prestamos + max(adeudo_tarjetas, Decimal('0'))
+            serie.append({
+                'fecha': dia,
+                'cuentas': saldo_cuentas,
+                'inversiones': inversion,
+                'deudas': deuda_total,
+                'patrimonio': saldo_cuentas + inversion - deuda_total,
+            })
+        return serie
+
+    @staticmethod
+    def guardar(user, desde: date, hasta: date) -> int:
+        """Calcula el rango y lo guarda con un solo upsert masivo."""
+        serie = NetWorthService.serie_diaria(user, desde, hasta)
+        NetWorthSnapshot.objects.bulk_create(
+            [NetWorthSnapshot(usuario=user, **dia) for dia in serie],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['usuario', 'fecha'],
+            update_fields=['cuentas', 'inversiones', 'deudas', 'patrimonio'],
+        )
+        DataVersionService.avanzar(user.pk)
+        return len(serie)
+
+    @staticmethod
+    def usuarios_con_datos() -> list[int]:
+        return sorted(set(Cuenta.objects.values_list('propietario_id', flat=True)) |
+                      set(Deuda.objects.values_list('propietario_id', flat=True)) |
+                      PortfolioHistory.objects.usuarios())
+
+    @staticmethod
+    def primera_fecha(user) -> date | None:
+        """Primer día con datos del usuario (transacción, deuda o historial de portafolio)."""
+        candidatas = [
+            registro_transacciones.objects.filter(propietario=user).aggregate(f=Min('fecha'))['f'],
+            Deuda.objects.filter(propietario=user).aggregate(f=Min('fecha_adquisicion'))['f'],
+            PortfolioHistory.objects.primera_fecha(user.pk),
+        ]
+        candidatas = [f for f in candidatas if f]
+        return min(candidatas) if candidatas else None
+
+    @staticmethod
+    def respaldar(user, desde: date | None = None) -> int:
+        """Backfill completo (o desde 'desde') hasta hoy."""
+        desde = desde or NetWorthService.primera_fecha(user)
+        if not desde:
+            return 0
+        return NetWorthService.guardar(user, desde, timezone.now().date())
+
+    @staticmethod
+    def snapshot_nocturno(user) -> int:
+        """Guarda el día de hoy y rellena los días que falten desde el último snapshot."""
+        hoy = timezone.now().date()
+        ultimo = NetWorthSnapshot.objects.filter(usuario=user).order_by('-fecha').values_list('fecha', flat=True).first()
+        desde = max(ultimo + timedelta(days=1), hoy - timedelta(days=MAX_DIAS_RELLENO)) if ultimo else hoy
+        return NetWorthService.guardar(user, min(desde, hoy), hoy)
+
+    @staticmethod
+    def reducir(filas: list, puntos: int) -> list:
+        """
+        Reduce una serie diaria a ~'puntos' tomando el último día de cada tramo
+        (es un saldo, no un flujo) y conservando siempre el último punto.
+        """
+        if puntos <= 0 or len(filas) <= puntos:
+            return filas
+        paso = -(-len(filas) // puntos)
+        reducida = filas[paso - 1::paso]
+        if reducida[-1] is not filas[-1]:
+            reducida.append(filas[-1])
+        return reducida
@@ -0,0 +1,152 @@
+# finanzas/services/portfolio_metrics_service.py
+import logging
+
+import orjson
+
+from ..models import PortfolioHistory
+from ..utils import get_redis_client
+from .data_version_service import DataVersionService
+
+logger = logging.getLogger(__name__)
+
+# La clave lleva la versión de datos; el TTL solo limpia versiones viejas.
+METRICAS_TTL = 24 * 3600
+
+# El historial es de días naturales (fines de semana repiten precio): se anualiza con 365.
+DIAS_ANIO = 365
+VENTANA_VOLATILIDAD = 30
+
+# Arranques simultáneos del Newton de la TIR; se queda la raíz convergida con menor residuo.
+ARRANQUES_TIR = (-0.9, -0.5, -0.1, 0.0, 0.1, 0.5, 1.0, 3.0)
+ITERACIONES_TIR = 60
+TOLERANCIA_TIR = 1e-9
+
+
+class PortfolioMetricsService:
+    """
+    Métricas de rendimiento del portafolio sobre el historial diario, como operaciones de
+    arreglos: rendimiento ponderado por tiempo (TWR), TIR por dinero (XIRR), máxima caída y
+    volatilidad móvil. Los flujos son las compras: el cambio diario de capital_invertido,
+    que es lo mismo con lo que se valuó el historial. Se guardan en Redis por usuario y
+    versión de datos, así que solo se recalculan cuando algo cambió.
+    """
+
+    @staticmethod
+    def rendimientos_diarios(valores: 'np.ndarray', flujos: 'np.ndarray') -> 'np.ndarray':
+        """
+        r_t = (V_t - F_t) / V_{t-1} - 1: el flujo del día entra al cierre y no cuenta como
+        ganancia. Los días sin valor previo (antes de la primera compra) rinden 0.
+        """
+        import numpy as np
+        previos = valores[:-1]
+        r = np.zeros(len(valores) - 1)
+        con_base = previos > 0
+        r[con_base] = (valores[1:][con_base] - flujos[1:][con_base]) / previos[con_base] - 1
+        return r
+
+    @staticmethod
+    def xirr(montos: 'np.ndarray', anios: 'np.ndarray') -> float | None:
+        """
+        Tasa anual r con sum(monto_i / (1 + r)^t_i) = 0. El Newton corre con varios arranques
+        a la vez (una matriz arranques × flujos por iteración). None si ninguno converge o
+        los flujos no cambian de signo.
+        """
+        import numpy as np
+        if not (np.any(montos > 0) and np.any(montos < 0)):
+            return None
+        tasas = np.array(ARRANQUES_TIR)
+        with np.errstate(all='ignore'):
+            for _ in range(ITERACIONES_TIR):
+                base = 1.0 + tasas[:, None]
+                descuento = base ** -anios[None, :]
+                vpn = (montos * descuento).sum(axis=1)
+                derivada = (-anios * montos * descuento / base).sum(axis=1)
+                paso = vpn / derivada
+                # Una tasa bajo -100% no tiene sentido: se acerca al límite sin cruzarlo.
+                tasas = np.maximum(tasas - paso, (tasas - 1.0) / 2)
+                if np.all(~np.isfinite(paso) | (np.abs(paso) < TOLERANCIA_TIR)):
+                    break
+            residuo = np.abs((montos * (1.0 + tasas[:, None]) ** -anios[None, :]).sum(axis=1))
+        validas = np.isfinite(tasas) & np.isfinite(residuo) & (tasas > -1) & \
+            (residuo <= 1e-6 * max(np.abs(montos).sum(), 1.0))
+        if not validas.any():
+            return None
+        return float(tasas[validas][np.argmin(residuo[validas])])
+
+    @staticmethod
+    def calcular(fechas: list, valores, capital) -> dict | None:
+        """Métricas de una serie diaria (fechas consecutivas). None con menos de dos días."""
+        import numpy as np
+        if len(fechas) < 2:
+            return None
+        valores = np.asarray(valores, dtype=float)
+        capital = np.asarray(capital, dtype=float)
+        flujos = np.diff(capital, prepend=0.0)
+        dias = (fechas[-1] - fechas[0]).days
+
+        r = PortfolioMetricsService.rendimientos_diarios(valores, flujos)
+        indice = np.concatenate(([1.0], np.cumprod(1.0 + r)))
+        twr = indice[-1] - 1.0
+        twr_anual = indice[-1] ** (DIAS_ANIO / dias) - 1.0 if dias >= DIAS_ANIO and indice[-1] > 0 else None
+
+        # Máxima caída sobre el índice TWR: las aportaciones no tapan las bajas.
+        picos = np.maximum.accumulate(indice)
+        caidas = indice / picos - 1.0
+        fondo = int(np.argmin(caidas))
+        pico = int(np.argmax(indice[:fondo + 1]))
+
+        volatilidad_movil = None
+        if len(r) >= VENTANA_VOLATILIDAD:
+            ventanas = np.lib.stride_tricks.sliding_window_view(r, VENTANA_VOLATILIDAD)
+            volatilidad_movil = ventanas.std(axis=1, ddof=1) * np.sqrt(DIAS_ANIO)
+
+        # La TIR ve a las compras como salidas y al valor final como la entrada que cierra.
+        con_flujo = np.flatnonzero(flujos)
+        ordinales = np.fromiter((f.toordinal() for f in fechas), dtype=float, count=len(fechas))
+        montos = np.append(-flujos[con_flujo], valores[-1])
+        anios = (np.append(ordinales[con_flujo], ordinales[-1]) - ordinales[0]) / DIAS_ANIO
+
+        return {
+            'desde': fechas[0].isoformat(),
+            'hasta': fechas[-1].isoformat(),
+            'twr': float(twr),
+            'twr_anual': float(twr_anual) if twr_anual is not None else None,
+            'xirr': PortfolioMetricsService.xirr(montos, anios),
+            'max_drawdown': float(caidas[fondo]),
+            'drawdown_pico': fechas[pico].isoformat(),
+            'drawdown_fondo': fechas[fondo].isoformat(),
+            'volatilidad_anual': float(r.std(ddof=1) * np.sqrt(DIAS_ANIO)) if len(r) > 1 else None,
+            'volatilidad_30d': float(volatilidad_movil[-1]) if volatilidad_movil is not None else None,
+            'volatilidad_30d_max': float(volatilidad_movil.max()) if volatilidad_movil is not None else None,
+        }
+
+    @staticmethod
+    def _clave(user_id, version) -> str:
+        return f"metricas:{user_id}:{version}"
+
+    @staticmethod
+    def de_usuario(user_id) -> dict | None:
+        """Métricas de todo el historial del usuario, desde Redis si la versión no cambió."""
+        version = DataVersionService.actual(user_id)
+        clave = PortfolioMetricsService._clave(user_id, version) if version is not None else None
+        if clave is not None:
+            try:
+                guardado = get_redis_client().get(clave)
+                if guardado is not None:
+                    return orjson.loads(guardado)
+            except Exception as e:
+                logger.warning(f"Métricas del portafolio: Redis no disponible ({e}), se calculan.")
+
+        fechas, valores, capital = [], [], []
+        for f, v, c, _ in PortfolioHistory.objects.serie(user_id):
+            fechas.append(f)
+            valores.append(float(v))
+            capital.append(float(c))
+        metricas = PortfolioMetricsService.calcular(fechas, valores, capital)
+
+        if clave is not None:
+            try:
+                get_redis_client().set(clave, orjson.dumps(metricas), ex=METRICAS_TTL)
+            except Exception as e:
+                logger.warning(f"Métricas del portafolio: no se pudieron guardar ({e}).")
+        return metricas
@@ -0,0 +1,153 @@
+# finanzas/services/portfolio_series_service.py
+import logging
+from datetime import date
+
+import orjson
+
+from ..models import PortfolioHistory
+from ..utils import get_redis_client
+from .market_data_service import ExchangeRateService
+
+logger = logging.getLogger(__name__)
+
+# El cálculo nocturno reescribe los resúmenes; el TTL solo limpia usuarios inactivos.
+RESUMEN_TTL = 8 * 24 * 3600
+
+# 'auto' usa la resolución más fina que no pase de puntos × este factor; LTTB reduce el resto.
+FACTOR_RESOLUCION = 4
+
+DIAS_POR_PUNTO = {'diaria': 1, 'semanal': 7, 'mensual': 30}
+
+
+class PortfolioSeriesService:
+    """
+    Serie de rendimiento del portafolio para la gráfica, por rango y con tope de puntos.
+    La diaria se lee de PortfolioHistory; la semanal y la mensual (último día de cada
+    semana ISO / mes, porque es un saldo) se precalculan al reconstruir el historial y se
+    guardan en Redis. Lo que exceda 'puntos' se reduce con LTTB, que conserva picos y valles.
+    Las filas son (fecha, valor_total, capital_invertido, ganancia_no_realizada) en float.
+    """
+
+    RESOLUCIONES = tuple(DIAS_POR_PUNTO)
+    MONEDAS = ('USD', 'MXN')
+
+    @staticmethod
+    def lttb(valores: list, puntos: int) -> list[int]:
+        """
+        Índices que elige Largest-Triangle-Three-Buckets: por cada cubeta, el punto que forma
+        el triángulo más grande con el elegido anterior y el promedio de la cubeta siguiente.
+        El eje x es la posición (la serie es regular). Conserva siempre el primero y el último.
+        """
+        n = len(valores)
+        if puntos >= n:
+            return list(range(n))
+        if puntos < 3:
+            return [0, n - 1][:max(puntos, 1)]
+
+        cubetas = puntos - 2
+        elegidos = [0]
+        a = 0
+        for i in range(cubetas):
+            inicio, fin = i * (n - 2) // cubetas + 1, (i + 1) * (n - 2) // cubetas + 1
+            sig_fin = (i + 2) * (n - 2) // cubetas + 1 if i + 1 < cubetas else n
+            prom_x = (fin + sig_fin - 1) / 2
+            prom_y = sum(valores[fin:sig_fin]) / (sig_fin - fin)
+
+            ax, ay = a, valores[a]
+            mejor, area_max = inicio, -1.0
+            for j in range(inicio, fin):
+                area = abs((ax - prom_x) * (valores[j] - ay) - (ax - j) * (prom_y - ay))
+                if area > area_max:
+                    mejor, area_max = j, area
+            elegidos.append(mejor)
+            a = mejor
+        elegidos.append(n - 1)
+        return elegidos
+
+    @staticmethod
+    def remuestrear(filas: list, resolucion: str) -> list:
+        """Último día de cada semana ISO ('semanal') o de cada mes ('mensual')."""
+        if resolucion == 'diaria':
+            return list(filas)
+        periodo = (lambda f: f.isocalendar()[:2]) if resolucion == 'semanal' else (lambda f: (f.year, f.month))
+        resumen = []
+        for fila in filas:
+            if resumen and periodo(resumen[-1][0]) == periodo(fila[0]):
+                resumen[-1] = fila
+            else:
+                resumen.append(fila)
+        return resumen
+
+    @staticmethod
+    def _clave(user_id, resolucion) -> str:
+        return f"portafolio:{user_id}:{resolucion}"
+
+    @staticmethod
+    def _diarias(user_id, desde=None, hasta=None) -> list:
+        return [(f, float(v), float(c), float(g)) for f, v, c, g in PortfolioHistory.objects.serie(user_id, desde, hasta)]
+
+    @staticmethod
+    def precalcular(user_id, filas=None) -> dict:
+        """Arma y guarda en Redis la serie semanal y la mensual. 'filas' evita releer la diaria."""
+        filas = PortfolioSeriesService._diarias(user_id) if filas is None else \
+            [(f, float(v), float(c), float(g)) for f, v, c, g in filas]
+        resumenes = {r: PortfolioSeriesService.remuestrear(filas, r) for r in ('semanal', 'mensual')}
+        try:
+            pipe = get_redis_client().pipeline()
+            for resolucion, resumen in resumenes.items():
+                pipe.set(PortfolioSeriesService._clave(user_id, resolucion),
+                         orjson.dumps([(f.isoformat(), v, c, g) for f, v, c, g in resumen]), ex=RESUMEN_TTL)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Serie del portafolio: no se pudo guardar el resumen del usuario {user_id} ({e}).")
+        return resumenes
+
+    @staticmethod
+    def resumen(user_id, resolucion: str) -> list:
+        """Serie semanal o mensual completa; si Redis no la tiene se arma desde la diaria."""
+        try:
+            guardado = get_redis_client().get(PortfolioSeriesService._clave(user_id, resolucion))
+            if guardado is not None:
+                return [(date.fromisoformat(f), v, c, g) for f, v, c, g in orjson.loads(guardado)]
+        except Exception as e:
+            logger.warning(f"Serie del portafolio: Redis no disponible ({e}), se arma desde la base.")
+        return PortfolioSeriesService.precalcular(user_id)[resolucion]
+
+    @staticmethod
+    def elegir_resolucion(desde: date, hasta: date, puntos: int) -> str:
+        dias = (hasta - desde).days + 1
+        return next((r for r, paso in DIAS_POR_PUNTO.items() if dias / paso <= puntos * FACTOR_RESOLUCION), 'mensual')
+
+    @staticmethod
+    def serie(user_id, hasta: date, desde: date | None = None, puntos: int = 300, resolucion: str = 'auto',
+              moneda: str = 'USD') -> dict:
+        """
+        Serie entre 'desde' (None = desde el inicio) y 'hasta' con a lo más 'puntos' puntos.
+        resolucion: 'auto' | 'diaria' | 'semanal' | 'mensual'. moneda: 'USD' (la del historial)
+        o 'MXN', con el tipo de cambio de cada fecha leído de la tabla (sin llamadas a la red).
+        """
+        if resolucion == 'auto':
+            inicio = desde or PortfolioHistory.objects.primera_fecha(user_id)
+            resolucion = PortfolioSeriesService.elegir_resolucion(inicio, hasta, puntos) if inicio else 'diaria'
+
+        if resolucion == 'diaria':
+            filas = PortfolioSeriesService._diarias(user_id, desde, hasta)
+        else:
+            filas = [fila for fila in PortfolioSeriesService.resumen(user_id, resolucion)
+                     if (desde is None or fila[0] >= desde) and fila[0] <= hasta]
+
+        indices = PortfolioSeriesService.lttb([v for _, v, _, _ in filas], puntos)
+        filas = [filas[i] for i in indices]
+        if moneda == 'MXN' and filas:
+            tasas = ExchangeRateService().tasas(filas[0][0], filas[-1][0])
+            # Las fechas anteriores al primer tipo de cambio guardado no se pueden convertir.
+            filas = [(f, v * float(tasas[f]), c * float(tasas[f]), g * float(tasas[f]))
+                     for f, v, c, g in filas if f in tasas]
+        return {
+            'resolucion': resolucion,
+            'moneda': moneda,
+            'labels': [f.isoformat() for f, _, _, _ in filas],
+            'valores': [v for _, v, _, _ in filas],
+            'capital': [c for _, _, c, _ in filas],
+            'ganancias': [g for _, _, _, g in filas],
+        }
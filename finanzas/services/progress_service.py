@@ -0,0 +1,150 @@
+# finanzas/services/progress_service.py
+import json
+import logging
+from ..utils import (
+    get_redis_client, get_redis_stream_client, get_redis_async_stream_client, REDIS_BLOQUEO_MAX_SEGUNDOS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Un escaneo vive 1 día en Redis; el stream se recorta para no crecer sin límite.
+SCAN_TTL_SECONDS = 86400
+STREAM_MAXLEN = 5000
+
+# Estado devuelto por los process_single_* -> tipo de evento publicado.
+EVENTO_POR_ESTADO = {
+    'SUCCESS': 'done',
+    'SKIPPED': 'done',
+    'FAILURE': 'failed',
+    'UNSUPPORTED': 'failed',
+    'THROTTLED': 'throttled',
+}
+EVENTOS_FINALES = ('done', 'failed', 'throttled')
+
+
+class ScanProgress:
+    """
+    Canal de progreso de un escaneo de Drive. Cada escaneo (identificado por el id
+    de la tarea lanzadora) tiene un stream de eventos y un hash de contadores, así
+    que consultar el avance cuesta O(1) sin importar cuántos archivos tenga el grupo.
+    """
+    def __init__(self, client=None, async_client=None):
+        self.client = client or get_redis_client()
+        # XREAD bloquea hasta block_ms: con el timeout corto del cliente compartido fallaría.
+        self.stream_client = client or get_redis_stream_client()
+        # Para las vistas async (SSE): si no se inyecta, aread() abre uno y aclose() lo cierra.
+        self._async_client = async_client
+        self._async_propio = False
+
+    @staticmethod
+    def _stream_key(scan_id: str) -> str:
+        return f"scan:{scan_id}:events"
+
+    @staticmethod
+    def _meta_key(scan_id: str) -> str:
+        return f"scan:{scan_id}:meta"
+
+    @staticmethod
+    def _group_key(group_id: str) -> str:
+        return f"scan:group:{group_id}"
+
+    def start(self, scan_id: str, user_id: int, total: int):
+        pipe = self.client.pipeline()
+        pipe.hset(self._meta_key(scan_id), mapping={
+            'user_id': user_id, 'total': total, 'group_id': '',
+            'done': 0, 'failed': 0, 'throttled': 0, 'finished': 0,
+        })
+        pipe.expire(self._meta_key(scan_id), SCAN_TTL_SECONDS)
+        self._add(pipe, scan_id, 'started', {'total': total})
+        pipe.execute()
+
+    def link_group(self, scan_id: str, group_id: str):
+        pipe = self.client.pipeline()
+        pipe.hset(self._meta_key(scan_id), 'group_id', group_id)
+        pipe.set(self._group_key(group_id), scan_id, ex=SCAN_TTL_SECONDS)
+        self._add(pipe, scan_id, 'linked', {'group_id': group_id})
+        pipe.execute()
+
+    def close(self, scan_id: str, user_id: int, result: dict):
+        """Cierra un escaneo que no lanzó subtareas (sin archivos o error en la tarea lanzadora)."""
+        try:
+            pipe = self.client.pipeline()
+            pipe.hset(self._meta_key(scan_id), mapping={'user_id': user_id, 'total': 0, 'finished': 0})
+            pipe.expire(self._meta_key(scan_id), SCAN_TTL_SECONDS)
+            self._add(pipe, scan_id, 'completed', result)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"No se pudo cerrar el escaneo {scan_id}: {e}")
+
+    def _add(self, pipe, scan_id: str, event: str, data: dict):
+        pipe.xadd(self._stream_key(scan_id), {'event': event, 'data': json.dumps(data, default=str)},
+                  maxlen=STREAM_MAXLEN, approximate=True)
+        pipe.expire(self._stream_key(scan_id), SCAN_TTL_SECONDS)
+
+    def publish(self, scan_id: str, event: str, data: dict):
+        """Publica un evento por archivo. Los eventos finales actualizan los contadores."""
+        try:
+            pipe = self.client.pipeline()
+            self._add(pipe, scan_id, event, data)
+            if event in EVENTOS_FINALES:
+                pipe.hincrby(self._meta_key(scan_id), event, 1)
+                pipe.hincrby(self._meta_key(scan_id), 'finished', 1)
+                pipe.hget(self._meta_key(scan_id), 'total')
+            results = pipe.execute()
+            if event in EVENTOS_FINALES:
+                finished, total = results[-2], int(results[-1] or 0)
+                # HINCRBY es atómico: solo el último archivo en terminar ve finished == total.
+                if total and finished == total:
+                    pipe = self.client.pipeline()
+                    self._add(pipe, scan_id, 'completed', self.summary(scan_id))
+                    pipe.execute()
+        except Exception as e:
+            logger.warning(f"No se pudo publicar progreso del escaneo {scan_id}: {e}")
+
+    def publish_result(self, scan_id: str, result: dict):
+        evento = EVENTO_POR_ESTADO.get(result.get('status'), 'failed')
+        self.publish(scan_id, evento, result)
+
+    def summary(self, scan_id: str) -> dict:
+        raw = self.client.hgetall(self._meta_key(scan_id))
+        if not raw:
+            return {}
+        meta = {k.decode(): v.decode() for k, v in raw.items()}
+        resumen = {k: int(meta.get(k) or 0) for k in ('user_id', 'total', 'done', 'failed', 'throttled', 'finished')}
+        resumen['group_id'] = meta.get('group_id') or None
+        return resumen
+
+    def summary_for_group(self, group_id: str) -> dict:
+        scan_id = self.client.get(self._group_key(group_id))
+        return self.summary(scan_id.decode()) if scan_id else {}
+
+    @staticmethod
+    def _eventos(respuesta) -> list:
+        eventos = []
+        for _, entradas in respuesta or []:
+            for entry_id, campos in entradas:
+                eventos.append((entry_id.decode(), campos[b'event'].decode(), json.loads(campos[b'data'])))
+        return eventos
+
+    @staticmethod
+    def _tope_bloqueo(block_ms):
+        return min(block_ms, REDIS_BLOQUEO_MAX_SEGUNDOS * 1000) if block_ms else block_ms
+
+    def read(self, scan_id: str, last_id: str = '0', block_ms: int = 15000, count: int = 100) -> list:
+        """Lee eventos posteriores a last_id. Devuelve [(id, evento, datos), ...]."""
+        respuesta = self.stream_client.xread({self._stream_key(scan_id): last_id}, count=count,
+                                             block=self._tope_bloqueo(block_ms))
+        return self._eventos(respuesta)
+
+    async def aread(self, scan_id: str, last_id: str = '0', block_ms: int = 15000, count: int = 100) -> list:
+        """Como read(), pero sin ocupar un hilo mientras XREAD espera."""
+        if self._async_client is None:
+            self._async_client, self._async_propio = get_redis_async_stream_client(), True
+        respuesta = await self._async_client.xread({self._stream_key(scan_id): last_id}, count=count,
+                                                   block=self._tope_bloqueo(block_ms))
+        return self._eventos(respuesta)
+
+    async def aclose(self):
+        if self._async_propio:
+            await self._async_client.aclose()
+            self._async_client, self._async_propio = None, False
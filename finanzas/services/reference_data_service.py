@@ -0,0 +1,135 @@
+# finanzas/services/reference_data_service.py
+import pickle
+import logging
+import contextvars
+from contextlib import contextmanager
+
+from django.db import transaction
+
+from ..models import Cuenta, Deuda
+from ..utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# La copia en Redis se invalida por versión; el TTL solo limpia usuarios inactivos.
+REFERENCIAS_TTL = 3600
+
+# Memo de la petición o tarea en curso ({user_id: Referencias}); None fuera de un alcance.
+_memo = contextvars.ContextVar('referencias_usuario', default=None)
+
+
+def clave_nombre(nombre) -> str:
+    """Nombre normalizado como lo compara la collation de MySQL: sin mayúsculas ni espacios de sobra."""
+    return (nombre or '').strip().casefold()
+
+
+class Referencias:
+    """
+    Cuentas y deudas de un usuario indexadas por nombre (el vínculo que usan las transacciones).
+    Las llaves van normalizadas con clave_nombre(): búsquense con cuenta()/deuda()/tarjeta().
+    """
+    # Cambia si cambia cómo se indexa, para no leer copias viejas de Redis.
+    FORMATO = 2
+
+    def __init__(self, cuentas: list, deudas: list):
+        self.cuentas = {clave_nombre(c.nombre): c for c in cuentas}
+        self.deudas = {clave_nombre(d.nombre): d for d in deudas}
+
+    def cuenta(self, nombre):
+        return self.cuentas.get(clave_nombre(nombre))
+
+    def deuda(self, nombre):
+        return self.deudas.get(clave_nombre(nombre))
+
+    def tarjeta(self, nombre):
+        deuda = self.deuda(nombre)
+        return deuda if deuda is not None and deuda.tipo_deuda == 'TARJETA_CREDITO' else None
+
+    def tarjetas(self) -> list:
+        return [d for d in self.deudas.values() if d.tipo_deuda == 'TARJETA_CREDITO']
+
+    def deuda_por_id(self, deuda_id):
+        return next((d for d in self.deudas.values() if d.id == deuda_id), None)
+
+    def cuentas_debito(self) -> list:
+        """Cuentas de débito con la principal primero."""
+        return sorted((c for c in self.cuentas.values() if c.tipo == 'DEBITO'),
+                      key=lambda c: (not c.es_principal, c.id))
+
+
+class ReferenceDataService:
+    """
+    Cargador de las cuentas y deudas de un usuario. Dentro de una petición o tarea se
+    consultan una sola vez (memo); entre procesos se comparte una copia en Redis bajo
+    refs:{user}:{versión}. Cada escritura de Cuenta o Deuda sube la versión al confirmarse
+    la transacción, así que una copia armada con datos viejos nunca se vuelve a leer.
+    """
+
+    @staticmethod
+    def _clave_version(user_id) -> str:
+        return f"refs:{user_id}:v"
+
+    @staticmethod
+    def abrir_alcance():
+        """Abre un memo para la petición o tarea en curso; devuelve el token para cerrarlo."""
+        return _memo.set({})
+
+    @staticmethod
+    def cerrar_alcance(token):
+        _memo.reset(token)
+
+    @staticmethod
+    @contextmanager
+    def alcance():
+        token = ReferenceDataService.abrir_alcance()
+        try:
+            yield
+        finally:
+            ReferenceDataService.cerrar_alcance(token)
+
+    @staticmethod
+    def de_usuario(user) -> Referencias:
+        user_id = getattr(user, 'pk', user)
+        memo = _memo.get()
+        if memo is not None and user_id in memo:
+            return memo[user_id]
+        refs = ReferenceDataService._cargar(user_id)
+        if memo is not None:
+            memo[user_id] = refs
+        return refs
+
+    @staticmethod
+    def _cargar(user_id) -> Referencias:
+        clave = None
+        try:
+            client = get_redis_client()
+            version = int(client.get(ReferenceDataService._clave_version(user_id)) or 0)
+            clave = f"refs:{user_id}:{version}:{Referencias.FORMATO}"
+            guardado = client.get(clave)
+            if guardado is not None:
+                return pickle.loads(guardado)
+        except Exception as e:
+            logger.warning(f"Referencias: Redis no disponible ({e}), se consulta la base.")
+
+        refs = Referencias(list(Cuenta.objects.filter(propietario_id=user_id).order_by('id')),
+                           list(Deuda.objects.filter(propietario_id=user_id).order_by('id')))
+        if clave is not None:
+            try:
+                client.set(clave, pickle.dumps(refs), ex=REFERENCIAS_TTL)
+            except Exception as e:
+                logger.warning(f"Referencias: no se pudo guardar en Redis ({e}).")
+        return refs
+
+    @staticmethod
+    def invalidar(user_id):
+        """Tras escribir una Cuenta o Deuda: descarta el memo y sube la versión al confirmar."""
+        memo = _memo.get()
+        if memo is not None:
+            memo.pop(user_id, None)
+
+        def _subir_version():
+            try:
+                get_redis_client().incr(ReferenceDataService._clave_version(user_id))
+            except Exception as e:
+                logger.warning(f"Referencias: no se pudo invalidar en Redis ({e}).")
+        transaction.on_commit(_subir_version)
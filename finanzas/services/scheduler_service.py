@@ -0,0 +1,226 @@
+# finanzas/services/scheduler_service.py
+import time
+import uuid
+import random
+import logging
+from contextlib import contextmanager
+from django.conf import settings
+from ..utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Límites por defecto de cada proveedor. Se pueden sobreescribir con AI_PROVIDER_LIMITS en settings.
+DEFAULT_PROVIDER_LIMITS = {
+    "gemini": {"initial": 4, "min": 1, "max": 15, "latency_target": 8.0},
+    "mistral": {"initial": 2, "min": 1, "max": 6, "latency_target": 12.0},
+}
+
+# AIMD: +1 slot por "ventana" de éxitos, x0.5 ante un 429.
+ADDITIVE_INCREASE = 1.0
+MULTIPLICATIVE_DECREASE = 0.5
+LATENCY_EWMA_ALPHA = 0.2
+BACKOFF_BASE_SECONDS = 5.0
+BACKOFF_CAP_SECONDS = 300.0
+# Cada slot es una concesión con vencimiento propio (ZSET token -> vence): si un worker
+# muere con uno tomado, deja de contar tras este tiempo aunque otros sigan adquiriendo.
+INFLIGHT_TTL_SECONDS = 120
+
+_ACQUIRE_LUA = """
+local state = redis.call('HMGET', KEYS[2], 'limit', 'backoff_until')
+local limit = tonumber(state[1]) or tonumber(ARGV[2])
+local backoff_until = tonumber(state[2]) or 0
+local now = tonumber(ARGV[1])
+if now < backoff_until then
+    return {0, tostring(backoff_until - now)}
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local inflight = redis.call('ZCARD', KEYS[1])
+if inflight >= math.max(1, math.floor(limit)) then
+    return {0, '0'}
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return {1, '0'}
+"""
+
+_SUCCESS_LUA = """
+redis.call('ZREM', KEYS[1], ARGV[7])
+local latency = tonumber(ARGV[1])
+local alpha = tonumber(ARGV[2])
+local limit = tonumber(redis.call('HGET', KEYS[2], 'limit')) or tonumber(ARGV[6])
+local ewma = tonumber(redis.call('HGET', KEYS[2], 'latency_ewma'))
+if ewma then ewma = alpha * latency + (1 - alpha) * ewma else ewma = latency end
+if ewma <= tonumber(ARGV[5]) then
+    limit = math.min(tonumber(ARGV[3]), limit + tonumber(ARGV[4]) / limit)
+end
+redis.call('HSET', KEYS[2], 'limit', tostring(limit), 'latency_ewma', tostring(ewma), 'throttle_streak', 0)
+redis.call('HINCRBY', KEYS[2], 'successes', 1)
+return tostring(limit)
+"""
+
+_THROTTLE_LUA = """
+redis.call('ZREM', KEYS[1], ARGV[8])
+local now = tonumber(ARGV[1])
+local limit = tonumber(redis.call('HGET', KEYS[2], 'limit')) or tonumber(ARGV[6])
+limit = math.max(tonumber(ARGV[2]), limit * tonumber(ARGV[3]))
+local streak = redis.call('HINCRBY', KEYS[2], 'throttle_streak', 1)
+redis.call('HINCRBY', KEYS[2], 'throttles', 1)
+local delay = tonumber(ARGV[7]) * math.min(tonumber(ARGV[5]), tonumber(ARGV[4]) * 2 ^ (streak - 1))
+local backoff_until = math.max(tonumber(redis.call('HGET', KEYS[2], 'backoff_until') or '0'), now + delay)
+redis.call('HSET', KEYS[2], 'limit', tostring(limit), 'backoff_until', tostring(backoff_until))
+return tostring(backoff_until - now)
+"""
+
+_RELEASE_LUA = """
+return redis.call('ZREM', KEYS[1], ARGV[1])
+"""
+
+
+class ProviderThrottled(Exception):
+    """
+    El proveedor de IA respondió 429 o el scheduler no tiene slots libres
+    (contencion=True: nadie recibió un 429, solo hay que esperar turno).
+    """
+    def __init__(self, provider: str, retry_after: float = 0.0, contencion: bool = False):
+        self.provider = provider
+        self.retry_after = retry_after
+        self.contencion = contencion
+        super().__init__(f"{provider} throttled (retry in {retry_after:.1f}s)")
+
+
+def aimd_next_limit(limit: float, throttled: bool, min_limit: float, max_limit: float) -> float:
+    """Siguiente límite de concurrencia según AIMD (misma regla que los scripts Lua)."""
+    if throttled:
+        return max(min_limit, limit * MULTIPLICATIVE_DECREASE)
+    return min(max_limit, limit + ADDITIVE_INCREASE / limit)
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE_SECONDS, cap: float = BACKOFF_CAP_SECONDS) -> float:
+    """Backoff exponencial con 'full jitter': uniforme en [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class ProviderScheduler:
+    """
+    Control de concurrencia adaptativo compartido por todos los workers vía Redis.
+    Cada proveedor (gemini, mistral) tiene un límite de llamadas simultáneas que
+    crece con los éxitos rápidos y se reduce a la mitad ante cada 429.
+    """
+    def __init__(self, provider: str, client=None):
+        self.provider = provider
+        limits = getattr(settings, "AI_PROVIDER_LIMITS", {}).get(provider) or DEFAULT_PROVIDER_LIMITS[provider]
+        self.initial_limit = float(limits.get("initial", 1))
+        self.min_limit = float(limits.get("min", 1))
+        self.max_limit = float(limits.get("max", self.initial_limit))
+        self.latency_target = float(limits.get("latency_target", 10.0))
+        self.client = client or get_redis_client()
+        # ZSET de concesiones (antes un contador; otro nombre para no chocar con el tipo viejo).
+        self.inflight_key = f"ai_sched:{provider}:leases"
+        self.state_key = f"ai_sched:{provider}:state"
+
+    def _eval(self, script: str, *args):
+        return self.client.eval(script, 2, self.inflight_key, self.state_key, *args)
+
+    def try_acquire(self) -> tuple[bool, float, str | None]:
+        """
+        Intenta tomar un slot. Devuelve (adquirido, segundos_de_espera_sugeridos, token);
+        el token identifica la concesión y se entrega al liberarla.
+        """
+        token = uuid.uuid4().hex
+        try:
+            acquired, wait = self._eval(_ACQUIRE_LUA, time.time(), self.initial_limit, INFLIGHT_TTL_SECONDS, token)
+            return bool(int(acquired)), float(wait), token
+        except Exception as e:
+            # Si Redis no responde preferimos seguir procesando sin coordinación.
+            logger.warning(f"Scheduler {self.provider}: Redis no disponible ({e}), se omite el control.")
+            return True, 0.0, None
+
+    def record_success(self, latency: float, token: str | None):
+        try:
+            self._eval(_SUCCESS_LUA, latency, LATENCY_EWMA_ALPHA, self.max_limit,
+                       ADDITIVE_INCREASE, self.latency_target, self.initial_limit, token or '')
+        except Exception as e:
+            logger.warning(f"Scheduler {self.provider}: no se pudo registrar éxito ({e}).")
+
+    def record_throttle(self, token: str | None) -> float:
+        """Registra un 429: reduce el límite y fija un backoff global. Devuelve la espera en segundos."""
+        try:
+            wait = self._eval(_THROTTLE_LUA, time.time(), self.min_limit, MULTIPLICATIVE_DECREASE,
+                              BACKOFF_BASE_SECONDS, BACKOFF_CAP_SECONDS, self.initial_limit, random.random(),
+                              token or '')
+            logger.warning(f"Scheduler {self.provider}: 429 recibido, backoff global de {float(wait):.1f}s.")
+            return float(wait)
+        except Exception as e:
+            logger.warning(f"Scheduler {self.provider}: no se pudo registrar throttle ({e}).")
+            return backoff_delay(0)
+
+    def release(self, token: str | None):
+        try:
+            self._eval(_RELEASE_LUA, token or '')
+        except Exception as e:
+            logger.warning(f"Scheduler {self.provider}: no se pudo liberar slot ({e}).")
+
+    @contextmanager
+    def slot(self):
+        """
+        Envuelve una llamada al proveedor. Si no hay slot libre lanza ProviderThrottled
+        sin bloquear al worker; la tarea debe reencolarse con retry_delay().
+        """
+        acquired, wait, token = self.try_acquire()
+        if not acquired:
+            raise ProviderThrottled(self.provider, wait, contencion=True)
+        start = time.monotonic()
+        try:
+            yield
+        except ProviderThrottled as e:
+            e.retry_after = self.record_throttle(token)
+            raise
+        except Exception:
+            self.release(token)
+            raise
+        else:
+            self.record_success(time.monotonic() - start, token)
+
+    def retry_delay(self, attempt: int, retry_after: float = 0.0) -> float:
+        """Espera antes de reencolar: respeta el backoff global y añade jitter exponencial."""
+        return retry_after + backoff_delay(attempt)
+
+    def stats(self) -> dict:
+        try:
+            raw = self.client.hgetall(self.state_key)
+            inflight = self.client.zcount(self.inflight_key, time.time(), '+inf')
+        except Exception:
+            return {}
+        stats = {k.decode(): v.decode() for k, v in raw.items()}
+        stats["inflight"] = int(inflight)
+        return stats
+
+
+def wait_for_rate_slot(provider: str, per_minute: int, client=None):
+    """
+    Límite de llamadas por minuto compartido entre workers (ventana fija en Redis).
+    Bloquea hasta que haya cupo; con per_minute <= 0 no limita.
+    """
+    if per_minute <= 0:
+        return
+    client = client or get_redis_client()
+    while True:
+        key = f"ratelimit:{provider}:{int(time.time() // 60)}"
+        try:
+            used = client.incr(key)
+            if used == 1:
+                client.expire(key, 120)
+        except Exception as e:
+            logger.warning(f"Rate limit {provider}: Redis no disponible ({e}), se omite el control.")
+            return
+        if used <= per_minute:
+            return
+        time.sleep(60 - time.time() % 60 + random.uniform(0, 1))
+
+
+_schedulers = {}
+
+def get_provider_scheduler(provider: str) -> ProviderScheduler:
+    if provider not in _schedulers:
+        _schedulers[provider] = ProviderScheduler(provider)
+    return _schedulers[provider]
@@ -0,0 +1,127 @@
+# finanzas/sessions.py
+import logging
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore, KEY_PREFIX
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.utils import timezone
+
+from .utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+
+def clave_indice(user_id) -> str:
+    return f"sesiones:{user_id}"
+
+
+class _CacheTolerante:
+    """Cache de sesiones que no tumba la petición si Redis falla: manda la base."""
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def _seguro(self, op, *args, default=None):
+        try:
+            return op(*args)
+        except Exception as e:
+            logger.warning(f"Sesiones: Redis no disponible ({e}), se usa la base.")
+            return default
+
+    def get(self, key):
+        return self._seguro(self._cache.get, key)
+
+    def set(self, key, value, timeout):
+        self._seguro(self._cache.set, key, value, timeout)
+
+    def delete(self, key):
+        self._seguro(self._cache.delete, key)
+
+    def delete_many(self, keys):
+        self._seguro(self._cache.delete_many, keys)
+
+    def __contains__(self, key):
+        return self._seguro(self._cache.has_key, key, default=False)
+
+    async def aget(self, key):
+        try:
+            return await self._cache.aget(key)
+        except Exception as e:
+            logger.warning(f"Sesiones: Redis no disponible ({e}), se usa la base.")
+            return None
+
+    async def aset(self, key, value, timeout):
+        try:
+            await self._cache.aset(key, value, timeout)
+        except Exception as e:
+            logger.warning(f"Sesiones: no se pudo guardar en Redis ({e}).")
+
+    async def adelete(self, key):
+        try:
+            await self._cache.adelete(key)
+        except Exception as e:
+            logger.warning(f"Sesiones: no se pudo borrar en Redis ({e}).")
+
+
+class SessionStore(CachedDBStore):
+    """
+    Sesiones cached_db: se leen de Redis y la base queda como respaldo durable.
+    Cada vez que se guarda una sesión autenticada se registra en el set sesiones:{user_id},
+    así revocar las de un usuario (RISC) es borrar por llave en vez de recorrer la tabla.
+    La escritura en sí ya es poco frecuente: ver SESSION_EXPIRE_AFTER_LAST_ACTIVITY_GRACE_PERIOD.
+    """
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._cache = _CacheTolerante(self._cache)
+
+    def save(self, must_create=False):
+        super().save(must_create)
+        user_id = self.get(SESSION_KEY)
+        if not user_id:
+            return
+        try:
+            pipe = get_redis_client().pipeline()
+            pipe.sadd(clave_indice(user_id), self.session_key)
+            pipe.expire(clave_indice(user_id), self.get_expiry_age())
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Sesiones: no se pudo indexar la sesión del usuario {user_id} ({e}).")
+
+    def flush(self):
+        # flush() (logout) vacía la sesión antes de borrarla: el dueño se toma antes.
+        user_id, session_key = self.get(SESSION_KEY), self.session_key
+        super().flush()
+        if user_id and session_key:
+            try:
+                get_redis_client().srem(clave_indice(user_id), session_key)
+            except Exception as e:
+                logger.warning(f"Sesiones: no se pudo actualizar el índice del usuario {user_id} ({e}).")
+
+
+def _sesiones_por_escaneo(user_id) -> list[str]:
+    """Respaldo sin Redis: decodifica las sesiones vigentes buscando las del usuario."""
+    store = SessionStore()
+    return [s.session_key for s in Session.objects.filter(expire_date__gt=timezone.now()).iterator()
+            if str(store.decode(s.session_data).get(SESSION_KEY)) == str(user_id)]
+
+
+def revocar_sesiones_usuario(user) -> int:
+    """Borra todas las sesiones del usuario (base y Redis). Devuelve cuántas había en la base."""
+    try:
+        client = get_redis_client()
+        llaves = [k.decode() if isinstance(k, bytes) else k for k in client.smembers(clave_indice(user.pk))]
+    except Exception as e:
+        logger.warning(f"Sesiones: índice no disponible ({e}), se recorre la tabla de sesiones.")
+        client, llaves = None, _sesiones_por_escaneo(user.pk)
+
+    borradas, _ = Session.objects.filter(session_key__in=llaves).delete()
+    _CacheTolerante(caches[settings.SESSION_CACHE_ALIAS]).delete_many([KEY_PREFIX + k for k in llaves])
+    if client is not None:
+        try:
+            client.delete(clave_indice(user.pk))
+        except Exception as e:
+            logger.warning(f"Sesiones: no se pudo limpiar el índice del usuario {user.pk} ({e}).")
+    return borradas
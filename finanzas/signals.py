@@ -0,0 +1,24 @@
+# finanzas/signals.py
+from django.db.models.signals import post_save, post_delete
+
+from .models import (
+    registro_transacciones, inversiones, GananciaMensual, Presupuesto, Cuenta, Deuda,
+    PortfolioHistory, PortfolioHistoryAnual, NetWorthSnapshot,
+)
+from .services.data_version_service import DataVersionService
+
+# Modelos que leen las gráficas del dashboard. Los upserts masivos (bulk_create) no
+# disparan señales: esos sitios llaman a DataVersionService.avanzar() directamente.
+MODELOS_GRAFICAS = (
+    registro_transacciones, inversiones, GananciaMensual, Presupuesto, Cuenta, Deuda,
+    PortfolioHistory, PortfolioHistoryAnual, NetWorthSnapshot,
+)
+
+
+def _avanzar_version_datos(sender, instance, **kwargs):
+    DataVersionService.avanzar(getattr(instance, 'propietario_id', None) or getattr(instance, 'usuario_id', None))
+
+
+for modelo in MODELOS_GRAFICAS:
+    post_save.connect(_avanzar_version_datos, sender=modelo, dispatch_uid=f'version_datos_save_{modelo.__name__}')
+    post_delete.connect(_avanzar_version_datos, sender=modelo, dispatch_uid=f'version_datos_delete_{modelo.__name__}')
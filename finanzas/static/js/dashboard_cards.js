@@ -66,16 +66,32 @@ document.addEventListener('DOMContentLoaded', function() {
         updateMetricCard('balance', data.balance, BADGE_POSITIVE, BADGE_NEGATIVE);
     }
 
-    function fetchCardMetrics(cuentaNombre) {
+    // Las métricas de todas las tarjetas llegan en una sola petición; al rotar solo se re-pinta.
+    let metricsPromise = null;
+
+    function fetchAllCardMetrics() {
         const month = document.querySelector('select[name="month"]')?.value;
         const year = document.querySelector('select[name="year"]')?.value;
-        if (month == null || year == null) return;
+        if (month == null || year == null) return Promise.resolve({});
 
-        const url = `/api/dashboard/ingresos-tarjeta/?cuenta_nombre=${encodeURIComponent(cuentaNombre)}&month=${month}&year=${year}`;
-        fetch(url)
+        const cuentas = tarjetas.map(t => t.nombre).join(',');
+        const url = `/api/dashboard/ingresos-tarjetas/?cuentas=${encodeURIComponent(cuentas)}&month=${month}&year=${year}`;
+        return fetch(url)
             .then(response => response.json())
-            .then(data => { if (data.status === 'success') renderCardMetrics(data); })
-            .catch(error => console.error('Error al obtener las estadísticas de ingresos:', error));
+            .then(data => (data.status === 'success' ? data.tarjetas : {}))
+            .catch(error => {
+                console.error('Error al obtener las estadísticas de ingresos:', error);
+                return {};
+            });
+    }
+
+    function fetchCardMetrics(cuentaNombre) {
+        metricsPromise = metricsPromise || fetchAllCardMetrics();
+        metricsPromise.then(metricas => {
+            if (metricas[cuentaNombre] && tarjetas[currentIndex].nombre === cuentaNombre) {
+                renderCardMetrics(metricas[cuentaNombre]);
+            }
+        });
     }
 
     function showCard(index) {
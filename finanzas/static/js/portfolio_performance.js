@@ -1,19 +1,21 @@
-// Gráfica de rendimiento del portafolio (evolución diaria del valor + G/P)
+// Gráfica de rendimiento del portafolio (evolución del valor + G/P)
 document.addEventListener('DOMContentLoaded', function () {
     const canvas = document.getElementById('portfolioPerformanceChart');
     if (!canvas || typeof Chart === 'undefined') return;
 
     const parseJson = (id) => {
         const el = document.getElementById(id);
-        if (!el) return [];
-        try { return JSON.parse(el.textContent); } catch (e) { return []; }
+        if (!el) return null;
+        try { return JSON.parse(el.textContent); } catch (e) { return null; }
     };
 
-    const allLabels = parseJson('perf-labels-data');
-    const allValues = parseJson('perf-valores-data');
-    const allGains = parseJson('perf-ganancias-data');
+    // La página trae el rango 6M ya reducido; los demás se piden al API una sola vez.
+    const inicial = parseJson('perf-inicial-data');
+    if (!inicial) return; // El estado vacío se maneja en la plantilla
 
-    if (!allLabels.length) return; // El estado vacío se maneja en la plantilla
+    const rangeBox = document.getElementById('perfRangeButtons');
+    const apiUrl = rangeBox ? rangeBox.dataset.url : null;
+    const series = { '6m': inicial };
 
     const ctx = canvas.getContext('2d');
 
@@ -36,7 +38,7 @@ document.addEventListener('DOMContentLoaded', function () {
     gradient.addColorStop(1, 'rgba(79, 70, 229, 0)');
 
     // Las ganancias visibles según el rango activo (las usa el tooltip)
-    let currentGains = allGains;
+    let currentGains = inicial.ganancias;
 
     // Plugin: línea vertical punteada en el punto bajo el cursor
     const hoverLine = {
@@ -63,9 +65,9 @@ document.addEventListener('DOMContentLoaded', function () {
     const chart = new Chart(ctx, {
         type: 'line',
         data: {
-            labels: allLabels,
+            labels: inicial.labels,
             datasets: [{
-                data: allValues,
+                data: inicial.valores,
                 borderColor: '#4F46E5',
                 backgroundColor: gradient,
                 borderWidth: 2,
@@ -122,17 +124,28 @@ document.addEventListener('DOMContentLoaded', function () {
         plugins: [hoverLine]
     });
 
-    // --- Filtrado por rango (1D / 1W / 1M / 6M / 1Y) ---
-    function applyRange(days) {
-        let labels = allLabels, values = allValues, gains = allGains;
-        if (days && allLabels.length > days) {
-            labels = allLabels.slice(-days);
-            values = allValues.slice(-days);
-            gains = allGains.slice(-days);
+    // --- Rangos (1W / 1M / 6M / 1Y / MAX): el servidor reduce a ~1 punto cada 2px ---
+    let pendingRange = null;
+    async function loadRange(range) {
+        if (!series[range]) {
+            if (!apiUrl) return null;
+            const puntos = Math.max(50, Math.round((canvas.clientWidth || 600) / 2));
+            const resp = await fetch(`${apiUrl}?rango=${encodeURIComponent(range)}&puntos=${puntos}`,
+                { credentials: 'same-origin' });
+            if (!resp.ok) return null;
+            series[range] = await resp.json();
         }
-        currentGains = gains;
-        chart.data.labels = labels;
-        chart.data.datasets[0].data = values;
+        return series[range];
+    }
+
+    async function applyRange(range) {
+        pendingRange = range;
+        let data;
+        try { data = await loadRange(range); } catch (e) { data = null; }
+        if (!data || pendingRange !== range) return; // Otro botón ganó mientras se pedía
+        currentGains = data.ganancias;
+        chart.data.labels = data.labels;
+        chart.data.datasets[0].data = data.valores;
         chart.update();
     }
 
@@ -145,12 +158,11 @@ document.addEventListener('DOMContentLoaded', function () {
             });
             btn.classList.add('bg-indigo-600', 'text-white');
             btn.classList.remove('text-gray-500');
-            applyRange(parseInt(btn.dataset.range, 10));
+            applyRange(btn.dataset.range);
         });
     });
 
-    // Rango por defecto: 6M
-    const defaultBtn = document.querySelector('#perfRangeButtons [data-range="180"]');
+    // Rango por defecto: 6M (ya viene en la página, no hace petición)
+    const defaultBtn = document.querySelector('#perfRangeButtons [data-range="6m"]');
     if (defaultBtn) defaultBtn.click();
-    else applyRange(180);
 });
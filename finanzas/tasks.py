@@ -1,19 +1,36 @@
 import time
 import json
+import importlib
+from datetime import date, timedelta
 import logging
-from PIL import Image
 from io import BytesIO
 from decimal import Decimal, InvalidOperation
-from .utils import parse_date_safely
-from celery import shared_task, group
+from .utils import parse_date_safely, get_redis_client
+from celery import shared_task, group, signature, chord
+from celery.signals import task_prerun, task_postrun, task_revoked, worker_init
+from django.conf import settings
+from django.utils import timezone
 from django.contrib.auth.models import User
 from .services import GoogleDriveService, StockPriceService, TransactionService, InvestmentService, get_gemini_service, ExchangeRateService, MistralOCRService, BillingService
-from .models import Deuda, AmortizacionPendiente, PagoAmortizacion, TiendaFacturacion, Factura, HistorialReciboServicio, Presupuesto
+from .services.scheduler_service import ProviderThrottled, get_provider_scheduler
+from .services.progress_service import ScanProgress
+from .services.admission_service import FairAdmissionQueue, EXTRACTION_TIME_LIMIT_SECONDS
+from .services.net_worth_service import NetWorthService
+from .services.reference_data_service import ReferenceDataService
+from .models import Deuda, AmortizacionPendiente, PagoAmortizacion, TiendaFacturacion, Factura, HistorialReciboServicio, Presupuesto, inversiones, Holding, EjecucionProgramada
 
 logger = logging.getLogger(__name__)
 
+# Los reintentos por 429 no cuentan como fallos: se permiten más que los de error.
+THROTTLE_MAX_RETRIES = 8
+# Esperar un slot libre (contención) no gasta reintentos; el total de reencolados por
+# saturación se corta por tiempo desde el primero.
+THROTTLE_MAX_SECONDS = 1800
+
 def load_and_optimize_image(file_content, max_width: int = 1024, quality: int = 80) -> bytes:
     """Reduce el tamaño y comprime la imagen para agilizar la llamada a la IA."""
+    from PIL import Image
+
     image = Image.open(file_content).convert("RGB")
     if image.width > max_width:
         ratio = max_width / float(image.width)
@@ -36,14 +53,156 @@ def _get_files_from_drive_folder(user, folder_name: str, mimetypes=None):
     return gdrive_service.list_files_in_folder(folder_name=folder_name, mimetypes=mimetypes)
 
 def _build_user_context(user) -> str:
-    from .models import Cuenta, registro_transacciones
-    cuentas = Cuenta.objects.filter(propietario=user)
+    from .models import registro_transacciones
+    cuentas = ReferenceDataService.de_usuario(user).cuentas.values()
     lista_cuentas_str = ", ".join([f"'{c.nombre}' (Terminación: {c.terminacion or 'N/A'})" for c in cuentas])
     categorias = list(registro_transacciones.objects.filter(propietario=user).values_list('categoria', flat=True).distinct()[:20])
     return f"Cuentas disponibles del usuario: [{lista_cuentas_str}]. Categorías conocidas del usuario: {categorias}."
 
-@shared_task(bind=True, max_retries=3, default_retry_delay=60)
-def process_single_ticket(self, user_id: int, file_id: str, file_name: str, mime_type: str):
+def _registrar_saturacion(task, exc: ProviderThrottled, client=None) -> dict:
+    """
+    Cuenta el reencolado en Redis bajo el id de la tarea (no cambia entre reintentos):
+    {'reencolados', 'n429', 'segundos'} desde el primero. Sin Redis no hay scheduler que
+    dé contención, así que todo cuenta como 429 con los reintentos de Celery.
+    """
+    clave = f"throttle:{task.request.id}"
+    try:
+        pipe = (client or get_redis_client()).pipeline()
+        pipe.hsetnx(clave, 'inicio', time.time())
+        pipe.hincrby(clave, 'reencolados', 1)
+        pipe.hincrby(clave, 'n429', 0 if exc.contencion else 1)
+        pipe.hget(clave, 'inicio')
+        pipe.expire(clave, THROTTLE_MAX_SECONDS * 2)
+        _, reencolados, n429, inicio, _ = pipe.execute()
+        return {'reencolados': reencolados, 'n429': n429, 'segundos': time.time() - float(inicio)}
+    except Exception as e:
+        logger.warning(f"No se pudo registrar la saturación de {task.request.id}: {e}")
+        return {'reencolados': task.request.retries, 'n429': task.request.retries, 'segundos': 0.0}
+
+def _reencolados_por_saturacion(task) -> int:
+    try:
+        return int(get_redis_client().hget(f"throttle:{task.request.id}", 'reencolados') or 0)
+    except Exception:
+        return 0
+
+def _retry_on_error(task, exc: Exception):
+    """Reintento por error: los reencolados por saturación no consumen su presupuesto."""
+    raise task.retry(exc=exc, max_retries=task.max_retries + _reencolados_por_saturacion(task))
+
+def _requeue_throttled(task, exc: ProviderThrottled, file_name: str, client=None) -> dict:
+    """
+    Reencola el archivo con backoff cuando el proveedor está saturado, en lugar de descartarlo.
+    La contención (no hubo slot) no gasta reintentos; los 429 reales sí. Ambos se cortan
+    a los THROTTLE_MAX_SECONDS del primer reencolado.
+    """
+    saturacion = _registrar_saturacion(task, exc, client)
+    if saturacion['n429'] > THROTTLE_MAX_RETRIES or saturacion['segundos'] > THROTTLE_MAX_SECONDS:
+        return {'status': 'THROTTLED', 'file_name': file_name, 'error': f'Cuota de {exc.provider} excedida tras varios reintentos.'}
+
+    countdown = get_provider_scheduler(exc.provider).retry_delay(min(saturacion['reencolados'] - 1, 6), exc.retry_after)
+    logger.info(f"{exc.provider} saturado; reencolando {file_name} en {countdown:.1f}s.")
+    scan_id = (task.request.kwargs or {}).get('scan_id')
+    if scan_id:
+        ScanProgress().publish(scan_id, 'retrying', {'file_name': file_name, 'provider': exc.provider, 'countdown': round(countdown, 1)})
+    # El tope ya lo puso el tiempo: a Celery se le da siempre un reintento más de los hechos.
+    raise task.retry(countdown=countdown, max_retries=task.request.retries + 1)
+
+def _launch_scan(task, user, subtask, files_to_process, **extra_kwargs) -> dict:
+    """
+    Prepara el grupo de subtareas del escaneo (id = tarea lanzadora) sin mandarlo al broker:
+    los ids quedan congelados para GroupResult y la admisión justa las despacha por turnos.
+    """
+    scan_id = task.request.id
+    ScanProgress().start(scan_id, user.id, len(files_to_process))
+    job = group(
+        subtask.s(user_id=user.id, file_id=item['id'], file_name=item['name'], mime_type=item['mimeType'],
+                  scan_id=scan_id, **extra_kwargs)
+        for item in files_to_process
+    )
+    result_group = job.freeze()
+    result_group.save()
+    ScanProgress().link_group(scan_id, result_group.id)
+    FairAdmissionQueue().enqueue(user.id, scan_id, [(sig.id, json.dumps(sig)) for sig in job.tasks])
+    _admit_pending()
+    return {'status': 'STARTED', 'task_group_id': result_group.id, 'scan_id': scan_id, 'total_tasks': len(files_to_process)}
+
+def _admit_pending():
+    """Despacha a bulk_extraction las subtareas que quepan en el cupo global (round-robin por usuario)."""
+    for item in FairAdmissionQueue().admit():
+        signature(json.loads(item)).apply_async()
+
+@shared_task(ignore_result=True)
+def admit_extraction_tasks():
+    """
+    Bombeo periódico de la cola justa (CELERY_BEAT_SCHEDULE): si un worker murió sin
+    task_postrun, su cupo vence solo pero nadie más volvería a admitir.
+    """
+    _admit_pending()
+
+@shared_task(time_limit=EXTRACTION_TIME_LIMIT_SECONDS)
+def simulate_extraction(user_id, file_id: str, file_name: str, mime_type: str, scan_id: str | None = None, seconds: float = 1.0):
+    """Subtarea sintética para la prueba de carga de colas (no toca Drive ni la IA)."""
+    time.sleep(seconds)
+    return {'status': 'SUCCESS', 'file_name': file_name}
+
+@task_prerun.connect
+def _renovar_cupo(task_id=None, kwargs=None, **extra):
+    """Cada corrida de una subtarea de escaneo (incluidos reintentos) renueva su concesión."""
+    if (kwargs or {}).get('scan_id'):
+        FairAdmissionQueue().renew(task_id)
+
+@task_postrun.connect
+def _publish_scan_progress(sender=None, task_id=None, task=None, args=None, kwargs=None, retval=None, state=None, **extra):
+    """Publica el resultado de cada subtarea (y el cierre de lanzadoras sin archivos) en el stream del escaneo."""
+    kwargs = kwargs or {}
+    scan_id = kwargs.get('scan_id')
+    if scan_id:
+        if state == 'RETRY':
+            return
+        result = retval if isinstance(retval, dict) else {'status': 'FAILURE', 'file_name': kwargs.get('file_name'), 'error': str(retval)}
+        ScanProgress().publish_result(scan_id, result)
+        # La subtarea liberó su cupo: admitir la siguiente en turno.
+        FairAdmissionQueue().release(task_id)
+        _admit_pending()
+    elif getattr(task, 'is_scan_launcher', False) and isinstance(retval, dict) and retval.get('status') != 'STARTED':
+        user_id = kwargs.get('user_id') or (args[0] if args else None)
+        ScanProgress().close(task_id, user_id, retval)
+
+# Cada tarea consulta las cuentas y deudas de su usuario una sola vez (ver ReferenceDataService).
+_alcance_referencias = {}
+
+@task_prerun.connect
+def _abrir_referencias(task_id=None, **extra):
+    _alcance_referencias[task_id] = ReferenceDataService.abrir_alcance()
+
+@task_postrun.connect
+def _cerrar_referencias(task_id=None, **extra):
+    token = _alcance_referencias.pop(task_id, None)
+    if token is not None:
+        ReferenceDataService.cerrar_alcance(token)
+
+@task_revoked.connect
+def _release_revoked_slot(sender=None, request=None, **extra):
+    """Las subtareas canceladas no pasan por task_postrun; liberan su cupo aquí."""
+    if request is not None and (request.kwargs or {}).get('scan_id'):
+        FairAdmissionQueue().release(request.id)
+        _admit_pending()
+
+# Dependencias que solo usan las tareas; los servicios las importan en su primer uso
+# para que los workers web (que importan este módulo) no las carguen.
+SDKS_WORKER = ('numpy', 'cv2', 'PIL.Image', 'google.generativeai', 'mistralai', 'googleapiclient.discovery', 'mercadopago')
+
+@worker_init.connect
+def _precargar_sdks(**kwargs):
+    """Los importa en el proceso principal del worker: los hijos prefork los heredan ya cargados."""
+    for modulo in SDKS_WORKER:
+        try:
+            importlib.import_module(modulo)
+        except ImportError as e:
+            logger.warning(f"No se pudo precargar {modulo}: {e}")
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60, time_limit=EXTRACTION_TIME_LIMIT_SECONDS)
+def process_single_ticket(self, user_id: int, file_id: str, file_name: str, mime_type: str, scan_id: str | None = None):
     """Procesa un único ticket: extrae datos con Gemini y lo guarda como pendiente."""
     try:
         user = User.objects.get(id=user_id)
@@ -65,12 +224,14 @@ def process_single_ticket(self, user_id: int, file_id: str, file_name: str, mime
 
         TransactionService().create_pending_transaction(user, extracted_data)
         return {'status': 'SUCCESS', 'file_name': file_name}
+    except ProviderThrottled as e:
+        return _requeue_throttled(self, e, file_name)
     except Exception as e:
-        self.retry(exc=e)
+        _retry_on_error(self, e)
         return {'status': 'FAILURE', 'file_name': file_name, 'error': str(e)}
 
-@shared_task
-def process_drive_tickets(user_id: int):
+@shared_task(bind=True, is_scan_launcher=True)
+def process_drive_tickets(self, user_id: int):
     """Busca tickets en Drive y lanza tareas paralelas."""
     try:
         user = User.objects.get(id=user_id)
@@ -79,11 +240,7 @@ def process_drive_tickets(user_id: int):
         if not files_to_process:
             return {'status': 'NO_FILES', 'message': 'No se encontraron nuevos tickets.'}
 
-        job = group(process_single_ticket.s(user.id, item['id'], item['name'], item['mimeType']) for item in files_to_process)
-        result_group = job.apply_async()
-        result_group.save()
-
-        return {'status': 'STARTED', 'task_group_id': result_group.id, 'total_tasks': len(files_to_process)}
+        return _launch_scan(self, user, process_single_ticket, files_to_process)
     except Exception as e:
         return {'status': 'ERROR', 'message': str(e)}
 
@@ -126,8 +283,8 @@ def _calculate_investment_metrics(extracted_data: dict) -> dict:
         'moneda': "USD"
     }
 
-@shared_task(bind=True, max_retries=3, default_retry_delay=60)
-def process_single_inversion(self, user_id: int, file_id: str, file_name: str, mime_type: str):
+@shared_task(bind=True, max_retries=3, default_retry_delay=60, time_limit=EXTRACTION_TIME_LIMIT_SECONDS)
+def process_single_inversion(self, user_id: int, file_id: str, file_name: str, mime_type: str, scan_id: str | None = None):
     """Procesa una inversión y crea el registro correspondiente."""
     try:
         if mime_type not in ('image/jpeg', 'image/png', 'application/pdf'):
@@ -150,15 +307,17 @@ def process_single_inversion(self, user_id: int, file_id: str, file_name: str, m
 
         return {'status': 'SUCCESS', 'file_name': file_name}
 
+    except ProviderThrottled as e:
+        return _requeue_throttled(self, e, file_name)
     except ConnectionError as e:
         self.update_state(state='FAILURE', meta=str(e))
         return {'status': 'FAILURE', 'file_name': file_name, 'error': 'ConnectionError'}
     except Exception as e:
-        self.retry(exc=e)
+        _retry_on_error(self, e)
         return {'status': 'FAILURE', 'file_name': file_name, 'error': str(e)}
 
-@shared_task
-def process_drive_investments(user_id):
+@shared_task(bind=True, is_scan_launcher=True)
+def process_drive_investments(self, user_id):
     """Tarea para procesar TODOS los archivos de la carpeta 'Inversiones'."""
     try:
         user = User.objects.get(id=user_id)
@@ -167,16 +326,12 @@ def process_drive_investments(user_id):
         if not files_to_process:
             return {'status': 'NO_FILES', 'message': 'No se encontraron nuevos tickets.'}
 
-        job = group(process_single_inversion.s(user.id, item['id'], item['name'], item['mimeType']) for item in files_to_process)
-        result_group = job.apply_async()
-        result_group.save()
-
-        return {'status': 'STARTED', 'task_group_id': result_group.id, 'total_tasks': len(files_to_process)}
+        return _launch_scan(self, user, process_single_inversion, files_to_process)
     except Exception as e:
         return {'status': 'ERROR', 'message': str(e)}
 
-@shared_task(bind=True, max_retries=3, default_retry_delay=60)
-def process_single_amortization(self, user_id: int, file_id: str, file_name: str, mime_type: str, deuda_id: int):
+@shared_task(bind=True, max_retries=3, default_retry_delay=60, time_limit=EXTRACTION_TIME_LIMIT_SECONDS)
+def process_single_amortization(self, user_id: int, file_id: str, file_name: str, mime_type: str, deuda_id: int, scan_id: str | None = None):
     """Procesa un único archivo de tabla de amortización."""
     try:
         if mime_type not in ('image/jpeg', 'image/png', 'application/pdf'):
@@ -204,8 +359,10 @@ def process_single_amortization(self, user_id: int, file_id: str, file_name: str
 
     except Deuda.DoesNotExist:
         return {'status': 'FAILURE', 'file_name': file_name, 'error': f'No se encontró la deuda con ID {deuda_id}'}
+    except ProviderThrottled as e:
+        return _requeue_throttled(self, e, file_name)
     except Exception as e:
-        self.retry(exc=e)
+        _retry_on_error(self, e)
         return {'status': 'FAILURE', 'file_name': file_name, 'error': str(e)}
 
 def _filter_files_by_name(files, target_name: str) -> list:
@@ -213,8 +370,8 @@ def _filter_files_by_name(files, target_name: str) -> list:
     target = target_name.lower()
     return [f for f in files if target in f['name'].lower()]
 
-@shared_task
-def process_drive_amortizations(user_id: int, deuda_id: int):
+@shared_task(bind=True, is_scan_launcher=True)
+def process_drive_amortizations(self, user_id: int, deuda_id: int):
     """Busca tablas de amortización en Drive que coincidan con la deuda."""
     try:
         user = User.objects.get(id=user_id)
@@ -233,11 +390,7 @@ def process_drive_amortizations(user_id: int, deuda_id: int):
         if not files_to_process:
             return {'status': 'NO_FILES', 'message': f"No se encontraron archivos que coincidan con el nombre '{deuda.nombre}'."}
 
-        job = group(process_single_amortization.s(user.id, item['id'], item['name'], item['mimeType'], deuda_id) for item in files_to_process)
-        result_group = job.apply_async()
-        result_group.save()
-
-        return {'status': 'STARTED', 'task_group_id': result_group.id, 'total_tasks': len(files_to_process)}
+        return _launch_scan(self, user, process_single_amortization, files_to_process, deuda_id=deuda_id)
     except Exception as e:
         return {'status': 'ERROR', 'message': str(e)}
 
@@ -263,10 +416,8 @@ def _normalize_store_name(datos_extraidos: dict) -> str:
     logger.info(f"Tienda nueva detectada: {nombre_ia}")
     return nombre_ia
 
-from google.api_core.exceptions import ResourceExhausted
-
-@shared_task(bind=True, max_retries=2, default_retry_delay=10)
-def process_single_invoice(self, user_id: int, file_id: str, file_name: str, mime_type: str):
+@shared_task(bind=True, max_retries=2, default_retry_delay=10, time_limit=EXTRACTION_TIME_LIMIT_SECONDS)
+def process_single_invoice(self, user_id: int, file_id: str, file_name: str, mime_type: str, scan_id: str | None = None):
     """Procesa un ticket para FACTURACIÓN."""
     try:
         user = User.objects.get(id=user_id)
@@ -289,9 +440,8 @@ def process_single_invoice(self, user_id: int, file_id: str, file_name: str, mim
                 text=texto_ticket, 
                 context=contexto_str
             )
-        except ResourceExhausted:
-            logger.warning(f"Rate Limit en Gemini para {file_name}. Pausando...")
-            return {'status': 'THROTTLED', 'file_name': file_name, 'error': 'Cuota de Gemini excedida (15 RPM).'}
+        except ProviderThrottled:
+            raise
         except Exception as e:
              return {'status': 'FAILURE', 'file_name': file_name, 'error': f"Gemini Error: {str(e)}"}
 
@@ -322,12 +472,15 @@ def process_single_invoice(self, user_id: int, file_id: str, file_name: str, mim
 
         return {'status': 'SUCCESS', 'file_name': file_name, 'tienda': tienda_final, 'es_conocida': True, 'mensaje': f"Tienda vinculada: {tienda_final}"}
 
+    except ProviderThrottled as e:
+        logger.warning(f"Rate Limit en {e.provider} para {file_name}. Reencolando...")
+        return _requeue_throttled(self, e, file_name)
     except Exception as e:
         logger.error(f"Error fatal procesando {file_name}: {e}")
         return {'status': 'FAILURE', 'file_name': file_name, 'error': str(e)}
 
-@shared_task
-def process_drive_for_invoices(user_id: int):
+@shared_task(bind=True, is_scan_launcher=True)
+def process_drive_for_invoices(self, user_id: int):
     """Tarea Maestra: Busca archivos y lanza los workers."""
     try:
         user = User.objects.get(id=user_id)
@@ -336,11 +489,7 @@ def process_drive_for_invoices(user_id: int):
         if not files_to_process:
             return {'status': 'NO_FILES', 'message': 'No se encontraron nuevos tickets.'}
 
-        job = group(process_single_invoice.s(user.id, item['id'], item['name'], item['mimeType']) for item in files_to_process)
-        result_group = job.apply_async()
-        result_group.save()
-
-        return {'status': 'STARTED', 'task_group_id': result_group.id, 'total_tasks': len(files_to_process)}
+        return _launch_scan(self, user, process_single_invoice, files_to_process)
 
     except Exception as e:
         return {'status': 'ERROR', 'message': str(e)}
@@ -362,8 +511,8 @@ def _parse_utility_bill_data(datos: dict) -> tuple:
 
     return fecha_obj, monto
 
-@shared_task(bind=True, max_retries=3, default_retry_delay=60)
-def process_single_utility_bill(self, user_id: int, presupuesto_id: int, file_id: str, file_name: str, mime_type: str):
+@shared_task(bind=True, max_retries=3, default_retry_delay=60, time_limit=EXTRACTION_TIME_LIMIT_SECONDS)
+def process_single_utility_bill(self, user_id: int, presupuesto_id: int, file_id: str, file_name: str, mime_type: str, scan_id: str | None = None):
     """Procesa un recibo de servicio usando Mistral y Gemini."""
     try:
         user = User.objects.get(id=user_id)
@@ -403,8 +552,10 @@ def process_single_utility_bill(self, user_id: int, presupuesto_id: int, file_id
             presupuesto.save(update_fields=['monto_real'])
 
         return {'status': 'SUCCESS', 'file_name': file_name}
+    except ProviderThrottled as e:
+        return _requeue_throttled(self, e, file_name)
     except Exception as e:
-        self.retry(exc=e)
+        _retry_on_error(self, e)
         return {'status': 'FAILURE', 'file_name': file_name, 'error': str(e)}
 
 def _get_utility_bill_folder_files(drive_service, categoria_lower: str) -> list:
@@ -426,8 +577,8 @@ def _get_utility_bill_folder_files(drive_service, categoria_lower: str) -> list:
         fields="files(id, name, mimeType)"
     ).execute().get('files', [])
 
-@shared_task
-def process_drive_utility_bills(user_id: int, presupuesto_id: int, categoria_lower: str):
+@shared_task(bind=True, is_scan_launcher=True)
+def process_drive_utility_bills(self, user_id: int, presupuesto_id: int, categoria_lower: str):
     """Busca y procesa recibos de servicio en Drive."""
     try:
         user = User.objects.get(id=user_id)
@@ -450,11 +601,124 @@ def process_drive_utility_bills(user_id: int, presupuesto_id: int, categoria_low
         if not files_to_process:
             return {'status': 'NO_FILES', 'message': 'No hay recibos nuevos por procesar.'}
             
-        job = group(process_single_utility_bill.s(user.id, presupuesto_id, item['id'], item['name'], item['mimeType']) for item in files_to_process)
-        result_group = job.apply_async()
-        result_group.save()
-        
-        return {'status': 'STARTED', 'task_group_id': result_group.id, 'total_tasks': len(files_to_process)}
+        return _launch_scan(self, user, process_single_utility_bill, files_to_process, presupuesto_id=presupuesto_id)
         
     except Exception as e:
-        return {'status': 'ERROR', 'message': str(e)}
\ No newline at end of file
+        return {'status': 'ERROR', 'message': str(e)}
+
+# --- Trabajos programados (Celery beat) ---
+# Cada trabajo reparte unidades idempotentes (un ticker o un usuario) en chunks por todo el pool
+# de workers; un chord cierra la corrida y guarda su resumen en EjecucionProgramada.
+
+def _run_nocturno(trabajo: str, unidad, items: list, cierre=None):
+    """items: argumentos de cada unidad (un valor o una tupla). 'cierre' es el callback del chord."""
+    cierre = cierre or nightly_finalize_job
+    ejecucion = EjecucionProgramada.objects.create(trabajo=trabajo, unidades_totales=len(items))
+    if not items:
+        cierre.delay([], ejecucion.id)
+        return ejecucion.id
+    chunk_size = getattr(settings, 'NIGHTLY_CHUNK_SIZE', 10)
+    argumentos = [item if isinstance(item, tuple) else (item,) for item in items]
+    chord(unidad.chunks(argumentos, chunk_size).group())(cierre.s(ejecucion.id))
+    logger.info(f"{trabajo}: {len(items)} unidades repartidas en chunks de {chunk_size}.")
+    return ejecucion.id
+
+def _medir_unidad(trabajo: str, fn, *args) -> dict:
+    """Ejecuta una unidad y devuelve sus métricas. Nunca lanza: un fallo no debe romper el chord."""
+    llamadas_antes = StockPriceService.llamadas_api
+    try:
+        usuarios, error = fn(*args), False
+    except Exception as e:
+        logger.error(f"{trabajo}: falló la unidad {args}: {e}")
+        usuarios, error = [], True
+    return {'usuarios': usuarios, 'llamadas': StockPriceService.llamadas_api - llamadas_antes, 'error': error}
+
+@shared_task
+def nightly_price_ticker(ticker: str) -> dict:
+    return _medir_unidad('update_prices', InvestmentService.refresh_ticker_price, ticker)
+
+@shared_task
+def nightly_monthly_series_ticker(ticker: str, inicio: str) -> dict:
+    """Fase 1 de update_monthly_profits: descarga UNA vez la serie mensual de un ticker."""
+    llamadas_antes = StockPriceService.llamadas_api
+    try:
+        serie = InvestmentService.fetch_monthly_closes(ticker, date.fromisoformat(inicio))
+        error = False
+    except Exception as e:
+        logger.error(f"update_monthly_profits: falló la serie de {ticker}: {e}")
+        serie, error = {}, True
+    return {'ticker': ticker, 'serie': {mes: str(precio) for mes, precio in serie.items()},
+            'usuarios': [], 'llamadas': StockPriceService.llamadas_api - llamadas_antes, 'error': error}
+
+@shared_task
+def nightly_monthly_profits_compute(resultados, ejecucion_id: int):
+    """Fase 2: P&L de todos los usuarios sobre las series compartidas y upsert masivo de GananciaMensual."""
+    unidades = [r for chunk in resultados or [] for r in (chunk or [])]
+    series = {r['ticker']: {mes: Decimal(p) for mes, p in r['serie'].items()} for r in unidades}
+    try:
+        resumen = InvestmentService.refresh_all_monthly_profits(series)
+    except Exception as e:
+        logger.error(f"update_monthly_profits: falló el cálculo por usuario: {e}")
+        resumen = {'usuarios': [], 'llamadas_ahorradas': 0}
+        unidades.append({'usuarios': [], 'llamadas': 0, 'error': True})
+    unidades.append({'usuarios': resumen['usuarios'], 'llamadas': 0, 'error': False})
+    _cerrar_ejecucion(ejecucion_id, unidades, llamadas_ahorradas=resumen['llamadas_ahorradas'])
+
+@shared_task
+def nightly_portfolio_history_user(user_id: int) -> dict:
+    def unidad(uid):
+        return [uid] if InvestmentService.refresh_portfolio_history(User.objects.get(id=uid)) else []
+    return _medir_unidad('update_portfolio_history', unidad, user_id)
+
+@shared_task
+def nightly_net_worth_user(user_id: int) -> dict:
+    def unidad(uid):
+        return [uid] if NetWorthService.snapshot_nocturno(User.objects.get(id=uid)) else []
+    return _medir_unidad('update_net_worth', unidad, user_id)
+
+def _cerrar_ejecucion(ejecucion_id: int, unidades: list, **extra):
+    ejecucion = EjecucionProgramada.objects.get(id=ejecucion_id)
+    ejecucion.fin = timezone.now()
+    ejecucion.duracion_segundos = (ejecucion.fin - ejecucion.inicio).total_seconds()
+    ejecucion.usuarios_procesados = len({uid for r in unidades for uid in r['usuarios']})
+    ejecucion.llamadas_api = sum(r['llamadas'] for r in unidades)
+    ejecucion.errores = sum(1 for r in unidades if r['error'])
+    ejecucion.estado = 'con_errores' if ejecucion.errores else 'completada'
+    for campo, valor in extra.items():
+        setattr(ejecucion, campo, valor)
+    ejecucion.save()
+    logger.info(f"{ejecucion.trabajo}: {ejecucion.usuarios_procesados} usuarios, {ejecucion.llamadas_api} llamadas "
+                f"({ejecucion.llamadas_ahorradas} ahorradas), {ejecucion.errores} errores en {ejecucion.duracion_segundos:.1f}s.")
+
+@shared_task
+def nightly_finalize_job(resultados, ejecucion_id: int):
+    """Callback del chord: consolida las métricas de todas las unidades de la corrida."""
+    _cerrar_ejecucion(ejecucion_id, [r for chunk in resultados or [] for r in (chunk or [])])
+
+@shared_task
+def nightly_update_prices():
+    tickers = list(Holding.objects.exclude(emisora_ticker__isnull=True).order_by()
+                   .values_list('emisora_ticker', flat=True).distinct())
+    return _run_nocturno('update_prices', nightly_price_ticker, tickers)
+
+@shared_task
+def nightly_update_monthly_profits():
+    # Fase 1 reparte las series por ticker (una descarga por ticker para todos los usuarios); fase 2 en el cierre.
+    plan = InvestmentService.monthly_series_plan(inversiones.objects.all())
+    items = [(ticker, inicio.isoformat()) for ticker, inicio in sorted(plan.items())]
+    return _run_nocturno('update_monthly_profits', nightly_monthly_series_ticker, items, cierre=nightly_monthly_profits_compute)
+
+@shared_task
+def nightly_update_portfolio_history():
+    usuarios = sorted(set(inversiones.objects.values_list('propietario_id', flat=True)))
+    return _run_nocturno('update_portfolio_history', nightly_portfolio_history_user, usuarios)
+
+@shared_task
+def nightly_update_exchange_rates():
+    """Respalda la última semana de USD/MXN en una llamada: cierra los fines de semana y feriados."""
+    ayer = timezone.localdate() - timedelta(days=1)
+    return ExchangeRateService().respaldar(ayer - timedelta(days=7), ayer)
+
+@shared_task
+def nightly_update_net_worth():
+    return _run_nocturno('update_net_worth', nightly_net_worth_user, NetWorthService.usuarios_con_datos())
@@ -1,7 +1,40 @@
-from datetime import date
-from django.test import TestCase
-from .models import registro_transacciones
+from datetime import date, datetime, timedelta
+import os
+import sys
+import threading
+import subprocess
+import gzip
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+from asgiref.sync import async_to_sync
+from django.http import StreamingHttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from decimal import Decimal
+import numpy as np
+import fakeredis
+from .models import registro_transacciones, inversiones, EjecucionProgramada, GananciaMensual, Deuda, PagoAmortizacion, EstadoCuentaTarjeta, Cuenta, SaldoMensualCuenta, PortfolioHistory, PortfolioHistoryAnual, NetWorthSnapshot, Suscripcion, Holding, VentaInversion, TipoCambio
 from .views.presupuesto import cadencia_dias, estimar_monto, proxima_fecha
+from .views.transacciones import _eventos_escaneo
+from .services.progress_service import ScanProgress
+from .services.admission_service import FairAdmissionQueue
+from .services.scheduler_service import aimd_next_limit, backoff_delay, ProviderScheduler, ProviderThrottled
+from .services.finance_service import InvestmentService, DebtService
+from .services.debt_simulation_service import DebtPayoffSimulator
+from .services.net_worth_service import NetWorthService
+from .services.card_metrics_service import CardMetricsService
+from .services.reference_data_service import ReferenceDataService
+from .services.portfolio_series_service import PortfolioSeriesService
+from .services.lot_matching_service import LotMatchingService
+from .services.portfolio_metrics_service import PortfolioMetricsService
+from .services.market_data_service import ExchangeRateService
+from .utils import consultas_concurrentes
+from .sessions import revocar_sesiones_usuario
+from .tasks import nightly_finalize_job, _requeue_throttled, THROTTLE_MAX_RETRIES
 from django.contrib.auth.models import User
 
 
@@ -32,6 +65,996 @@ class PrediccionReciboTest(TestCase):
         # y debe caer dentro de un ciclo después de hoy
         self.assertLessEqual((f - date(2026, 6, 19)).days, 61)
 
+class TareaFalsa:
+    """Lo que _requeue_throttled usa de una tarea de Celery."""
+    max_retries = 3
+
+    def __init__(self):
+        self.request = SimpleNamespace(id='tarea-1', retries=0, kwargs={})
+
+    def retry(self, countdown=None, max_retries=None, exc=None):
+        assert max_retries is None or self.request.retries + 1 <= max_retries
+        self.request.retries += 1
+        return RuntimeError('retry')
+
+class ProviderSchedulerTest(TestCase):
+    def test_slot_perdido_vence_aunque_haya_carga(self):
+        redis = redis_falso()
+        sched = ProviderScheduler('mistral', client=redis)
+        tokens = [sched.try_acquire() for _ in range(3)]
+        self.assertEqual([t[0] for t in tokens], [True, True, False])
+        # El primer worker muere sin liberar; el segundo libera y otro adquiere enseguida.
+        sched.release(tokens[1][2])
+        self.assertTrue(sched.try_acquire()[0])
+        self.assertEqual(sched.stats()['inflight'], 2)
+        # Pasado el vencimiento, la concesión huérfana ya no ocupa cupo.
+        for miembro, vence in redis.zrange(sched.inflight_key, 0, -1, withscores=True):
+            redis.zadd(sched.inflight_key, {miembro: vence - 121})
+        self.assertEqual(sched.stats()['inflight'], 0)
+        self.assertTrue(sched.try_acquire()[0])
+
+    def test_contencion_no_gasta_reintentos(self):
+        redis, tarea = redis_falso(), TareaFalsa()
+        for _ in range(30):
+            with self.assertRaises(RuntimeError):
+                _requeue_throttled(tarea, ProviderThrottled('mistral', 0.0, contencion=True), 'a.jpg', client=redis)
+        # Los 429 reales sí tienen tope...
+        for _ in range(THROTTLE_MAX_RETRIES):
+            with self.assertRaises(RuntimeError):
+                _requeue_throttled(tarea, ProviderThrottled('mistral', 1.0), 'a.jpg', client=redis)
+        self.assertEqual(_requeue_throttled(tarea, ProviderThrottled('mistral', 1.0), 'a.jpg', client=redis)['status'], 'THROTTLED')
+
+        # ...y la contención se corta por tiempo.
+        otra = TareaFalsa()
+        otra.request.id = 'tarea-2'
+        with self.assertRaises(RuntimeError):
+            _requeue_throttled(otra, ProviderThrottled('mistral', contencion=True), 'b.jpg', client=redis)
+        redis.hset('throttle:tarea-2', 'inicio', time.time() - 3600)
+        self.assertEqual(_requeue_throttled(otra, ProviderThrottled('mistral', contencion=True), 'b.jpg', client=redis)['status'], 'THROTTLED')
+
+    def test_aimd_reduce_a_la_mitad_con_429(self):
+        self.assertEqual(aimd_next_limit(8.0, True, 1.0, 15.0), 4.0)
+        # nunca baja del mínimo
+        self.assertEqual(aimd_next_limit(1.0, True, 1.0, 15.0), 1.0)
+
+    def test_aimd_crece_un_slot_por_ventana(self):
+        limite = 4.0
+        for _ in range(4):
+            limite = aimd_next_limit(limite, False, 1.0, 15.0)
+        self.assertGreater(limite, 4.9)
+        self.assertLess(limite, 5.0)
+        self.assertEqual(aimd_next_limit(15.0, False, 1.0, 15.0), 15.0)
+
+    def test_backoff_acotado(self):
+        for intento in range(12):
+            self.assertLessEqual(backoff_delay(intento, base=5.0, cap=300.0), 300.0)
+            self.assertGreaterEqual(backoff_delay(intento, base=5.0, cap=300.0), 0.0)
+
+class TrabajosNocturnosTest(TestCase):
+    def test_precio_se_consulta_una_vez_por_ticker(self):
+        class PreciosFalsos:
+            llamadas = 0
+            def get_current_price(self, ticker):
+                self.llamadas += 1
+                return Decimal('12.5')
+
+        for nombre in ('ana', 'beto'):
+            inversiones.objects.create(
+                propietario=User.objects.create(username=nombre), emisora_ticker='VOO', nombre_activo='VOO',
+                cantidad_titulos=2, fecha_compra=date(2025, 1, 2), precio_compra_titulo=10, precio_actual_titulo=10,
+                costo_total_adquisicion=0, valor_actual_mercado=0, ganancia_perdida_no_realizada=0,
+            )
+        precios = PreciosFalsos()
+        usuarios = InvestmentService.refresh_ticker_price('VOO', precios)
+        self.assertEqual(precios.llamadas, 1)
+        self.assertEqual(len(usuarios), 2)
+        self.assertTrue(all(i.valor_actual_mercado == Decimal('25') for i in inversiones.objects.all()))
+
+    def test_ganancias_mensuales_con_series_compartidas(self):
+        usuarios = [User.objects.create(username=n) for n in ('ana', 'beto')]
+        for usuario in usuarios:
+            inversiones.objects.create(
+                propietario=usuario, emisora_ticker='VOO', nombre_activo='VOO',
+                cantidad_titulos=2, fecha_compra=date(2025, 1, 15), precio_compra_titulo=10, precio_actual_titulo=10,
+                costo_total_adquisicion=0, valor_actual_mercado=0, ganancia_perdida_no_realizada=0,
+            )
+        # Mes obsoleto que debe desaparecer tras el upsert.
+        GananciaMensual.objects.create(propietario=usuarios[0], mes='2024-12', total=1)
+        series = {'VOO': {'2025-01': Decimal('11'), '2025-02': Decimal('9')}}
+        resumen = InvestmentService.refresh_all_monthly_profits(series)
+
+        self.assertEqual(resumen['llamadas_ahorradas'], 1)
+        self.assertEqual(resumen['filas'], 4)
+        self.assertEqual(
+            dict(GananciaMensual.objects.filter(propietario=usuarios[0]).values_list('mes', 'total')),
+            {'2025-01': Decimal('2.00'), '2025-02': Decimal('-2.00')},
+        )
+
+    def test_resumen_de_la_corrida(self):
+        ejecucion = EjecucionProgramada.objects.create(trabajo='update_prices', unidades_totales=3)
+        nightly_finalize_job([
+            [{'usuarios': [1, 2], 'llamadas': 1, 'error': False}, {'usuarios': [2], 'llamadas': 1, 'error': False}],
+            [{'usuarios': [], 'llamadas': 1, 'error': True}],
+        ], ejecucion.id)
+        ejecucion.refresh_from_db()
+        self.assertEqual((ejecucion.usuarios_procesados, ejecucion.llamadas_api, ejecucion.errores), (2, 3, 1))
+        self.assertEqual(ejecucion.estado, 'con_errores')
+        self.assertIsNotNone(ejecucion.duracion_segundos)
+
+class TablaAmortizacionTest(TestCase):
+    def test_tabla_francesa_cuadra_al_centavo(self):
+        deuda = Deuda.objects.create(
+            propietario=User.objects.create(username='deudor'), nombre='Hipoteca', tipo_deuda='PRESTAMO',
+            monto_total=Decimal('1500000.00'), tasa_interes=Decimal('10.50'), plazo_meses=360,
+            fecha_adquisicion=date(2025, 1, 31),
+        )
+        DebtService.generar_tabla_amortizacion(deuda)
+        # Regenerar reemplaza la tabla en lugar de duplicarla.
+        DebtService.generar_tabla_amortizacion(deuda)
+
+        cuotas = list(PagoAmortizacion.objects.filter(deuda=deuda))
+        self.assertEqual(len(cuotas), 360)
+        self.assertEqual(sum(c.capital for c in cuotas), Decimal('1500000.00'))
+        self.assertEqual(cuotas[-1].saldo_insoluto, Decimal('0.00'))
+        self.assertTrue(all(c.pago_total == c.capital + c.interes + c.iva for c in cuotas))
+        self.assertEqual(cuotas[1].fecha_vencimiento, date(2025, 3, 31))
+
+class AbonoCapitalTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='abonos')
+        self.deuda = Deuda.objects.create(
+            propietario=self.user, nombre='Auto', tipo_deuda='PRESTAMO',
+            monto_total=Decimal('300.00'), tasa_interes=Decimal('0'), plazo_meses=3,
+            fecha_adquisicion=date(2025, 1, 1),
+        )
+        DebtService.generar_tabla_amortizacion(self.deuda)
+
+    def _pago_capital(self, monto):
+        return registro_transacciones.objects.create(
+            propietario=self.user, fecha=date(2025, 2, 1), descripcion='Abono', categoria='Deudas',
+            monto=Decimal(monto), tipo='PAGO_CAPITAL', cuenta_origen='Banco', cuenta_destino='Auto',
+        )
+
+    def _estado(self):
+        return list(PagoAmortizacion.objects.filter(deuda=self.deuda).values_list('pagado', 'capital_abonado'))
+
+    def test_abono_parcial_y_reversion(self):
+        pago = self._pago_capital('150')
+        self.assertEqual(self._estado(), [(True, Decimal('100.00')), (False, Decimal('50.00')), (False, Decimal('0.00'))])
+
+        pago.delete()
+        self.assertEqual(self._estado(), [(False, Decimal('0.00'))] * 3)
+        self.deuda.refresh_from_db()
+        self.assertEqual(self.deuda.saldo_pendiente, Decimal('300.00'))
+
+class SimuladorDeudasTest(TestCase):
+    def test_avalancha_paga_menos_intereses_que_bola_de_nieve(self):
+        deudas = [
+            {'saldo': 1000.0, 'tasa_mensual': 0.03, 'pago_minimo': 50.0},
+            {'saldo': 500.0, 'tasa_mensual': 0.01, 'pago_minimo': 50.0},
+        ]
+        escenarios = [('minimos', 0.0), ('avalancha', 200.0), ('bola_de_nieve', 200.0)]
+        sim = DebtPayoffSimulator.simular(deudas, escenarios)
+
+        meses = sim['meses'].max(axis=1)
+        intereses = sim['intereses'].sum(axis=1)
+        self.assertTrue((sim['meses'] > 0).all())
+        self.assertLess(meses[1], meses[0])
+        self.assertLess(intereses[1], intereses[2])
+        # Bola de nieve liquida primero la deuda chica.
+        self.assertLess(sim['meses'][2, 1], sim['meses'][2, 0])
+        # Lo pagado es exactamente saldo inicial + intereses.
+        for i in range(3):
+            self.assertAlmostEqual(sim['pagado'][i].sum(), 1500 + intereses[i], places=6)
+
+    def test_montos_extra_no_finitos_se_rechazan(self):
+        self.client.force_login(User.objects.create(username='simulador'))
+        for extra in ('nan', 'inf', '0,-inf'):
+            resp = self.client.get(reverse('simular_liquidacion_deudas'), {'extras': extra})
+            self.assertEqual(resp.status_code, 400)
+
+class EstadoCuentaTarjetaTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='tarjetahabiente')
+        self.tarjeta = Deuda.objects.create(
+            propietario=self.user, nombre='Oro', tipo_deuda='TARJETA_CREDITO',
+            monto_total=Decimal('10000'), tasa_interes=Decimal('40'), dia_corte=6, dia_pago=26,
+        )
+
+    def _movimiento(self, fecha, monto, tipo='GASTO'):
+        origen, destino = ('Oro', 'Comercio') if tipo == 'GASTO' else ('Nómina', 'Oro')
+        return registro_transacciones.objects.create(
+            propietario=self.user, fecha=fecha, descripcion='Mov', categoria='Varios',
+            monto=Decimal(monto), tipo=tipo, cuenta_origen=origen, cuenta_destino=destino,
+        )
+
+    def _ciclos(self):
+        return list(EstadoCuentaTarjeta.objects.filter(deuda=self.tarjeta)
+                    .values_list('fecha_corte', 'fecha_pago', 'cargos', 'pagos', 'movimientos'))
+
+    def test_ciclos_incrementales_coinciden_con_reconstruccion(self):
+        self._movimiento(date(2025, 3, 6), '100')
+        compra = self._movimiento(date(2025, 3, 7), '250')
+        self._movimiento(date(2025, 3, 20), '80', tipo='TRANSFERENCIA')
+        borrar = self._movimiento(date(2025, 4, 1), '40')
+
+        compra.fecha = date(2025, 3, 2)
+        compra.save()
+        borrar.delete()
+
+        esperado = [
+            (date(2025, 4, 6), date(2025, 4, 26), Decimal('0'), Decimal('80'), 1),
+            (date(2025, 3, 6), date(2025, 3, 26), Decimal('350'), Decimal('0'), 2),
+        ]
+        self.assertEqual([c for c in self._ciclos() if c[4]], esperado)
+        EstadoCuentaTarjeta.objects.reconstruir(self.tarjeta)
+        self.assertEqual(self._ciclos(), esperado)
+
+class SaldoMensualCuentaTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='ahorrador')
+        self.nomina = Cuenta.objects.create(propietario=self.user, nombre='Nómina')
+        self.ahorro = Cuenta.objects.create(propietario=self.user, nombre='Ahorro')
+
+    def _tx(self, fecha, monto, tipo, origen, destino=''):
+        return registro_transacciones.objects.create(
+            propietario=self.user, fecha=fecha, descripcion='Mov', categoria='Varios',
+            monto=Decimal(monto), tipo=tipo, cuenta_origen=origen, cuenta_destino=destino,
+        )
+
+    def test_cierres_incrementales_cuadran_con_el_libro(self):
+        self._tx(date(2025, 1, 15), '1000', 'INGRESO', 'Nómina')
+        self._tx(date(2025, 1, 20), '300', 'TRANSFERENCIA', 'Nómina', 'Ahorro')
+        gasto = self._tx(date(2025, 3, 5), '200', 'GASTO', 'Nómina', 'Super')
+        borrar = self._tx(date(2025, 2, 10), '50', 'GASTO', 'Nómina', 'Cine')
+
+        gasto.fecha = date(2025, 2, 5)
+        gasto.save()
+        borrar.delete()
+
+        cierres = list(SaldoMensualCuenta.objects.filter(cuenta=self.nomina).values_list('mes', 'saldo_cierre'))
+        self.assertEqual(cierres, [(date(2025, 1, 1), Decimal('700')), (date(2025, 2, 1), Decimal('500'))])
+        self.assertEqual(SaldoMensualCuenta.objects.saldo_al(self.nomina, date(2025, 1, 16)), Decimal('1000'))
+        self.assertEqual(SaldoMensualCuenta.objects.saldo_al(self.ahorro, date(2025, 6, 1)), Decimal('300'))
+        self.assertEqual(SaldoMensualCuenta.objects.reconstruir(self.nomina, verificar=True), [])
+        self.assertEqual(SaldoMensualCuenta.objects.reconstruir(self.ahorro, verificar=True), [])
+
+class PatrimonioTest(TestCase):
+    def test_serie_diaria_combina_cuentas_tarjetas_y_portafolio(self):
+        user = User.objects.create(username='patrimonio')
+        Cuenta.objects.create(propietario=user, nombre='Nómina')
+        Deuda.objects.create(propietario=user, nombre='Oro', tipo_deuda='TARJETA_CREDITO',
+                             monto_total=Decimal('10000'), tasa_interes=Decimal('40'))
+        PortfolioHistory.objects.create(usuario=user, fecha=date(2025, 1, 2), valor_total=Decimal('500'),
+                                        capital_invertido=Decimal('400'), ganancia_no_realizada=Decimal('100'))
+        for dia, monto, tipo, origen, destino in [
+            (1, '1000', 'INGRESO', 'Nómina', ''), (2, '300', 'GASTO', 'Oro', 'Super'),
+            (3, '200', 'GASTO', 'Nómina', 'Luz'), (4, '100', 'TRANSFERENCIA', 'Nómina', 'Oro'),
+        ]:
+            registro_transacciones.objects.create(
+                propietario=user, fecha=date(2025, 1, dia), descripcion='Mov', categoria='Varios',
+                monto=Decimal(monto), tipo=tipo, cuenta_origen=origen, cuenta_destino=destino,
+            )
+
+        self.assertEqual(NetWorthService.guardar(user, date(2025, 1, 1), date(2025, 1, 5)), 5)
+        filas = list(NetWorthSnapshot.objects.filter(usuario=user).values_list('cuentas', 'inversiones', 'deudas', 'patrimonio'))
+        self.assertEqual([f[3] for f in filas], [Decimal('1000'), Decimal('1200'), Decimal('1000'), Decimal('1000'), Decimal('1000')])
+        self.assertEqual(filas[3], (Decimal('700'), Decimal('500'), Decimal('200'), Decimal('1000')))
+        self.assertEqual(NetWorthService.reducir(list(range(10)), 4), [2, 5, 8, 9])
+
+class MetricasTarjetasTest(TestCase):
+    def test_todas_las_cuentas_y_ambos_meses_en_una_consulta(self):
+        user = User.objects.create(username='widget')
+        for fecha, monto, tipo, origen, destino, categoria in [
+            (date(2025, 2, 10), '1000', 'INGRESO', 'Nómina', '', 'Sueldo'),
+            (date(2025, 3, 10), '1500', 'INGRESO', 'Nómina', '', 'Sueldo'),
+            (date(2025, 3, 11), '200', 'GASTO', 'Nómina', 'Super', 'Comida'),
+            (date(2025, 3, 12), '300', 'TRANSFERENCIA', 'Nómina', 'Vales', 'Traspaso'),
+            (date(2025, 3, 13), '50', 'GASTO', 'Vales', 'Super', 'Comida'),
+            (date(2025, 4, 1), '999', 'GASTO', 'Nómina', 'Fuera de rango', 'Comida'),
+        ]:
+            registro_transacciones.objects.create(
+                propietario=user, fecha=fecha, descripcion='Mov', categoria=categoria,
+                monto=Decimal(monto), tipo=tipo, cuenta_origen=origen, cuenta_destino=destino,
+            )
+
+        with self.assertNumQueries(1):
+            metricas = CardMetricsService.metricas(user, ['Nómina', 'Vales'], 2025, 3)
+
+        nomina, vales = metricas['Nómina'], metricas['Vales']
+        self.assertEqual(nomina['ingresos']['total'], '1,500.00')
+        self.assertEqual(nomina['ingresos']['porcentaje'], 50.0)
+        self.assertEqual((nomina['gastos']['total'], nomina['gastos']['transactions'], nomina['gastos']['categories']),
+                         ('500.00', 2, 2))
+        self.assertEqual(nomina['balance']['total'], '1,000.00')
+        # La transferencia entre cuentas del widget cuenta como entrada de 'Vales'.
+        self.assertEqual((vales['ingresos']['total'], vales['gastos']['total']), ('300.00', '50.00'))
+
+    def test_mes_fuera_de_rango_es_400(self):
+        self.client.force_login(User.objects.create(username='widget-400'))
+        for mes in (0, 13):
+            self.assertEqual(self.client.get(reverse('api_ingresos_tarjetas'), {'year': 2025, 'month': mes}).status_code, 400)
+            self.assertEqual(self.client.get(reverse('api_ingresos_tarjeta'),
+                                             {'cuenta_nombre': 'Nómina', 'year': 2025, 'month': mes}).status_code, 400)
+
+class DashboardAsyncTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='async')
+        Cuenta.objects.create(propietario=self.user, nombre='Nómina', tipo='DEBITO', es_principal=True)
+        tc = Deuda.objects.create(propietario=self.user, nombre='TC', tipo_deuda='TARJETA_CREDITO',
+                                  monto_total=Decimal('10000'), tasa_interes=Decimal('40'),
+                                  plazo_meses=1, fecha_adquisicion=date(2025, 1, 1))
+        Deuda.objects.filter(pk=tc.pk).update(saldo_pendiente=Decimal('7000'))
+        for fecha, monto, tipo, origen, destino in [
+            (date(2025, 3, 1), '2000', 'INGRESO', 'Nómina', ''),
+            (date(2025, 3, 5), '300', 'GASTO', 'Nómina', 'Super'),
+            (date(2025, 3, 9), '500', 'TRANSFERENCIA', 'Nómina', 'TC'),
+        ]:
+            registro_transacciones.objects.create(propietario=self.user, fecha=fecha, descripcion='Mov', categoria='General',
+                                                  monto=Decimal(monto), tipo=tipo, cuenta_origen=origen, cuenta_destino=destino)
+        self.client.force_login(self.user)
+
+    def test_dashboard_y_graficas_async(self):
+        resp = self.client.get(reverse('dashboard'), {'year': 2025, 'month': 3})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual((resp.context['ingresos'], resp.context['gastos']), (Decimal('2000'), Decimal('300')))
+        self.assertEqual((resp.context['deuda_total'], resp.context['num_tarjetas']), (Decimal('2500'), 1))
+        self.assertEqual(resp.context['total_pagado_deudas'], Decimal('500'))
+
+        flujo = self.client.get(reverse('api_flujo_dinero'), {'year': 2025, 'month': 3}).json()
+        self.assertEqual([Decimal(v) for v in flujo['data']], [Decimal('2000'), Decimal('300')])
+
+    def test_sin_cuentas_redirige_al_onboarding(self):
+        self.client.force_login(User.objects.create(username='nuevo'))
+        self.assertRedirects(self.client.get(reverse('dashboard')), reverse('gestionar_cuentas'), fetch_redirect_response=False)
+
+class ConsultasConcurrentesTest(TransactionTestCase):
+    def test_cada_consulta_en_su_hilo(self):
+        User.objects.create(username='hilos')
+        hilos, conteos = set(), []
+        def consulta():
+            hilos.add(threading.get_ident())
+            conteos.append(User.objects.count())
+            return len(conteos)
+
+        resultados = async_to_sync(consultas_concurrentes)(consulta, consulta, lambda: 'ok')
+        self.assertEqual(sorted(resultados[:2]) + resultados[2:], [1, 2, 'ok'])
+        self.assertEqual(conteos, [1, 1])
+        self.assertNotIn(threading.get_ident(), hilos)
+
+class PoolConexionesTest(TestCase):
+    def test_pool_reutiliza_descarta_caidas_y_esta_acotado(self):
+        from sqlalchemy import event, exc
+        from sqlalchemy.pool import QueuePool
+        from config.db_pool.base import _verificar_conexion
+
+        class ConexionFalsa:
+            def __init__(self):
+                self.caida = False
+            def ping(self, reconnect=True):
+                if self.caida:
+                    raise OSError('MySQL server has gone away')
+            def rollback(self):
+                pass
+            def close(self):
+                pass
+
+        pool = QueuePool(ConexionFalsa, pool_size=2, max_overflow=0, timeout=0.1)
+        event.listen(pool, 'checkout', _verificar_conexion)
+        primera = pool.connect()
+        cruda = primera.dbapi_connection
+        primera.close()
+        segunda = pool.connect()
+        self.assertIs(segunda.dbapi_connection, cruda)
+
+        cruda.caida = True
+        segunda.close()
+        tercera = pool.connect()
+        self.assertIsNot(tercera.dbapi_connection, cruda)
+
+        ocupada = pool.connect()  # con referencia: si se recolecta, vuelve al pool
+        self.assertIsNotNone(ocupada)
+        with self.assertRaises(exc.TimeoutError):
+            pool.connect()
+
+class ImportacionWebTest(TestCase):
+    # Un worker web importa las URLs (y con ellas vistas, tasks y servicios) pero nunca hace OCR.
+    SDKS_PESADOS = ('numpy', 'cv2', 'google.generativeai', 'mistralai', 'googleapiclient.discovery',
+                    'mercadopago', 'twelvedata', 'PIL.Image', 'jwt')
+    # Parte del arranque del proceso (Django y sus apps) que pueden costar las URLs. Relativo
+    # para que un CI lento no lo rompa; hoy ronda el 2%.
+    PRESUPUESTO_RELATIVO = 0.25
+
+    def test_las_urls_no_cargan_los_sdk_y_caben_en_el_presupuesto(self):
+        salida = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import django; django.setup(); import finanzas.urls'],
+            capture_output=True, text=True, env={**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)},
+        )
+        self.assertEqual(salida.returncode, 0, salida.stderr[-2000:])
+        acumulado, total = {}, 0
+        for linea in salida.stderr.splitlines():
+            if linea.startswith('import time:') and '|' in linea:
+                _, cumulativo, modulo = linea.split('|')
+                if cumulativo.strip().isdigit():
+                    acumulado[modulo.strip()] = int(cumulativo)
+                    # Solo los imports de primer nivel: los anidados ya van en su cumulativo.
+                    if not modulo.startswith('  '):
+                        total += int(cumulativo)
+
+        self.assertEqual([m for m in self.SDKS_PESADOS if m in acumulado], [])
+        self.assertLess(acumulado['finanzas.urls'] / total, self.PRESUPUESTO_RELATIVO)
+
+def redis_falso(caido=False) -> fakeredis.FakeRedis:
+    """Redis en memoria con scripts Lua (fakeredis + lupa); caido=True simula el servidor abajo."""
+    servidor = fakeredis.FakeServer()
+    servidor.connected = not caido
+    return fakeredis.FakeRedis(server=servidor)
+
+async def consumir(eventos) -> list:
+    return [m async for m in eventos]
+
+class ProgresoEscaneoTest(TestCase):
+    def setUp(self):
+        servidor = fakeredis.FakeServer()
+        self.progreso = ScanProgress(client=fakeredis.FakeRedis(server=servidor),
+                                     async_client=fakeredis.FakeAsyncRedis(server=servidor))
+        self.progreso.start('scan-1', 7, 3)
+
+    def _terminar(self):
+        self.progreso.publish_result('scan-1', {'status': 'SUCCESS', 'file_name': 'a.jpg'})
+        self.progreso.publish('scan-1', 'retrying', {'file_name': 'b.jpg'})
+        self.progreso.publish_result('scan-1', {'status': 'THROTTLED', 'file_name': 'b.jpg'})
+        self.progreso.publish_result('scan-1', {'status': 'UNSUPPORTED', 'file_name': 'c.pdf'})
+
+    def test_contadores_y_un_solo_completed_del_ultimo_archivo(self):
+        self.progreso.publish_result('scan-1', {'status': 'SUCCESS', 'file_name': 'a.jpg'})
+        self.assertNotIn('completed', [e for _, e, _ in self.progreso.read('scan-1', block_ms=None)])
+        self.progreso.publish('scan-1', 'retrying', {'file_name': 'b.jpg'})
+        self.progreso.publish_result('scan-1', {'status': 'THROTTLED', 'file_name': 'b.jpg'})
+        self.progreso.publish_result('scan-1', {'status': 'UNSUPPORTED', 'file_name': 'c.pdf'})
+
+        resumen = self.progreso.summary('scan-1')
+        self.assertEqual({k: resumen[k] for k in ('done', 'failed', 'throttled', 'finished', 'user_id')},
+                         {'done': 1, 'failed': 1, 'throttled': 1, 'finished': 3, 'user_id': 7})
+        eventos = self.progreso.read('scan-1', block_ms=None)
+        self.assertEqual([e for _, e, _ in eventos], ['started', 'done', 'retrying', 'throttled', 'failed', 'completed'])
+        self.assertEqual(eventos[-1][2]['finished'], 3)
+
+    async def test_stream_retoma_desde_last_event_id(self):
+        self._terminar()
+        eventos = self.progreso.read('scan-1', block_ms=None)
+        mensajes = await consumir(_eventos_escaneo(self.progreso, 'scan-1', 7, self.progreso.summary('scan-1'), eventos[2][0]))
+        self.assertEqual(mensajes[0], "retry: 3000\n\n")
+        self.assertEqual([m.split('\n')[1] for m in mensajes[1:]],
+                         ['event: throttled', 'event: failed', 'event: completed'])
+        self.assertTrue(mensajes[1].startswith(f"id: {eventos[3][0]}\n"))
+
+    async def test_stream_sin_meta_valida_al_duenio(self):
+        self._terminar()
+        # Abierto antes de que existiera la meta: el primer evento revela que es de otro usuario.
+        self.assertEqual(await consumir(_eventos_escaneo(self.progreso, 'scan-1', 8, {})), ["retry: 3000\n\n"])
+        self.assertEqual(len(await consumir(_eventos_escaneo(self.progreso, 'scan-1', 7, {}))), 7)
+
+    async def test_stream_entrega_cada_evento_antes_de_terminar(self):
+        eventos = _eventos_escaneo(self.progreso, 'scan-1', 7, self.progreso.summary('scan-1'))
+        # Un generador async es lo que deja a ASGI mandar cada mensaje sin juntar la respuesta.
+        self.assertTrue(StreamingHttpResponse(eventos, content_type='text/event-stream').is_async)
+        self.assertEqual(await eventos.__anext__(), "retry: 3000\n\n")
+        self.assertIn("event: started\n", await eventos.__anext__())
+
+        # El siguiente mensaje llega mientras el stream sigue esperando, no al cerrar el escaneo.
+        siguiente = asyncio.ensure_future(eventos.__anext__())
+        await asyncio.sleep(0.02)
+        self.assertFalse(siguiente.done())
+        self.progreso.publish_result('scan-1', {'status': 'SUCCESS', 'file_name': 'a.jpg'})
+        self.assertIn("event: done\n", await asyncio.wait_for(siguiente, 1))
+        self.assertNotIn('completed', [e for _, e, _ in self.progreso.read('scan-1', block_ms=None)])
+        await eventos.aclose()
+
+@override_settings(EXTRACTION_MAX_INFLIGHT=4)
+class AdmisionJustaTest(TestCase):
+    def setUp(self):
+        self.redis = redis_falso()
+        self.cola = FairAdmissionQueue(client=self.redis)
+        for usuario, n in ((1, 5), (2, 2), (3, 1)):
+            self.cola.enqueue(usuario, f"scan-{usuario}", [(f"t{usuario}-{i}", f"u{usuario}-{i}") for i in range(n)])
+
+    def test_round_robin_con_tope_de_cupo(self):
+        self.assertEqual(self.cola.admit(), ['u1-0', 'u2-0', 'u3-0', 'u1-1'])
+        self.assertEqual(self.cola.admit(), [])
+        self.cola.release('t3-0')
+        self.assertEqual(self.cola.admit(), ['u2-1'])
+        self.assertEqual(self.cola.stats(), {'inflight': 4, 'max_inflight': 4, 'pending_by_user': {'1': 3}})
+
+    def test_liberar_de_mas_no_abre_cupo_extra(self):
+        self.cola.admit()
+        for _ in range(3):
+            self.cola.release('t1-0')
+        self.cola.release('desconocida')
+        self.assertEqual(self.cola.stats()['inflight'], 3)
+        self.assertEqual(len(self.cola.admit()), 1)
+
+    def test_cupo_de_worker_muerto_vence(self):
+        self.cola.admit()
+        for tarea, vence in self.redis.zrange(self.cola.inflight_key, 0, -1, withscores=True):
+            self.redis.zadd(self.cola.inflight_key, {tarea: vence - 3601})
+        self.assertEqual(self.cola.stats()['inflight'], 0)
+        self.assertEqual(self.cola.admit(), ['u2-1', 'u1-2', 'u1-3', 'u1-4'])
+
+    def test_reintento_renueva_su_cupo(self):
+        self.cola.admit()
+        for tarea, vence in self.redis.zrange(self.cola.inflight_key, 0, -1, withscores=True):
+            self.redis.zadd(self.cola.inflight_key, {tarea: vence - 3601})
+        # El reintento de t1-0 arranca después de que su concesión venció: vuelve a ocupar cupo.
+        self.cola.renew('t1-0')
+        self.assertEqual(self.cola.stats()['inflight'], 1)
+        self.assertEqual(len(self.cola.admit()), 3)
+
+    def test_descartar_no_duplica_turnos(self):
+        self.assertEqual(self.cola.discard(1, 'scan-1'), 5)
+        self.cola.enqueue(1, 'scan-9', [('t1-9', 'u1-9'), ('t1-10', 'u1-10')])
+        activos = self.redis.lrange(self.cola.active_key, 0, -1)
+        self.assertEqual(activos.count(b'1'), 1)
+        self.assertEqual(self.cola.admit(), ['u2-0', 'u3-0', 'u1-9', 'u2-1'])
+
+    def test_cancelar_un_escaneo_no_toca_los_otros(self):
+        # El usuario 2 tiene además un escaneo de inversiones en espera.
+        self.cola.enqueue(2, 'scan-inv', [('inv-0', 'i2-0'), ('inv-1', 'i2-1')])
+        self.assertEqual(self.cola.discard(2, 'scan-2'), 2)
+        self.assertEqual(self.cola.discard(3, 'scan-inv'), 0)
+        self.assertEqual(self.cola.admit(), ['u1-0', 'i2-0', 'u3-0', 'u1-1'])
+        self.assertEqual(self.cola.stats()['pending_by_user'], {'1': 3, '2': 1})
+
+class SuscripcionPremiumTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='premium')
+        self.redis = redis_falso()
+
+    def test_estado_cacheado_hasta_fin_del_dia_de_fecha_fin(self):
+        fin = timezone.now() + timedelta(days=3)
+        Suscripcion.objects.create(usuario=self.user, estado='activa', fecha_fin=fin)
+        self.assertTrue(Suscripcion.objects.es_premium(self.user, client=self.redis))
+
+        clave = Suscripcion.objects.clave_premium(self.user.pk)
+        expira = datetime.combine(fin.date() + timedelta(days=1), datetime.min.time(), tzinfo=fin.tzinfo)
+        self.assertAlmostEqual(self.redis.ttl(clave), (expira - timezone.now()).total_seconds(), delta=5)
+
+        # Un cambio que no pasa por save() no se ve: la respuesta sale de Redis.
+        Suscripcion.objects.filter(usuario=self.user).update(estado='cancelada')
+        with self.assertNumQueries(0):
+            self.assertTrue(Suscripcion.objects.es_premium(self.user, client=self.redis))
+
+    def test_save_invalida_y_sin_redis_se_consulta_la_base(self):
+        self.assertFalse(Suscripcion.objects.es_premium(self.user, client=self.redis))
+        Suscripcion.objects.create(usuario=self.user, estado='activa', fecha_fin=timezone.now() + timedelta(days=31))
+        # Lo que hace save() al activarse desde el webhook.
+        Suscripcion.objects.invalidar_premium(self.user.pk, client=self.redis)
+        self.assertTrue(Suscripcion.objects.es_premium(self.user, client=self.redis))
+        self.assertTrue(Suscripcion.objects.es_premium(self.user, client=redis_falso(caido=True)))
+
+    def test_las_paginas_no_crean_suscripcion(self):
+        self.client.force_login(self.user)
+        for nombre in ('lista_deudas', 'lista_inversiones', 'lista_transacciones'):
+            self.assertEqual(self.client.get(reverse(nombre)).status_code, 200)
+        self.assertFalse(Suscripcion.objects.exists())
+
+class SesionesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='sesiones')
+        Cuenta.objects.create(propietario=self.user, nombre='Nómina', tipo='DEBITO', es_principal=True)
+
+    def test_actividad_dentro_del_periodo_de_gracia_no_reescribe_la_sesion(self):
+        from django.contrib.sessions.models import Session
+
+        self.client.force_login(self.user)
+        self.client.get(reverse('lista_deudas'))
+        sesion = Session.objects.get()
+        self.client.get(reverse('lista_deudas'))
+        self.assertEqual(Session.objects.get().session_data, sesion.session_data)
+
+    def test_revocar_borra_solo_las_sesiones_del_usuario(self):
+        from django.contrib.sessions.models import Session
+        from django.test import Client
+
+        for usuario in (self.user, self.user, User.objects.create(username='otro')):
+            Client().force_login(usuario)
+        self.assertEqual(revocar_sesiones_usuario(self.user), 2)
+        self.assertEqual(Session.objects.count(), 1)
+
+class ReferenciasUsuarioTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='refs')
+        Cuenta.objects.create(propietario=self.user, nombre='Nómina', tipo='DEBITO', es_principal=True)
+        self.tc = Deuda.objects.create(propietario=self.user, nombre='TC', tipo_deuda='TARJETA_CREDITO',
+                                       monto_total=Decimal('10000'), tasa_interes=Decimal('40'),
+                                       plazo_meses=1, fecha_adquisicion=date(2025, 1, 1))
+
+    def test_una_carga_por_alcance_y_se_invalida_al_escribir(self):
+        with ReferenceDataService.alcance():
+            with self.assertNumQueries(2):
+                refs = ReferenceDataService.de_usuario(self.user)
+            with self.assertNumQueries(0):
+                self.assertIs(ReferenceDataService.de_usuario(self.user.pk), refs)
+            self.assertEqual([c.nombre for c in refs.cuentas_debito()], ['Nómina'])
+            self.assertEqual(refs.tarjeta('TC').id, self.tc.id)
+            self.assertIsNone(refs.tarjeta('Nómina'))
+
+            Cuenta.objects.create(propietario=self.user, nombre='Ahorro', tipo='DEBITO')
+            self.assertIsNotNone(ReferenceDataService.de_usuario(self.user).cuenta('Ahorro'))
+
+    def test_nombres_sin_distinguir_mayusculas_ni_espacios(self):
+        # Como la collation de MySQL: 'tc ' en la transacción es la tarjeta 'TC'.
+        with ReferenceDataService.alcance():
+            refs = ReferenceDataService.de_usuario(self.user)
+            self.assertEqual(refs.tarjeta('tc ').id, self.tc.id)
+            self.assertEqual(refs.cuenta(' NÓMINA').nombre, 'Nómina')
+            registro_transacciones.objects.create(propietario=self.user, fecha=date(2025, 3, 1), descripcion='Compra',
+                                                  categoria='General', monto=Decimal('500'), tipo='GASTO',
+                                                  cuenta_origen='tc ', cuenta_destino='Super')
+            registro_transacciones.objects.create(propietario=self.user, fecha=date(2025, 3, 2), descripcion='Pago',
+                                                  categoria='General', monto=Decimal('200'), tipo='TRANSFERENCIA',
+                                                  cuenta_origen='nómina', cuenta_destino='Tc')
+        self.tc.refresh_from_db()
+        self.assertEqual(self.tc.saldo_pendiente, Decimal('9700'))
+        self.assertEqual(list(EstadoCuentaTarjeta.objects.filter(deuda=self.tc).values_list('cargos', 'pagos')),
+                         [(Decimal('500'), Decimal('200'))])
+        self.assertEqual(SaldoMensualCuenta.objects.get(cuenta__nombre='Nómina').movimiento_neto, Decimal('-200'))
+        # La reconstrucción y el widget empatan los nombres igual que el camino incremental.
+        EstadoCuentaTarjeta.objects.reconstruir(self.tc)
+        self.assertEqual(list(EstadoCuentaTarjeta.objects.filter(deuda=self.tc).values_list('cargos', 'pagos')),
+                         [(Decimal('500'), Decimal('200'))])
+        nomina = Cuenta.objects.get(nombre='Nómina')
+        self.assertEqual(SaldoMensualCuenta.objects.reconstruir(nomina, verificar=True), [])
+        self.assertEqual(SaldoMensualCuenta.objects.saldo_al(nomina, date(2025, 4, 1)), Decimal('-200'))
+        metricas = CardMetricsService.metricas(self.user, ['Nómina'], 2025, 3)
+        self.assertEqual(metricas['Nómina']['gastos']['total'], '200.00')
+
+    def test_saldo_de_tarjeta_no_depende_de_la_copia_en_memoria(self):
+        with ReferenceDataService.alcance():
+            ReferenceDataService.de_usuario(self.user)
+            # Otro worker movió el saldo sin pasar por este proceso.
+            Deuda.objects.filter(pk=self.tc.pk).update(saldo_pendiente=Decimal('8000'))
+            registro_transacciones.objects.create(propietario=self.user, fecha=date(2025, 3, 1), descripcion='Compra',
+                                                  categoria='General', monto=Decimal('500'), tipo='GASTO',
+                                                  cuenta_origen='TC', cuenta_destino='Super')
+        self.tc.refresh_from_db()
+        self.assertEqual(self.tc.saldo_pendiente, Decimal('7500'))
+
+class GraficasCondicionalesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='graficas')
+        Cuenta.objects.create(propietario=self.user, nombre='Nómina', tipo='DEBITO', es_principal=True)
+        self.client.force_login(self.user)
+
+    def test_decimales_como_texto_y_series_largas_comprimidas(self):
+        flujo = self.client.get(reverse('api_flujo_dinero'), {'year': 2025, 'month': 3})
+        self.assertEqual(json.loads(flujo.content)['data'], ['0.00', '0.00'])
+        self.assertFalse(flujo.has_header('Content-Encoding'))
+
+        NetWorthSnapshot.objects.bulk_create([
+            NetWorthSnapshot(usuario=self.user, fecha=date(2025, 1, 1) + timedelta(days=i), cuentas=Decimal('1000'),
+                             inversiones=Decimal('500'), deudas=Decimal('200'), patrimonio=Decimal('1300'))
+            for i in range(300)
+        ])
+        serie = self.client.get(reverse('api_datos_patrimonio'), {'rango': 'max'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(serie['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', serie['Vary'])
+        self.assertEqual(len(json.loads(gzip.decompress(serie.content))['labels']), 300)
+
+class SeriePortafolioTest(TestCase):
+    def test_lttb_conserva_extremos_y_picos(self):
+        valores = [100.0] * 1000
+        valores[437] = 900.0
+        indices = PortfolioSeriesService.lttb(valores, 50)
+        self.assertEqual(len(indices), 50)
+        self.assertEqual((indices[0], indices[-1]), (0, 999))
+        self.assertIn(437, indices)
+        self.assertEqual(indices, sorted(indices))
+
+    def test_endpoint_reduce_y_elige_resolucion(self):
+        user = User.objects.create(username='serie')
+        hoy = timezone.localdate()
+        PortfolioHistory.objects.bulk_create([
+            PortfolioHistory(usuario=user, fecha=hoy - timedelta(days=i), valor_total=Decimal(1000 + i),
+                             capital_invertido=Decimal('900'), ganancia_no_realizada=Decimal(100 + i))
+            for i in range(1500)
+        ])
+        self.client.force_login(user)
+
+        anio = json.loads(self.client.get(reverse('api_datos_portafolio'), {'rango': '1a', 'puntos': 100}).content)
+        self.assertEqual((anio['resolucion'], len(anio['labels'])), ('diaria', 100))
+        self.assertEqual(anio['labels'][-1], hoy.isoformat())
+
+        todo = json.loads(self.client.get(reverse('api_datos_portafolio'), {'rango': 'max', 'puntos': 100}).content)
+        self.assertEqual(todo['resolucion'], 'semanal')
+        self.assertEqual(len(todo['valores']), 100)
+        semanas = {date.fromisoformat(f).isocalendar()[:2] for f in todo['labels']}
+        self.assertEqual(len(semanas), 100)
+
+        self.assertEqual(self.client.get(reverse('api_datos_portafolio'), {'resolucion': 'horaria'}).status_code, 400)
+        pagina = self.client.get(reverse('portafolio'))
+        self.assertEqual(len(pagina.context['perf_inicial']['labels']), 183)
+
+class HistorialCompactoTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='compacto')
+        inicio = date(2023, 12, 1)
+        self.filas = [(inicio + timedelta(days=i), Decimal('1000.005') + i, Decimal('900'), Decimal('100.004') + i)
+                      for i in range(800)]
+
+    @override_settings(PORTFOLIO_HISTORY_STORAGE='anual')
+    def test_un_renglon_por_anio_y_lectura_por_rango(self):
+        self.assertEqual(PortfolioHistory.objects.reemplazar(self.user.id, self.filas), 4)
+        self.assertEqual(PortfolioHistory.objects.filter(usuario=self.user).count(), 0)
+        self.assertEqual(PortfolioHistory.objects.primera_fecha(self.user.id), date(2023, 12, 1))
+
+        with self.assertNumQueries(2):
+            rango = list(PortfolioHistory.objects.serie(self.user.id, date(2024, 12, 30), date(2025, 1, 2)))
+        self.assertEqual([f for f, *_ in rango], [date(2024, 12, 30) + timedelta(days=i) for i in range(4)])
+        self.assertEqual(rango[0][1:], (Decimal('1395.01'), Decimal('900.00'), Decimal('495.00')))
+
+    def test_compactar_y_volver_sin_perder_datos(self):
+        PortfolioHistory.objects.reemplazar(self.user.id, self.filas)
+        diaria = list(PortfolioHistory.objects.serie(self.user.id))
+        self.assertEqual(len(diaria), 800)
+
+        with override_settings(PORTFOLIO_HISTORY_STORAGE='anual'):
+            call_command('compactar_portfolio_history', stdout=open(os.devnull, 'w'))
+            self.assertEqual(PortfolioHistoryAnual.objects.filter(usuario=self.user).count(), 4)
+            self.assertEqual(list(PortfolioHistory.objects.serie(self.user.id)), diaria)
+        # Con el modo diario activo todavía se lee el bloque hasta que se reconstruya.
+        self.assertEqual(list(PortfolioHistory.objects.serie(self.user.id)), diaria)
+        call_command('compactar_portfolio_history', stdout=open(os.devnull, 'w'))
+        self.assertEqual(PortfolioHistory.objects.filter(usuario=self.user).count(), 800)
+        self.assertFalse(PortfolioHistoryAnual.objects.exists())
+
+class PosicionesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='posiciones')
+
+    def lote(self, ticker, cantidad, precio, actual, nombre=None, tipo='ACCION', fecha=date(2025, 1, 2)):
+        return inversiones.objects.create(
+            propietario=self.user, emisora_ticker=ticker, nombre_activo=nombre or ticker, tipo_inversion=tipo,
+            cantidad_titulos=cantidad, fecha_compra=fecha, precio_compra_titulo=precio, precio_actual_titulo=actual,
+            costo_total_adquisicion=0, valor_actual_mercado=0, ganancia_perdida_no_realizada=0,
+        )
+
+    def test_se_mantiene_al_crear_editar_y_borrar_lotes(self):
+        primero = self.lote('voo', 2, 10, 12, fecha=date(2024, 6, 1))
+        self.lote('VOO', 6, 14, 12)
+        self.lote(None, Decimal('0.5'), 100, 120, nombre='Bitcoin', tipo='CRIPTO')
+
+        voo = Holding.objects.get(propietario=self.user, clave='VOO')
+        self.assertEqual((voo.lotes, voo.cantidad_titulos, voo.costo_total_adquisicion), (2, 8, 104))
+        self.assertEqual((voo.precio_promedio, voo.valor_actual_mercado, voo.primera_compra),
+                         (13, 96, date(2024, 6, 1)))
+        self.assertIsNone(Holding.objects.get(clave='Bitcoin').emisora_ticker)
+
+        primero.emisora_ticker = 'SPY'
+        primero.save()
+        self.assertEqual(Holding.objects.get(clave='VOO').cantidad_titulos, 6)
+        self.assertEqual(Holding.objects.get(clave='SPY').lotes, 1)
+        primero.delete()
+        self.assertFalse(Holding.objects.filter(clave='SPY').exists())
+
+        Holding.objects.all().update(cantidad_titulos=0)
+        self.assertEqual(Holding.objects.reconstruir(self.user.id), 2)
+        self.assertEqual(Holding.objects.get(clave='VOO').cantidad_titulos, 6)
+
+    def test_precio_actualiza_un_renglon_por_usuario(self):
+        self.lote('VOO', 2, 10, 10)
+        self.lote('VOO', 3, 10, 10)
+
+        class Precio:
+            def get_current_price(self, ticker):
+                return 12.5
+
+        with self.assertNumQueries(6):
+            usuarios = InvestmentService.refresh_ticker_price('VOO', Precio())
+        self.assertEqual(usuarios, [self.user.id])
+        voo = Holding.objects.get(clave='VOO')
+        self.assertEqual((voo.valor_actual_mercado, voo.ganancia_perdida_no_realizada), (Decimal('62.5'), Decimal('12.5')))
+        self.assertEqual(sum(i.valor_actual_mercado for i in inversiones.objects.all()), Decimal('62.5'))
+
+class VentasInversionTest(TestCase):
+    def test_metodos_de_costeo(self):
+        compras = [(1, date(2025, 1, 1), 10, 100), (2, date(2025, 2, 1), 10, 200)]
+        ventas = [(7, date(2025, 3, 1), 15)]
+        esperado = {'FIFO': (200, 5, 100), 'LIFO': (250, 5, 50), 'PROMEDIO': (225, 5, 75)}
+        for metodo, (costo, cantidad_abierta, costo_abierto) in esperado.items():
+            resultados, abiertos = LotMatchingService.emparejar(compras, ventas, metodo)
+            self.assertEqual(resultados[7][0], costo, metodo)
+            self.assertEqual((sum(l[1] for l in abiertos), sum(l[2] for l in abiertos)), (cantidad_abierta, costo_abierto), metodo)
+
+    def test_ventas_guardan_ganancia_y_reducen_la_posicion(self):
+        user = User.objects.create(username='ventas')
+        for fecha, precio in ((date(2025, 1, 1), 10), (date(2025, 2, 1), 20)):
+            inversiones.objects.create(
+                propietario=user, emisora_ticker='VOO', nombre_activo='VOO', cantidad_titulos=10, fecha_compra=fecha,
+                precio_compra_titulo=precio, precio_actual_titulo=30,
+                costo_total_adquisicion=0, valor_actual_mercado=0, ganancia_perdida_no_realizada=0,
+            )
+        venta = VentaInversion.objects.create(propietario=user, emisora_ticker='VOO', nombre_activo='VOO',
+                                              fecha_venta=date(2025, 3, 1), cantidad_titulos=15, precio_venta_titulo=30)
+        self.assertEqual((venta.costo_base, venta.ganancia_realizada), (200, 250))
+        self.assertEqual(sorted(inversiones.objects.values_list('ganancia_perdida', flat=True)), [50, 200])
+        voo = Holding.objects.get(clave='VOO')
+        self.assertEqual((voo.cantidad_titulos, voo.costo_total_adquisicion, voo.valor_actual_mercado), (5, 100, 150))
+
+        VentaInversion.objects.create(propietario=user, emisora_ticker='VOO', nombre_activo='VOO', comision=5,
+                                      fecha_venta=date(2025, 4, 1), cantidad_titulos=5, precio_venta_titulo=40)
+        self.assertFalse(Holding.objects.filter(clave='VOO').exists())
+
+        self.client.force_login(user)
+        reporte = json.loads(self.client.get(reverse('api_ganancias_realizadas'), {'anio': 2025}).content)
+        self.assertEqual(Decimal(reporte['ganancia']), Decimal('345'))
+
+    def test_lo_vendido_sale_del_valor_y_de_las_series(self):
+        user = User.objects.create(username='series-ventas')
+        inversiones.objects.create(
+            propietario=user, emisora_ticker='VOO', nombre_activo='VOO', cantidad_titulos=10, fecha_compra=date(2025, 1, 1),
+            precio_compra_titulo=10, precio_actual_titulo=10,
+            costo_total_adquisicion=0, valor_actual_mercado=0, ganancia_perdida_no_realizada=0,
+        )
+        VentaInversion.objects.create(propietario=user, emisora_ticker='VOO', nombre_activo='VOO',
+                                      fecha_venta=date(2025, 2, 10), cantidad_titulos=4, precio_venta_titulo=15)
+
+        class Precios:
+            def get_current_price(self, ticker):
+                return 20
+
+            def get_daily_series(self, ticker, inicio, fin):
+                return [{'datetime': '2025-02-09', 'close': 15}]
+
+        InvestmentService.refresh_ticker_price('VOO', Precios())
+        lote = inversiones.objects.get()
+        self.assertEqual((lote.valor_actual_mercado, lote.ganancia_perdida_no_realizada), (120, 60))
+        self.assertEqual(Holding.objects.get(clave='VOO').valor_actual_mercado, 120)
+
+        historial = {d['fecha']: d for d in InvestmentService.calculate_daily_portfolio_history(user, Precios())}
+        self.assertEqual((historial[date(2025, 2, 9)]['valor_total'], historial[date(2025, 2, 9)]['capital_invertido']), (150, 100))
+        self.assertEqual((historial[date(2025, 2, 10)]['valor_total'], historial[date(2025, 2, 10)]['capital_invertido']), (90, 60))
+
+        series = {'VOO': {'2025-01': Decimal('12'), '2025-02': Decimal('15')}}
+        ganancias = InvestmentService.monthly_profit_from_series(
+            [lote], series, hoy=date(2025, 2, 28),
+            consumos=InvestmentService.consumos_de_ventas(VentaInversion.objects.filter(propietario=user)))
+        self.assertEqual(ganancias, {'2025-01': 20, '2025-02': 30})
+
+class MetricasPortafolioTest(TestCase):
+    def setUp(self):
+        # 1000 que se duplican en 100 días, se aportan 10,000 y luego baja a 11,000.
+        inicio = date(2024, 1, 1)
+        self.fechas = [inicio + timedelta(days=i) for i in range(201)]
+        self.valores = [1000 + 10 * i for i in range(100)] + [12000 - 10 * i for i in range(101)]
+        self.capital = [1000] * 100 + [11000] * 101
+
+    def test_twr_no_cuenta_aportaciones(self):
+        m = PortfolioMetricsService.calcular(self.fechas, self.valores, self.capital)
+        # El simple da 0% (11,000 contra 11,000); el TWR encadena 2 × 11/12.
+        self.assertAlmostEqual(m['twr'], 2 * 11000 / 12000 - 1)
+        self.assertIsNone(m['twr_anual'])
+        self.assertAlmostEqual(m['max_drawdown'], 11000 / 12000 - 1)
+        self.assertEqual((m['drawdown_pico'], m['drawdown_fondo']), ('2024-04-10', '2024-07-19'))
+        self.assertGreater(m['volatilidad_30d'], 0)
+
+        t = (date(2024, 4, 10) - date(2024, 1, 1)).days / 365, 200 / 365
+        vpn = -1000 - 10000 / (1 + m['xirr']) ** t[0] + 11000 / (1 + m['xirr']) ** t[1]
+        self.assertAlmostEqual(vpn, 0, places=4)
+        self.assertIsNone(PortfolioMetricsService.xirr(np.array([-1.0, -2.0]), np.array([0.0, 1.0])))
+
+    def test_endpoint_y_vista(self):
+        user = User.objects.create(username='metricas')
+        PortfolioHistory.objects.reemplazar(user.id, [
+            (f, Decimal(v), Decimal(c), Decimal(v - c)) for f, v, c in zip(self.fechas, self.valores, self.capital)
+        ])
+        self.client.force_login(user)
+        datos = json.loads(self.client.get(reverse('api_metricas_portafolio')).content)
+        self.assertAlmostEqual(datos['twr'], 2 * 11000 / 12000 - 1)
+        pagina = self.client.get(reverse('portafolio'))
+        self.assertAlmostEqual(pagina.context['metricas']['max_drawdown'], (11000 / 12000 - 1) * 100)
+
+class ProveedorTipoCambioFalso(ExchangeRateService):
+    """currencyapi en memoria; registra cada llamada."""
+    def __init__(self, tasas, client):
+        super().__init__(client=client)
+        self.proveedor, self.llamadas = tasas, []
+
+    def _pedir_dia(self, fecha):
+        self.llamadas.append(fecha)
+        return self.proveedor.get(fecha)
+
+    def _pedir_rango(self, desde, hasta):
+        self.llamadas.append((desde, hasta))
+        return {f: t for f, t in self.proveedor.items() if desde <= f <= hasta}
+
+class ProveedorCaido(ProveedorTipoCambioFalso):
+    def _pedir_dia(self, fecha):
+        self.llamadas.append(fecha)
+        raise ConnectionError('timeout')
+
+class TipoCambioTest(TestCase):
+    def setUp(self):
+        ExchangeRateService._cache.clear()
+        self.redis = redis_falso()
+        # Solo días hábiles, como el proveedor.
+        dias = [date(2023, 1, 1) + timedelta(days=i) for i in range(547)]
+        self.proveedor = {d: Decimal('17') + Decimal(i) / 1000 for i, d in enumerate(dias) if d.weekday() < 5}
+
+    def test_respaldo_por_rango_y_sin_red_despues(self):
+        fx = ProveedorTipoCambioFalso(self.proveedor, self.redis)
+        fx.respaldar(date(2023, 1, 1), date(2024, 6, 30))
+        self.assertEqual(len(fx.llamadas), 2)
+        # Del primer al último día hábil, sin huecos; el domingo final no se arrastra.
+        self.assertEqual(TipoCambio.objects.first().fecha, date(2023, 1, 2))
+        self.assertEqual(TipoCambio.objects.last().fecha, date(2024, 6, 28))
+        self.assertEqual(TipoCambio.objects.count(), (date(2024, 6, 28) - date(2023, 1, 2)).days + 1)
+
+        viernes, sabado = date(2024, 6, 21), date(2024, 6, 22)
+        with self.assertNumQueries(1):
+            self.assertEqual(fx.get_usd_mxn_rate(viernes), self.proveedor[viernes])
+        with self.assertNumQueries(0):
+            fx.get_usd_mxn_rate(datetime(2024, 6, 21, 15, 0))
+        with self.assertNumQueries(1):
+            self.assertEqual(fx.get_usd_mxn_rate(sabado), self.proveedor[viernes])
+        self.assertTrue(TipoCambio.objects.get(fecha=sabado).arrastrado)
+        # Lo arrastrado no se queda en el LRU: el dato real se ve en cuanto se guarda.
+        TipoCambio.objects.filter(fecha=sabado).update(usd_mxn=Decimal('19.5'), arrastrado=False)
+        self.assertEqual(fx.get_usd_mxn_rate(sabado), Decimal('19.5'))
+        self.assertEqual(len(fx.llamadas), 2)
+
+        tasas = fx.tasas(date(2024, 6, 27), date(2024, 7, 2))
+        self.assertEqual(len(tasas), 6)
+        self.assertEqual(tasas[date(2024, 7, 2)], self.proveedor[date(2024, 6, 28)])
+
+    def test_una_sola_llamada_por_fecha(self):
+        lunes = date(2023, 3, 6)
+        ocupada = ProveedorTipoCambioFalso(self.proveedor, self.redis)
+        # Otra tarea tiene el candado y ya publicó: no se llama al proveedor.
+        self.redis.set(f"fx:usd_mxn:{lunes}:candado", 1, nx=True)
+        self.redis.set(f"fx:usd_mxn:{lunes}", '18.5')
+        self.assertEqual(ocupada.get_usd_mxn_rate(lunes), Decimal('18.5'))
+        self.assertEqual(ocupada.llamadas, [])
+
+        martes = date(2023, 3, 7)
+        primera = ProveedorTipoCambioFalso(self.proveedor, self.redis)
+        self.assertEqual(primera.get_usd_mxn_rate(martes), self.proveedor[martes])
+        self.assertEqual(primera.llamadas, [martes])
+        self.assertEqual(self.redis.get(f"fx:usd_mxn:{martes}"), str(self.proveedor[martes]).encode())
+        self.assertFalse(self.redis.exists(f"fx:usd_mxn:{martes}:candado"))
+
+        # Feriado sin dato: una llamada, y luego el martes anterior guardado.
+        feriado = date(2023, 3, 8)
+        del self.proveedor[feriado]
+        self.assertEqual(primera.get_usd_mxn_rate(feriado), self.proveedor[martes])
+        otra = ProveedorTipoCambioFalso(self.proveedor, self.redis)
+        self.assertEqual(otra.get_usd_mxn_rate(feriado), self.proveedor[martes])
+        self.assertEqual(primera.llamadas + otra.llamadas, [martes, feriado])
+
+    def test_falla_del_proveedor_no_se_publica(self):
+        lunes = date(2023, 3, 6)
+        caido = ProveedorCaido(self.proveedor, self.redis)
+        self.assertIsNone(caido.get_usd_mxn_rate(lunes))
+        self.assertFalse(self.redis.exists(f"fx:usd_mxn:{lunes}", f"fx:usd_mxn:{lunes}:candado"))
+
+        # La siguiente llamada sí va al proveedor en vez de leer un "sin dato" publicado.
+        sano = ProveedorTipoCambioFalso(self.proveedor, self.redis)
+        self.assertEqual(sano.get_usd_mxn_rate(lunes), self.proveedor[lunes])
+        self.assertEqual(caido.llamadas + sano.llamadas, [lunes, lunes])
+
+    def test_serie_del_portafolio_en_pesos(self):
+        user = User.objects.create(username='pesos')
+        hoy = timezone.localdate()
+        PortfolioHistory.objects.reemplazar(user.id, [
+            (hoy - timedelta(days=i), Decimal('100'), Decimal('80'), Decimal('20')) for i in range(5)
+        ])
+        TipoCambio.objects.create(fecha=hoy - timedelta(days=3), usd_mxn=Decimal('18'))
+        self.client.force_login(user)
+        serie = json.loads(self.client.get(reverse('api_datos_portafolio'), {'rango': '1s', 'moneda': 'mxn'}).content)
+        self.assertEqual(serie['moneda'], 'MXN')
+        self.assertEqual(serie['labels'][0], (hoy - timedelta(days=3)).isoformat())
+        self.assertEqual(serie['valores'], [1800.0] * 4)
+
 class RegistroTransaccionesModelTest(TestCase):
     def test_str_representation(self):
         user = User.objects.create(username="tester")
@@ -21,6 +21,11 @@ urlpatterns = [
     path('api/datos-flujo-dinero/', views.datos_flujo_dinero, name='api_flujo_dinero'),
     path('api/datos-inversiones/', views.datos_inversiones, name='api_datos_inversiones'),
     path('api/dashboard/ingresos-tarjeta/', views.api_ingresos_tarjeta, name='api_ingresos_tarjeta'),
+    path('api/dashboard/ingresos-tarjetas/', views.api_ingresos_tarjetas, name='api_ingresos_tarjetas'),
+    path('api/datos-patrimonio/', views.datos_patrimonio, name='api_datos_patrimonio'),
+    path('api/datos-portafolio/', views.datos_portafolio, name='api_datos_portafolio'),
+    path('api/metricas-portafolio/', views.datos_metricas_portafolio, name='api_metricas_portafolio'),
+    path('api/ganancias-realizadas/', views.ganancias_realizadas, name='api_ganancias_realizadas'),
     path('procesamiento-automatico/', views.vista_procesamiento_automatico, name='procesamiento_automatico'),
     path('procesar-drive/', views.iniciar_procesamiento_drive, name='procesar_drive'),
     path('revisar-tickets/', views.revisar_tickets, name='revisar_tickets'),
@@ -30,6 +35,7 @@ urlpatterns = [
     path('aprobar-todos-tickets/', views.aprobar_todos_tickets, name='aprobar_todos_tickets'),
     path('rechazar-todos-tickets/', views.rechazar_todos_tickets, name='rechazar_todos_tickets'),
     path('estado-grupo/<str:group_id>/', views.get_group_status, name='get_group_status'),
+    path('progreso-escaneo/<str:scan_id>/', views.stream_scan_progress, name='stream_scan_progress'),
     path('api/cancelar-procesamiento/', views.cancelar_procesamiento, name='cancelar_procesamiento'),
     path('revisar_tickets/', views.revisar_tickets, name='revisar_tickets'),
     path('inversiones/', views.lista_inversiones, name='lista_inversiones'),
@@ -52,6 +58,9 @@ urlpatterns = [
     path('deudas/', views.lista_deudas, name='lista_deudas'),
     path('deudas/crear/', views.crear_deuda, name='crear_deuda'),
     path('deudas/<int:deuda_id>/', views.detalle_deuda, name='detalle_deuda'),
+    path('deudas/simulacion/', views.simular_liquidacion_deudas, name='simular_liquidacion_deudas'),
+    path('deudas/<int:deuda_id>/estados-cuenta/', views.api_estados_cuenta_tarjeta, name='api_estados_cuenta_tarjeta'),
+    path('deudas/proximos-pagos/', views.api_proximos_pagos_tarjetas, name='api_proximos_pagos_tarjetas'),
     path('deudas/<int:deuda_id>/editar/', views.editar_deuda, name='editar_deuda'),
     path('deudas/<int:deuda_id>/eliminar/', views.eliminar_deuda, name='eliminar_deuda'),
     path('mi_perfil/', views.mi_perfil, name='mi_perfil'),
@@ -96,6 +105,7 @@ urlpatterns = [
     path('cuentas/', views.gestionar_cuentas, name='gestionar_cuentas'),
     path('cuentas/editar/<int:cuenta_id>/', views.editar_cuenta, name='editar_cuenta'),
     path('cuentas/eliminar/<int:cuenta_id>/', views.eliminar_cuenta, name='eliminar_cuenta'),
+    path('cuentas/<int:cuenta_id>/saldo/', views.api_saldo_cuenta, name='api_saldo_cuenta'),
     path('presupuesto/', views.presupuesto_view, name='presupuesto'),
     path('presupuesto/historicos/', views.revisar_historicos, name='revisar_historicos'),
     path('presupuesto/crear/', views.crear_presupuesto, name='crear_presupuesto'),
@@ -1,6 +1,12 @@
 # finanzas/utils.py
-from datetime import datetime, date
+import asyncio
+import calendar
+from datetime import datetime, date, timedelta
 import logging
+from functools import lru_cache
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, connections
 from dateutil.parser import parse as dateutil_parse, ParserError
 
 logger = logging.getLogger(__name__)
@@ -17,3 +23,89 @@ def parse_date_safely(date_str: str | None) -> date:
         logger.warning(f"La fecha extraída '{parsed_date}' es muy antigua y fue descartada. Se usará la fecha actual.")
         return datetime.now().date()
     return parsed_date
+
+
+def _dia_en_mes(year: int, month: int, dia: int) -> date:
+    """El día 'dia' del mes, o el último día si el mes es más corto (ej. día 31 en febrero)."""
+    return date(year, month, min(dia, calendar.monthrange(year, month)[1]))
+
+
+def proxima_fecha_con_dia(fecha: date, dia: int) -> date:
+    """Primera fecha >= 'fecha' que cae en el día 'dia' del mes."""
+    candidata = _dia_en_mes(fecha.year, fecha.month, dia)
+    if candidata < fecha:
+        year, month = (fecha.year + 1, 1) if fecha.month == 12 else (fecha.year, fecha.month + 1)
+        candidata = _dia_en_mes(year, month, dia)
+    return candidata
+
+
+def ciclo_de_corte(fecha: date, dia_corte: int | None) -> tuple[date, date]:
+    """
+    Periodo de facturación (inicio, corte) al que pertenece 'fecha'.
+    Sin día de corte configurado el ciclo es el mes calendario.
+    """
+    corte = proxima_fecha_con_dia(fecha, dia_corte or 31)
+    year, month = (corte.year - 1, 12) if corte.month == 1 else (corte.year, corte.month - 1)
+    return _dia_en_mes(year, month, dia_corte or 31) + timedelta(days=1), corte
+
+
+def fecha_limite_pago(corte: date, dia_pago: int | None) -> date | None:
+    """Fecha límite de pago del estado de cuenta que corta en 'corte'."""
+    if not dia_pago:
+        return None
+    return proxima_fecha_con_dia(corte + timedelta(days=1), dia_pago)
+
+
+# Tope de las lecturas que bloquean en el servidor (XREAD ... BLOCK).
+REDIS_BLOQUEO_MAX_SEGUNDOS = 20
+
+
+@lru_cache(maxsize=1)
+def get_redis_client():
+    """
+    Cliente Redis compartido (mismo servidor que el broker de Celery). Timeout corto: lo usan
+    las peticiones web (sesiones, plan, referencias, versiones) y si Redis se cuelga deben
+    caer a la base en segundos.
+    """
+    import redis
+    return redis.Redis.from_url(settings.CELERY_BROKER_URL, socket_connect_timeout=2, socket_timeout=2)
+
+
+@lru_cache(maxsize=1)
+def get_redis_stream_client():
+    """Cliente aparte para lecturas bloqueantes: su timeout pasa el bloqueo más largo permitido."""
+    import redis
+    return redis.Redis.from_url(settings.CELERY_BROKER_URL, socket_connect_timeout=2,
+                                socket_timeout=REDIS_BLOQUEO_MAX_SEGUNDOS + 5)
+
+
+def get_redis_async_stream_client():
+    """
+    Cliente asyncio para lecturas bloqueantes desde vistas async. No se cachea: queda atado
+    al event loop que lo crea, así que cada stream abre el suyo y lo cierra al terminar.
+    """
+    import redis.asyncio
+    return redis.asyncio.Redis.from_url(settings.CELERY_BROKER_URL, socket_connect_timeout=2,
+                                        socket_timeout=REDIS_BLOQUEO_MAX_SEGUNDOS + 5)
+
+
+def _consulta_en_hilo(fn):
+    """Corre fn con la conexión propia del hilo y la libera al terminar (los hilos del executor se reutilizan)."""
+    try:
+        return fn()
+    finally:
+        connections.close_all()
+
+
+async def consultas_concurrentes(*consultas):
+    """
+    Ejecuta a la vez callables sync independientes (consultas del ORM) y devuelve sus
+    resultados en el mismo orden. Los métodos a* del ORM corren todos en el hilo de la
+    petición, uno tras otro; aquí cada consulta va en su propio hilo y conexión, así que
+    la espera total es la de la consulta más lenta. Dentro de una transacción (pruebas,
+    atomic) se ejecutan en serie sobre la conexión actual: otra conexión no vería lo
+    que aún no se confirma.
+    """
+    if await sync_to_async(lambda: connection.in_atomic_block)():
+        return [await sync_to_async(fn)() for fn in consultas]
+    return await asyncio.gather(*(sync_to_async(_consulta_en_hilo, thread_sensitive=False)(fn) for fn in consultas))
@@ -42,7 +42,7 @@ from ..models import (
     inversiones, GananciaMensual, PendingInvestment, Deuda, 
     PagoAmortizacion, AmortizacionPendiente, Factura, PortfolioHistory,
     GoogleCredentials, TiendaFacturacion, Cuenta, Presupuesto, 
-    HistorialReciboServicio
+    HistorialReciboServicio, SaldoMensualCuenta
 )
 
 logger = logging.getLogger(__name__)
@@ -57,6 +57,8 @@ def gestionar_cuentas(request):
             cuenta = form.save(commit=False)
             cuenta.propietario = request.user
             cuenta.save()
+            # Puede haber transacciones previas que ya usaban este nombre.
+            SaldoMensualCuenta.objects.reconstruir(cuenta)
             
             if cuenta.tipo == 'CREDITO':
                 Deuda.objects.get_or_create(
@@ -88,9 +90,12 @@ def gestionar_cuentas(request):
 def editar_cuenta(request, cuenta_id):
     cuenta = get_object_or_404(Cuenta, id=cuenta_id, propietario=request.user)
     if request.method == 'POST':
+        nombre_anterior = cuenta.nombre
         form = CuentaForm(request.POST, instance=cuenta)
         if form.is_valid():
             form.save()
+            if cuenta.nombre != nombre_anterior:
+                SaldoMensualCuenta.objects.reconstruir(cuenta)
             messages.success(request, f"La cuenta '{cuenta.nombre}' ha sido actualizada.")
             return redirect('gestionar_cuentas')
     else:
@@ -106,3 +111,24 @@ def eliminar_cuenta(request, cuenta_id):
     messages.success(request, f"La cuenta '{nombre}' ha sido eliminada correctamente.")
     return redirect('gestionar_cuentas')
 
+@login_required
+def api_saldo_cuenta(request, cuenta_id):
+    """Saldo de una cuenta a una fecha (?fecha=AAAA-MM-DD, hoy por defecto) y sus últimos cierres mensuales."""
+    cuenta = get_object_or_404(Cuenta, id=cuenta_id, propietario=request.user)
+    fecha = timezone.now().date()
+    if request.GET.get('fecha'):
+        try:
+            fecha = datetime.strptime(request.GET['fecha'], '%Y-%m-%d').date()
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'El formato de fecha es inválido'}, status=400)
+
+    cierres = list(SaldoMensualCuenta.objects.filter(cuenta=cuenta, mes__lte=fecha)
+                   .order_by('-mes').values('mes', 'movimiento_neto', 'saldo_cierre')[:12])
+    return JsonResponse({
+        'status': 'success',
+        'cuenta': cuenta.nombre,
+        'fecha': fecha,
+        'saldo': float(SaldoMensualCuenta.objects.saldo_al(cuenta, fecha)),
+        'cierres': [{'mes': c['mes'].strftime('%Y-%m'), 'movimiento_neto': float(c['movimiento_neto']),
+                     'saldo_cierre': float(c['saldo_cierre'])} for c in reversed(cierres)],
+    })
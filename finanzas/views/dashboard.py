@@ -19,10 +19,15 @@ from django.views.decorators.http import require_POST, require_GET
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
 
+from asgiref.sync import sync_to_async
 from celery.result import AsyncResult, GroupResult
 
-from ..utils import parse_date_safely
+from ..utils import parse_date_safely, consultas_concurrentes
+from .respuestas import grafica_condicional, respuesta_json
 from ..services.finance_service import InvestmentService
+from ..services.net_worth_service import NetWorthService
+from ..services.card_metrics_service import CardMetricsService
+from ..services.reference_data_service import ReferenceDataService
 from ..tasks import (
     process_drive_tickets,
     process_drive_investments,
@@ -40,22 +45,26 @@ from ..services import (
 )
 from ..models import (
     registro_transacciones, Suscripcion, TransaccionPendiente, 
-    inversiones, GananciaMensual, PendingInvestment, Deuda, 
+    inversiones, Holding, GananciaMensual, PendingInvestment, Deuda, 
     PagoAmortizacion, AmortizacionPendiente, Factura, PortfolioHistory,
     GoogleCredentials, TiendaFacturacion, Cuenta, Presupuesto, 
-    HistorialReciboServicio
+    HistorialReciboServicio, NetWorthSnapshot
 )
 
 logger = logging.getLogger(__name__)
 
+FILTRO_AHORRO = (
+    # 1. Todo lo que esté categorizado explícitamente como Ahorro (menos Gastos)
+    (Q(categoria__iexact='Ahorro') & ~Q(tipo__in=['GASTO', 'PAGO_MENSUALIDAD', 'PAGO_CAPITAL'])) |
+    # 2. Transferencias directas a la Cuenta Ahorro
+    Q(tipo__iexact='TRANSFERENCIA', cuenta_destino__iexact='Cuenta Ahorro') |
+    # 3. Ingresos que entraron directo a Cuenta Ahorro
+    Q(tipo__iexact='INGRESO', cuenta_origen__iexact='Cuenta Ahorro')
+)
+
 @login_required
-def vista_dashboard(request):
-    # --- ONBOARDING OBLIGATORIO ---
-    # Si el usuario no tiene ninguna cuenta registrada, lo forzamos a crear una
-    if not Cuenta.objects.filter(propietario=request.user).exists():
-        messages.info(request, "¡Bienvenido! Para poder analizar tus tickets y automatizar tus gastos, primero necesitamos que registres al menos una cuenta o tarjeta.")
-        return redirect('gestionar_cuentas')
-    # ------------------------------
+async def vista_dashboard(request):
+    user = await request.auser()
 
     # Definimos fechas al inicio para usarlas en todo el dashboard
     current_year = datetime.now().year
@@ -63,21 +72,38 @@ def vista_dashboard(request):
     year = int(request.GET.get('year', current_year))
     month = int(request.GET.get('month', current_month))
 
-    suscripcion, created = Suscripcion.objects.get_or_create(usuario=request.user)
-    
-    # --- LÓGICA PARA LA GRÁFICA DE AHORRO (SAVINGS GROWTH) ---
-    # Calculamos el ahorro acumulado mes a mes para el año seleccionado
-    savings_qs = registro_transacciones.objects.filter(
-        propietario=request.user,
-        fecha__year=year
-    ).filter(
-        # 1. Todo lo que esté categorizado explícitamente como Ahorro (menos Gastos)
-        (Q(categoria__iexact='Ahorro') & ~Q(tipo__in=['GASTO', 'PAGO_MENSUALIDAD', 'PAGO_CAPITAL'])) |
-        # 2. Transferencias directas a la Cuenta Ahorro
-        Q(tipo__iexact='TRANSFERENCIA', cuenta_destino__iexact='Cuenta Ahorro') | 
-        # 3. Ingresos que entraron directo a Cuenta Ahorro 
-        Q(tipo__iexact='INGRESO', cuenta_origen__iexact='Cuenta Ahorro')
-    ).annotate(mes=TruncMonth('fecha')).values('mes').annotate(total=Sum('monto')).order_by('mes')
+    del_mes = registro_transacciones.objects.filter(propietario=user, fecha__year=year, fecha__month=month)
+    # Cuentas y deudas salen del memo de la petición (o de su copia en Redis).
+    refs = await sync_to_async(ReferenceDataService.de_usuario)(user)
+
+    # --- ONBOARDING OBLIGATORIO ---
+    # Si el usuario no tiene ninguna cuenta registrada, lo forzamos a crear una
+    if not refs.cuentas:
+        messages.info(request, "¡Bienvenido! Para poder analizar tus tickets y automatizar tus gastos, primero necesitamos que registres al menos una cuenta o tarjeta.")
+        return redirect('gestionar_cuentas')
+    # ------------------------------
+
+    tarjetas_credito = [d.nombre for d in refs.tarjetas()]
+
+    # Las consultas no dependen unas de otras: van todas a la vez y la página
+    # tarda lo que la más lenta, no la suma.
+    (savings_qs, bal, agregados_inversion, ahorros_tx_count,
+     pagos_prestamos, pagos_tc) = await consultas_concurrentes(
+        # Ahorro acumulado mes a mes para la gráfica del año seleccionado
+        lambda: list(registro_transacciones.objects.filter(propietario=user, fecha__year=year)
+                     .filter(FILTRO_AHORRO)
+                     .annotate(mes=TruncMonth('fecha')).values('mes').annotate(total=Sum('monto')).order_by('mes')),
+        lambda: registro_transacciones.objects.balance_dashboard(user, year, month),
+        lambda: Holding.objects.filter(propietario=user).aggregate(
+            total_inicial=Sum('costo_total_adquisicion'),
+            total_actual=Sum('valor_actual_mercado')
+        ),
+        lambda: del_mes.filter(FILTRO_AHORRO).count(),
+        lambda: del_mes.filter(tipo__in=['PAGO_MENSUALIDAD', 'PAGO_CAPITAL']).aggregate(total=Sum('monto'))['total'],
+        lambda: del_mes.filter(tipo='TRANSFERENCIA', cuenta_destino__in=tarjetas_credito).aggregate(total=Sum('monto'))['total'],
+    )
+    todas_deudas = list(refs.deudas.values())
+    las_cuentas = refs.cuentas_debito()
 
     savings_labels = []
     savings_data = []
@@ -107,18 +133,8 @@ def vista_dashboard(request):
     chart_data = savings_data
     # ----------------------------------------------
     
-    # Verificamos si la suscripción está activa con nuestro método del modelo.
-    es_usuario_premium = suscripcion.is_active()
-
-    # --- LA MAGIA DE LA OPTIMIZACIÓN (VIA MANAGER) ---
-    bal = registro_transacciones.objects.balance_dashboard(request.user, year, month)
-    
-    # Hacemos UNA SOLA CONSULTA para las inversiones
-    agregados_inversion = inversiones.objects.filter(propietario=request.user).aggregate(
-        total_inicial=Sum('costo_total_adquisicion'),
-        total_actual=Sum('valor_actual_mercado')
-    )
-    # --- FIN DE LA OPTIMIZACIÓN ---
+    # Estado premium cacheado en Redis (sin tocar la base en la mayoría de las visitas).
+    es_usuario_premium = await request.plan.aes_premium()
 
     # Asignamos valores desde el diccionario 'bal'
     ingresos = bal['ingresos_efectivo']
@@ -134,24 +150,11 @@ def vista_dashboard(request):
     disponible_banco = ingresos - gastos - transferencias - ahorro_total
     
     ahorro = ahorro_acumulado
-    
-    # --- Cálculo de Transacciones de Ahorro del Mes ---
-    ahorros_tx_count = registro_transacciones.objects.filter(
-        propietario=request.user,
-        fecha__year=year,
-        fecha__month=month
-    ).filter(
-        (Q(categoria__iexact='Ahorro') & ~Q(tipo__in=['GASTO', 'PAGO_MENSUALIDAD', 'PAGO_CAPITAL'])) |
-        Q(tipo__iexact='TRANSFERENCIA', cuenta_destino__iexact='Cuenta Ahorro') | 
-        Q(tipo__iexact='INGRESO', cuenta_origen__iexact='Cuenta Ahorro')
-    ).count()
 
     # --- Cálculo de Deuda Total ---
-    todas_deudas = Deuda.objects.filter(propietario=request.user)
     deuda_total = Decimal('0.00')
-    
-    num_tarjetas = todas_deudas.filter(tipo_deuda='TARJETA_CREDITO').count()
-    num_prestamos = todas_deudas.filter(tipo_deuda='PRESTAMO').count()
+    num_tarjetas = sum(1 for d in todas_deudas if d.tipo_deuda == 'TARJETA_CREDITO')
+    num_prestamos = sum(1 for d in todas_deudas if d.tipo_deuda == 'PRESTAMO')
     
     for d in todas_deudas:
         if d.tipo_deuda == 'TARJETA_CREDITO':
@@ -164,25 +167,8 @@ def vista_dashboard(request):
             deuda_total += d.saldo_pendiente
             
     # --- Pago total a deudas este mes ---
-    pagos_prestamos = registro_transacciones.objects.filter(
-        propietario=request.user,
-        fecha__year=year,
-        fecha__month=month,
-        tipo__in=['PAGO_MENSUALIDAD', 'PAGO_CAPITAL']
-    ).aggregate(total=Sum('monto'))['total'] or Decimal('0.00')
-    
-    nombres_tarjetas = todas_deudas.filter(tipo_deuda='TARJETA_CREDITO').values_list('nombre', flat=True)
-    pagos_tc = registro_transacciones.objects.filter(
-        propietario=request.user,
-        fecha__year=year,
-        fecha__month=month,
-        tipo='TRANSFERENCIA',
-        cuenta_destino__in=nombres_tarjetas
-    ).aggregate(total=Sum('monto'))['total'] or Decimal('0.00')
-    
-    total_pagado_deudas = pagos_prestamos + pagos_tc
+    total_pagado_deudas = (pagos_prestamos or Decimal('0.00')) + (pagos_tc or Decimal('0.00'))
     # --- Listado de Tarjetas para el Widget ---
-    las_cuentas = Cuenta.objects.filter(propietario=request.user, tipo='DEBITO').order_by('-es_principal', 'id')
     tarjetas_list = []
     for c in las_cuentas:
         term = c.terminacion.strip() if c.terminacion else ""
@@ -224,11 +210,14 @@ def vista_dashboard(request):
         'investment_chart_labels': chart_labels,
         'investment_chart_data': chart_data,
     }
-    return render(request, 'dashboard.html', context)
+    # El render puede tocar request.user (context processors), que es acceso sync a la DB.
+    return await sync_to_async(render)(request, 'dashboard.html', context)
 
 @login_required
 @require_GET
-def datos_gastos_categoria(request):
+@grafica_condicional
+async def datos_gastos_categoria(request):
+    user = await request.auser()
     try:
         year = int(request.GET.get('year', datetime.now().year))
         month = int(request.GET.get('month', datetime.now().month))
@@ -239,12 +228,12 @@ def datos_gastos_categoria(request):
     tipos = ['INGRESO'] if request.GET.get('tipo') == 'INGRESO' else ['GASTO', 'PAGO_MENSUALIDAD', 'PAGO_CAPITAL']
     agrupar = 'descripcion' if request.GET.get('agrupar') == 'descripcion' else 'categoria'
 
-    resumen = list(registro_transacciones.objects.filter(
-        propietario=request.user,
+    resumen = [fila async for fila in registro_transacciones.objects.filter(
+        propietario=user,
         tipo__in=tipos,
         fecha__year=year,
         fecha__month=month
-    ).values(agrupar).annotate(total=Sum('monto')).order_by('-total'))
+    ).values(agrupar).annotate(total=Sum('monto')).order_by('-total')]
 
     # Mostramos solo las 9 mayores; el resto se agrupa en "Otros" para que la dona sea legible
     LIMITE = 9
@@ -254,24 +243,25 @@ def datos_gastos_categoria(request):
     if otros:
         labels.append('Otros')
         montos.append(otros)
-    return JsonResponse({'labels': labels, 'data': montos})
+    return respuesta_json({'labels': labels, 'data': montos})
 
 @login_required
 @require_GET
-def datos_presupuesto(request):
-    print(f"DEBUG: api_datos_presupuesto hit by {request.user}")
-    presupuestos = Presupuesto.objects.filter(propietario=request.user).order_by('-monto_presupuestado')
+@grafica_condicional
+async def datos_presupuesto(request):
+    user = await request.auser()
+    presupuestos = Presupuesto.objects.filter(propietario=user).order_by('-monto_presupuestado')
     
     labels = []
     data_presupuestado = []
     data_real = []
     
-    for p in presupuestos:
+    async for p in presupuestos:
         labels.append(p.categoria)
         data_presupuestado.append(float(p.monto_presupuestado))
         data_real.append(float(p.monto_real))
         
-    return JsonResponse({
+    return respuesta_json({
         'labels': labels,
         'presupuestado': data_presupuestado,
         'real': data_real
@@ -279,61 +269,114 @@ def datos_presupuesto(request):
 
 @login_required
 @require_GET
-def datos_flujo_dinero(request):
+@grafica_condicional
+async def datos_flujo_dinero(request):
+    user = await request.auser()
     try:
         year = int(request.GET.get('year', datetime.now().year))
         month = int(request.GET.get('month', datetime.now().month))
     except ValueError:
         return JsonResponse({'error': 'Formato de fecha inválido'}, status=400)
-    transacciones_del_mes = registro_transacciones.objects.filter(
-        propietario=request.user,
+    # Ingresos y gastos de las cuentas de débito salen de un solo SELECT.
+    cuentas_debito = [c.nombre for c in (await sync_to_async(ReferenceDataService.de_usuario)(user)).cuentas_debito()]
+    totales = await registro_transacciones.objects.filter(
+        propietario=user,
         fecha__year=year,
-        fecha__month=month
+        fecha__month=month,
+        cuenta_origen__in=cuentas_debito,
+    ).exclude(categoria='Ahorro').aaggregate(
+        ingresos=Sum('monto', filter=Q(tipo='INGRESO')),
+        gastos=Sum('monto', filter=Q(tipo__in=['GASTO', 'PAGO_MENSUALIDAD', 'PAGO_CAPITAL'])),
     )
-    cuentas_debito = list(Cuenta.objects.filter(propietario=request.user, tipo='DEBITO').values_list('nombre', flat=True))
-    ingresos = transacciones_del_mes.filter(tipo='INGRESO', cuenta_origen__in=cuentas_debito).exclude(categoria='Ahorro').aggregate(total=Sum('monto'))['total'] or Decimal('0.00')
-    gastos = transacciones_del_mes.filter(tipo__in=['GASTO', 'PAGO_MENSUALIDAD', 'PAGO_CAPITAL'], cuenta_origen__in=cuentas_debito).exclude(categoria='Ahorro').aggregate(total=Sum('monto'))['total'] or Decimal('0.00')
+    ingresos = totales['ingresos'] or Decimal('0.00')
+    gastos = totales['gastos'] or Decimal('0.00')
     data = {
         'labels': ['Ingresos del Mes', 'Gastos del Mes'],
         'data': [ingresos, gastos],
     }
-    return JsonResponse(data)
+    return respuesta_json(data)
 
 @login_required
 @require_GET
-def datos_ganancias_mensuales(request):
+@grafica_condicional
+async def datos_ganancias_mensuales(request):
     """Retorna las ganancias mensuales acumuladas de las inversiones del usuario.
     profits = InvestmentService.calculate_monthly_profit(request.user)
     labels = list(profits.keys())
     data = [profits[month] for month in labels]
     return JsonResponse({'labels': labels, 'data': data})
     """
-    ganancias = GananciaMensual.objects.filter(
-        propietario=request.user
-    ).order_by('mes')
+    user = await request.auser()
+    ganancias = [g async for g in GananciaMensual.objects.filter(
+        propietario=user
+    ).order_by('mes')]
     labels = [g.mes for g in ganancias]
     data = [g.total for g in ganancias]
-    return JsonResponse({'labels': labels, 'data': data})
+    return respuesta_json({'labels': labels, 'data': data})
 
 @login_required
 @require_GET
-def datos_inversiones(request):
-    
-    qs = (
-        inversiones.objects
-        .filter(propietario=request.user)
+@grafica_condicional
+async def datos_inversiones(request):
+    user = await request.auser()
+    qs = [
+        item async for item in inversiones.objects
+        .filter(propietario=user)
         .annotate(month=TruncMonth('fecha_compra'))
         .values('month')
         .annotate(total=Sum('ganancia_perdida_no_realizada'))
         .order_by('month')
-    )
+    ]
     labels = [DateFormat(item['month']).format('Y-m') for item in qs]
     values = [item['total'] for item in qs]
-    return JsonResponse({'labels': labels, 'data': values})
+    return respuesta_json({'labels': labels, 'data': values})
+
+RANGOS_PATRIMONIO = {'1m': 30, '3m': 91, '6m': 182, '1a': 365, '5a': 1826}
+
+@login_required
+@require_GET
+@grafica_condicional
+async def datos_patrimonio(request):
+    """
+    Serie diaria de patrimonio desde NetWorthSnapshot. ?rango=1m|3m|6m|1a|5a|max o
+    ?desde=&hasta= (AAAA-MM-DD); ?puntos limita cuántos puntos se devuelven.
+    """
+    user = await request.auser()
+    hoy = timezone.now().date()
+    rango = request.GET.get('rango', '1a')
+    try:
+        puntos = min(max(int(request.GET.get('puntos', 365)), 2), 2000)
+        hasta = datetime.strptime(request.GET['hasta'], '%Y-%m-%d').date() if request.GET.get('hasta') else hoy
+        if request.GET.get('desde'):
+            desde = datetime.strptime(request.GET['desde'], '%Y-%m-%d').date()
+        elif rango == 'max':
+            desde = None
+        else:
+            desde = hasta - timedelta(days=RANGOS_PATRIMONIO[rango])
+    except (ValueError, KeyError):
+        return JsonResponse({'error': 'Parámetros de rango inválidos'}, status=400)
+
+    filas = NetWorthSnapshot.objects.filter(usuario=user, fecha__lte=hasta)
+    if desde:
+        filas = filas.filter(fecha__gte=desde)
+    filas = NetWorthService.reducir(
+        [f async for f in filas.order_by('fecha').values_list('fecha', 'cuentas', 'inversiones', 'deudas', 'patrimonio')], puntos
+    )
+    return respuesta_json({
+        'labels': [f.strftime('%Y-%m-%d') for f, *_ in filas],
+        'cuentas': [float(c) for _, c, _, _, _ in filas],
+        'inversiones': [float(i) for _, _, i, _, _ in filas],
+        'deudas': [float(d) for _, _, _, d, _ in filas],
+        'patrimonio': [float(p) for *_, p in filas],
+    })
 
 '''
 Deudas y amortizaciones
 '''
+def _mes_valido(year: int, month: int) -> bool:
+    """Las métricas también leen el mes anterior y el siguiente: deben existir como fechas."""
+    return 1 <= month <= 12 and 1 < year < 9999
+
 @login_required
 @require_GET
 def api_ingresos_tarjeta(request):
@@ -350,99 +393,37 @@ def api_ingresos_tarjeta(request):
             month = int(month)
         except ValueError:
             return JsonResponse({'status': 'error', 'message': 'El formato de fecha es inválido'}, status=400)
-        
-        # Calcular el mes anterior para la comparación
-        if month == 1:
-            prev_month = 12
-            prev_year = year - 1
-        else:
-            prev_month = month - 1
-            prev_year = year
-            
-        # --- NUEVA LÓGICA: Procesador de flujos con Transferencias ---
-        def procesar_flujo(es_entrada, y, m):
-            if es_entrada:
-                # Entradas: Ingresos normales OR Transferencias que llegaron a esta tarjeta
-                qs = registro_transacciones.objects.filter(
-                    propietario=request.user, fecha__year=y, fecha__month=m
-                ).filter(
-                    Q(tipo='INGRESO', cuenta_origen=cuenta_nombre) | 
-                    Q(tipo='TRANSFERENCIA', cuenta_destino=cuenta_nombre)
-                )
-            else:
-                # Salidas: Gastos normales OR Transferencias que salieron de esta tarjeta
-                qs = registro_transacciones.objects.filter(
-                    propietario=request.user, fecha__year=y, fecha__month=m
-                ).filter(
-                    Q(tipo='GASTO', cuenta_origen=cuenta_nombre) | 
-                    Q(tipo='TRANSFERENCIA', cuenta_origen=cuenta_nombre)
-                )
-            
-            agregados = qs.aggregate(
-                total=Sum('monto'),
-                num_categorias=Count('categoria', distinct=True)
-            )
-            
-            return {
-                'total': agregados['total'] or Decimal('0.00'),
-                'transactions': qs.count(),
-                'categories': agregados['num_categorias'] or 0
-            }
-
-        # 1. Obtenemos datos del mes actual y anterior
-        entradas_act = procesar_flujo(es_entrada=True, y=year, m=month)
-        salidas_act = procesar_flujo(es_entrada=False, y=year, m=month)
-        
-        entradas_prev = procesar_flujo(es_entrada=True, y=prev_year, m=prev_month)
-        salidas_prev = procesar_flujo(es_entrada=False, y=prev_year, m=prev_month)
-
-        # 2. Función auxiliar para calcular métricas de la tarjeta
-        def calcular_metricas(act, prev):
-            dif = act['total'] - prev['total']
-            if prev['total'] > 0:
-                pct = (dif / prev['total']) * Decimal('100.0')
-            else:
-                pct = Decimal('100.0') if act['total'] > 0 else Decimal('0.0')
-                
-            return {
-                'total': f"{act['total']:,.2f}",
-                'transactions': act['transactions'],
-                'categories': act['categories'],
-                'diferencia_monto': f"{abs(dif):,.2f}",
-                'porcentaje': round(float(abs(pct)), 1),
-                'es_positivo': bool(dif >= 0),
-            }
-
-        ingresos_data = calcular_metricas(entradas_act, entradas_prev)
-        gastos_data = calcular_metricas(salidas_act, salidas_prev)
-        
-        # 3. Calcular Balance Total de esta Tarjeta específica
-        balance_act = float(entradas_act['total']) - float(salidas_act['total'])
-        balance_prev = float(entradas_prev['total']) - float(salidas_prev['total'])
-        
-        dif_balance = balance_act - balance_prev
-        if balance_prev > 0:
-            pct_balance = (dif_balance / balance_prev) * 100.0
-        else:
-            pct_balance = 100.0 if balance_act > 0 else 0.0
-
-        balance_data = {
-            'total': f"{balance_act:,.2f}",
-            'transactions': entradas_act['transactions'] + salidas_act['transactions'],
-            'categories': entradas_act['categories'] + salidas_act['categories'],
-            'diferencia_monto': f"{abs(dif_balance):,.2f}",
-            'porcentaje': round(float(abs(pct_balance)), 1),
-            'es_positivo': bool(dif_balance >= 0),
-        }
-
-        return JsonResponse({
-            'status': 'success',
-            'ingresos': ingresos_data,
-            'gastos': gastos_data,
-            'balance': balance_data
-        })
+        if not _mes_valido(year, month):
+            return JsonResponse({'status': 'error', 'message': 'El formato de fecha es inválido'}, status=400)
+
+        # Entradas/salidas del mes y del anterior en una sola consulta agrupada.
+        metricas = CardMetricsService.metricas(request.user, [cuenta_nombre], year, month)[cuenta_nombre]
+        return JsonResponse({'status': 'success', **metricas})
         
     except Exception as e:
         logger.error(f"Error en api_ingresos_tarjeta: {e}")
         return JsonResponse({'status': 'error', 'message': 'Ha ocurrido un error inesperado al procesar los ingresos.'}, status=500)
 
+@login_required
+@require_GET
+def api_ingresos_tarjetas(request):
+    """Métricas de todas las cuentas del widget (o ?cuentas=a,b) en una respuesta y una consulta."""
+    try:
+        year = int(request.GET.get('year', datetime.now().year))
+        month = int(request.GET.get('month', datetime.now().month))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'El formato de fecha es inválido'}, status=400)
+    if not _mes_valido(year, month):
+        return JsonResponse({'status': 'error', 'message': 'El formato de fecha es inválido'}, status=400)
+
+    if request.GET.get('cuentas'):
+        cuentas = [c for c in request.GET['cuentas'].split(',') if c]
+    else:
+        cuentas = [c.nombre for c in ReferenceDataService.de_usuario(request.user).cuentas_debito()]
+    try:
+        metricas = CardMetricsService.metricas(request.user, cuentas, year, month)
+    except Exception as e:
+        logger.error(f"Error en api_ingresos_tarjetas: {e}")
+        return JsonResponse({'status': 'error', 'message': 'Ha ocurrido un error inesperado al procesar los ingresos.'}, status=500)
+    return JsonResponse({'status': 'success', 'tarjetas': metricas})
+
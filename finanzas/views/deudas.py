@@ -1,4 +1,5 @@
 import json
+import math
 import logging
 from decimal import Decimal
 from datetime import datetime, timedelta
@@ -10,6 +11,7 @@ from django.contrib.auth import login
 from django.http import HttpResponse, JsonResponse
 from django.core.mail import send_mail
 from django.conf import settings
+from django.db import transaction
 from django.db.models import Sum, Q, Count
 from django.contrib.auth.models import User
 from django.utils.dateformat import DateFormat
@@ -23,6 +25,9 @@ from celery.result import AsyncResult, GroupResult
 
 from ..utils import parse_date_safely
 from ..services.finance_service import DebtService
+from ..services.debt_simulation_service import (
+    DebtPayoffSimulator, ESTRATEGIAS, tasa_mensual_efectiva, pago_minimo_tarjeta
+)
 from ..tasks import (
     process_drive_tickets,
     process_drive_investments,
@@ -43,7 +48,7 @@ from ..models import (
     inversiones, GananciaMensual, PendingInvestment, Deuda, 
     PagoAmortizacion, AmortizacionPendiente, Factura, PortfolioHistory,
     GoogleCredentials, TiendaFacturacion, Cuenta, Presupuesto, 
-    HistorialReciboServicio
+    HistorialReciboServicio, EstadoCuentaTarjeta
 )
 
 logger = logging.getLogger(__name__)
@@ -53,8 +58,7 @@ def lista_deudas(request):
     """
     Muestra una lista de todas las deudas (préstamos y tarjetas) del usuario.
     """
-    suscripcion, created = Suscripcion.objects.get_or_create(usuario=request.user)
-    es_usuario_premium = suscripcion.is_active()
+    es_usuario_premium = request.plan.es_premium
     deudas = Deuda.objects.filter(propietario=request.user).order_by('fecha_adquisicion')
     context = {'deudas': deudas,
                'es_usuario_premium': es_usuario_premium
@@ -125,6 +129,102 @@ def detalle_deuda(request, deuda_id):
     }
     return render(request, 'detalle_deuda.html', context)
 
+@login_required
+def simular_liquidacion_deudas(request):
+    """
+    Simula la liquidación de todas las deudas del usuario.
+    ?estrategias=avalancha,bola_de_nieve&extra=1500 o, para comparar montos, ?extras=0,500,1000.
+    Siempre incluye el escenario de solo mínimos como referencia.
+    """
+    estrategias = [e for e in request.GET.get('estrategias', 'avalancha,bola_de_nieve').split(',') if e]
+    if any(e not in ESTRATEGIAS for e in estrategias):
+        return JsonResponse({"error": f"Estrategias válidas: {', '.join(ESTRATEGIAS)}"}, status=400)
+    try:
+        extras = [round(float(x), 2) for x in request.GET.get('extras', request.GET.get('extra', '0')).split(',') if x]
+    except ValueError:
+        return JsonResponse({"error": "Los montos extra deben ser numéricos."}, status=400)
+    if not extras or any(not math.isfinite(x) or x < 0 for x in extras) or len(extras) > 50:
+        return JsonResponse({"error": "Indica entre 1 y 50 montos extra no negativos."}, status=400)
+
+    escenarios = [('minimos', 0.0)] + [(e, x) for x in extras for e in estrategias if e != 'minimos']
+    return JsonResponse(DebtPayoffSimulator.resultado(request.user, escenarios))
+
+def _resumen_estados_cuenta(deuda, estados) -> list[dict]:
+    """
+    Resume ciclos de una tarjeta ordenados del más reciente al más antiguo. El saldo al
+    corte de cada ciclo es el adeudo actual menos el neto de los ciclos posteriores, por
+    eso 'estados' debe incluir todos los ciclos más recientes que el último que interese.
+    """
+    hoy = timezone.now().date()
+    adeudo = float(deuda.total_gastado)
+    tasa = tasa_mensual_efectiva(deuda.tasa_interes)
+    posteriores, pagos_despues_del_corte = 0.0, 0.0
+    resumen = []
+    for estado in estados:
+        saldo_corte = round(adeudo - posteriores, 2)
+        posteriores += float(estado.cargos - estado.pagos)
+        minimo = pago_minimo_tarjeta(saldo_corte, tasa, float(deuda.monto_total))
+        resumen.append({
+            'fecha_inicio': estado.fecha_inicio,
+            'fecha_corte': estado.fecha_corte,
+            'fecha_pago': estado.fecha_pago,
+            'abierto': estado.fecha_corte >= hoy,
+            'cargos': round(float(estado.cargos), 2),
+            'pagos': round(float(estado.pagos), 2),
+            'movimientos': estado.movimientos,
+            'saldo_al_corte': saldo_corte,
+            # Lo ya abonado en el ciclo siguiente cuenta contra lo que falta pagar de este corte.
+            'pago_no_intereses': round(max(saldo_corte - pagos_despues_del_corte, 0.0), 2),
+            'pago_minimo': round(max(minimo - pagos_despues_del_corte, 0.0), 2),
+        })
+        pagos_despues_del_corte = float(estado.pagos)
+    return resumen
+
+@login_required
+def api_estados_cuenta_tarjeta(request, deuda_id):
+    """Últimos ciclos de facturación de una tarjeta (?ciclos=6), leídos de la tabla de estados de cuenta."""
+    deuda = get_object_or_404(Deuda, id=deuda_id, propietario=request.user, tipo_deuda='TARJETA_CREDITO')
+    try:
+        ciclos = min(max(int(request.GET.get('ciclos', 6)), 1), 36)
+    except ValueError:
+        return JsonResponse({"error": "ciclos debe ser un número."}, status=400)
+    estados = deuda.estados_cuenta.all()[:ciclos]
+    return JsonResponse({
+        'deuda': deuda.id,
+        'nombre': deuda.nombre,
+        'adeudo_actual': round(float(deuda.total_gastado), 2),
+        'estados': _resumen_estados_cuenta(deuda, estados),
+    })
+
+@login_required
+def api_proximos_pagos_tarjetas(request):
+    """
+    Próximo pago de cada tarjeta del usuario: el estado de cuenta ya cortado que sigue
+    pendiente de vencer o, si no hay, el ciclo abierto. Dos consultas en total.
+    """
+    hoy = timezone.now().date()
+    tarjetas = {d.id: d for d in Deuda.objects.filter(propietario=request.user, tipo_deuda='TARJETA_CREDITO')}
+    por_tarjeta = {}
+    for estado in EstadoCuentaTarjeta.objects.filter(deuda_id__in=tarjetas, fecha_pago__gte=hoy):
+        por_tarjeta.setdefault(estado.deuda_id, []).append(estado)
+
+    pagos = []
+    for deuda_id, deuda in tarjetas.items():
+        resumen = _resumen_estados_cuenta(deuda, por_tarjeta.get(deuda_id, []))
+        # El más antiguo de los vigentes es el que vence primero.
+        proximo = resumen[-1] if resumen else {
+            'fecha_corte': deuda.proxima_fecha_corte,
+            'fecha_pago': deuda.proxima_fecha_pago,
+            'abierto': True,
+            'saldo_al_corte': round(float(deuda.total_gastado), 2),
+            'pago_no_intereses': max(round(float(deuda.total_gastado), 2), 0.0),
+            'pago_minimo': pago_minimo_tarjeta(float(deuda.total_gastado), tasa_mensual_efectiva(deuda.tasa_interes),
+                                               float(deuda.monto_total)),
+        }
+        pagos.append({'deuda': deuda_id, 'nombre': deuda.nombre, **proximo})
+    pagos.sort(key=lambda p: (p['fecha_pago'] is None, p['fecha_pago'] or hoy))
+    return JsonResponse({'pagos': pagos})
+
 @login_required
 def editar_deuda(request, deuda_id):
     deuda = get_object_or_404(Deuda, id=deuda_id, propietario=request.user)
@@ -132,6 +232,7 @@ def editar_deuda(request, deuda_id):
     if request.method == 'POST':
         monto_total_anterior = deuda.monto_total
         estaba_pendiente_configuracion = deuda.requiere_configuracion_adicional
+        ciclo_anterior = (deuda.nombre, deuda.dia_corte, deuda.dia_pago)
         
         form = DeudaForm(request.POST, instance=deuda)
         if form.is_valid():
@@ -147,6 +248,8 @@ def editar_deuda(request, deuda_id):
 
             deuda.requiere_configuracion_adicional = False # Ya se actualizó la configuración
             deuda.save()
+            if deuda.tipo_deuda == 'TARJETA_CREDITO' and ciclo_anterior != (deuda.nombre, deuda.dia_corte, deuda.dia_pago):
+                EstadoCuentaTarjeta.objects.reconstruir(deuda)
             messages.success(request, f"La deuda '{deuda.nombre}' ha sido actualizada.")
             return redirect('lista_deudas')
     else:
@@ -191,7 +294,7 @@ def revisar_amortizaciones(request, deuda_id):
     """Muestra las tablas de amortización pendientes para su revisión."""
     deuda = get_object_or_404(Deuda, id=deuda_id, propietario=request.user)
     pendientes = AmortizacionPendiente.objects.filter(deuda=deuda, estado='pendiente')
-    # pago_total no viene en datos_json (lo calcula PagoAmortizacion al aprobar).
+    # pago_total no viene en datos_json (lo calcula DebtService.reemplazar_tabla_amortizacion al aprobar).
     # Lo anotamos en memoria para mostrarlo en la tabla de revisión (no se guarda).
     for p in pendientes:
         for cuota in p.datos_json:
@@ -215,22 +318,12 @@ def aprobar_amortizacion(request, pendiente_id):
     if request.method == 'POST':
         cuotas_json = pendiente.datos_json
         
-        # Borramos la tabla de amortización existente para evitar duplicados
-        PagoAmortizacion.objects.filter(deuda=deuda).delete()
-
-        for i, cuota_data in enumerate(cuotas_json, 1):
-            PagoAmortizacion.objects.create(
-                deuda=deuda,
-                numero_cuota=i,
-                fecha_vencimiento=parse_date_safely(cuota_data.get("fecha_vencimiento")),
-                capital=Decimal(str(cuota_data.get("capital", 0.0))),
-                interes=Decimal(str(cuota_data.get("interes", 0.0))),
-                iva=Decimal(str(cuota_data.get("iva", 0.0))),
-                saldo_insoluto=Decimal(str(cuota_data.get("saldo_insoluto", 0.0)))
-            )
-        
-        pendiente.estado = 'aprobada'
-        pendiente.save()
+        # Reemplaza la tabla y marca la pendiente en una sola transacción: ni tablas a medias
+        # ni una tabla ya aplicada que siga apareciendo para aprobar.
+        with transaction.atomic():
+            DebtService.reemplazar_tabla_amortizacion(deuda, DebtService.cuotas_desde_json(cuotas_json))
+            pendiente.estado = 'aprobada'
+            pendiente.save()
         messages.success(request, f"Tabla de amortización del archivo '{pendiente.nombre_archivo}' aprobada y aplicada.")
         return redirect('detalle_deuda', deuda_id=deuda.id)
 
@@ -52,14 +52,12 @@ def facturacion(request):
     """
     Muestra el historial de facturas registradas.
     """
-    suscripcion, created = Suscripcion.objects.get_or_create(usuario=request.user)
-    
     # Ahora consultamos el modelo Factura en lugar de registro_transacciones
     facturas = Factura.objects.filter(propietario=request.user, estado='facturado').order_by('-fecha_emision')
 
     context = {
         'facturas': facturas,
-        'es_usuario_premium': suscripcion.is_active()
+        'es_usuario_premium': request.plan.es_premium
     }
     return render(request, 'lista_facturacion.html', context)
 
@@ -14,13 +14,15 @@ from django.contrib.auth.models import User
 from django.utils.dateformat import DateFormat
 from django.db.models.functions import TruncMonth
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, require_GET
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
 
+from asgiref.sync import sync_to_async
 from celery.result import AsyncResult, GroupResult
 
 from ..utils import parse_date_safely
+from .respuestas import grafica_condicional, respuesta_json
 from ..tasks import (
     process_drive_tickets,
     process_drive_investments,
@@ -34,11 +36,12 @@ from ..forms import (
 )
 from ..services import (
     TransactionService, MercadoPagoService, StockPriceService, 
-    InvestmentService, RISCService, BillingService
+    InvestmentService, RISCService, BillingService, PortfolioSeriesService, LotMatchingService,
+    PortfolioMetricsService
 )
 from ..models import (
     registro_transacciones, Suscripcion, TransaccionPendiente, 
-    inversiones, PendingInvestment, Deuda,
+    inversiones, Holding, PendingInvestment, Deuda,
     PagoAmortizacion, AmortizacionPendiente, Factura, PortfolioHistory,
     GoogleCredentials, TiendaFacturacion, Cuenta, Presupuesto,
     HistorialReciboServicio
@@ -46,16 +49,20 @@ from ..models import (
 
 logger = logging.getLogger(__name__)
 
+# Lo que la página trae incrustado (rango 6M); el resto se pide a datos_portafolio.
+PUNTOS_INICIALES = 200
+RANGOS_PORTAFOLIO = {'1s': 7, '1m': 30, '6m': 182, '1a': 365, '5a': 1826}
+
 @login_required
 def vista_portafolio(request):
     """
     Vista dedicada para el Portafolio de Inversiones.
     """
-    suscripcion, created = Suscripcion.objects.get_or_create(usuario=request.user)
-    es_usuario_premium = suscripcion.is_active()
+    es_usuario_premium = request.plan.es_premium
 
     # --- LÓGICA DE ACTIVOS ---
-    mis_inversiones = inversiones.objects.filter(propietario=request.user).order_by('-valor_actual_mercado')
+    # Una posición por activo (Holding) en vez de un renglón por lote.
+    mis_inversiones = Holding.objects.filter(propietario=request.user).order_by('-valor_actual_mercado')
     
     # Totales Generales
     agregados = mis_inversiones.aggregate(
@@ -72,15 +79,20 @@ def vista_portafolio(request):
     if total_invertido > 0:
         porcentaje_ganancia = ((valor_total - total_invertido) / total_invertido) * 100
 
-    # --- GRÁFICA DE RENDIMIENTO (evolución diaria del portafolio) ---
-    historial = PortfolioHistory.objects.filter(usuario=request.user).order_by('fecha')
-    perf_labels = []
-    perf_valores = []
-    perf_ganancias = []
-    for h in historial:
-        perf_labels.append(h.fecha.strftime('%Y-%m-%d'))
-        perf_valores.append(float(h.valor_total))
-        perf_ganancias.append(float(h.ganancia_no_realizada))
+    # --- GRÁFICA DE RENDIMIENTO (evolución del portafolio) ---
+    # Solo viaja el rango por defecto ya reducido; los demás rangos los pide el JS.
+    perf_inicial = None
+    metricas = None
+    if PortfolioHistory.objects.existe(request.user.id):
+        hoy = timezone.localdate()
+        perf_inicial = PortfolioSeriesService.serie(
+            request.user.id, hasta=hoy, desde=hoy - timedelta(days=RANGOS_PORTAFOLIO['6m']), puntos=PUNTOS_INICIALES
+        )
+        # TWR / TIR / caída / volatilidad: el porcentaje simple engaña con aportaciones escalonadas.
+        metricas = PortfolioMetricsService.de_usuario(request.user.id)
+        if metricas:
+            # El servicio da fracciones; la plantilla muestra porcentajes.
+            metricas = {k: v * 100 if isinstance(v, float) else v for k, v in metricas.items()}
 
     context = {
         'inversiones': mis_inversiones,
@@ -89,13 +101,62 @@ def vista_portafolio(request):
         'ganancia_total': ganancia_total,
         'porcentaje_ganancia': porcentaje_ganancia,
         'es_usuario_premium': es_usuario_premium,
-        # Series para la gráfica de rendimiento (listas crudas; json_script las serializa)
-        'perf_labels': perf_labels,
-        'perf_valores': perf_valores,
-        'perf_ganancias': perf_ganancias,
+        # Serie inicial de la gráfica de rendimiento (json_script la serializa)
+        'perf_inicial': perf_inicial,
+        'metricas': metricas,
     }
     return render(request, 'portafolio.html', context)
 
+@login_required
+@require_GET
+@grafica_condicional
+async def datos_portafolio(request):
+    """
+    Serie de rendimiento del portafolio. ?rango=1s|1m|6m|1a|5a|max o ?desde=&hasta= (AAAA-MM-DD);
+    ?puntos tope de puntos (LTTB); ?resolucion=auto|diaria|semanal|mensual; ?moneda=USD|MXN.
+    """
+    user = await request.auser()
+    rango = request.GET.get('rango', '6m')
+    resolucion = request.GET.get('resolucion', 'auto')
+    moneda = request.GET.get('moneda', 'USD').upper()
+    try:
+        puntos = min(max(int(request.GET.get('puntos', 300)), 2), 2000)
+        hasta = datetime.strptime(request.GET['hasta'], '%Y-%m-%d').date() if request.GET.get('hasta') else timezone.localdate()
+        if request.GET.get('desde'):
+            desde = datetime.strptime(request.GET['desde'], '%Y-%m-%d').date()
+        elif rango == 'max':
+            desde = None
+        else:
+            desde = hasta - timedelta(days=RANGOS_PORTAFOLIO[rango])
+        if resolucion != 'auto' and resolucion not in PortfolioSeriesService.RESOLUCIONES:
+            raise ValueError(resolucion)
+        if moneda not in PortfolioSeriesService.MONEDAS:
+            raise ValueError(moneda)
+    except (ValueError, KeyError):
+        return JsonResponse({'error': 'Parámetros de rango inválidos'}, status=400)
+
+    serie = await sync_to_async(PortfolioSeriesService.serie)(user.id, hasta, desde, puntos, resolucion, moneda)
+    return respuesta_json(serie)
+
+@login_required
+@require_GET
+@grafica_condicional
+async def datos_metricas_portafolio(request):
+    """Métricas de rendimiento de todo el historial (TWR, TIR, máxima caída, volatilidad)."""
+    user = await request.auser()
+    metricas = await sync_to_async(PortfolioMetricsService.de_usuario)(user.id)
+    return respuesta_json(metricas or {})
+
+@login_required
+@require_GET
+def ganancias_realizadas(request):
+    """Reporte fiscal: ganancia realizada por activo en ?anio= (por defecto el actual)."""
+    try:
+        anio = int(request.GET.get('anio', timezone.localdate().year))
+    except ValueError:
+        return JsonResponse({'error': 'Año inválido'}, status=400)
+    return respuesta_json(LotMatchingService.reporte(request.user.id, anio))
+
 @login_required
 def iniciar_procesamiento_inversiones(request):
     """Inicia el procesamiento automático de inversiones."""
@@ -217,9 +278,12 @@ def lista_inversiones(request):
     """
     Muestra todas las inversiones del usuario logueado.
     """
-    suscripcion, created = Suscripcion.objects.get_or_create(usuario=request.user)
     lista = inversiones.objects.filter(propietario=request.user).order_by('-fecha_compra')
-    es_usuario_premium = suscripcion.is_active()
+    # Desde el portafolio: solo los lotes de una posición (?activo=<clave de Holding>)
+    if request.GET.get('activo'):
+        activo = request.GET['activo']
+        lista = lista.filter(Q(emisora_ticker__iexact=activo) | Q(nombre_activo=activo))
+    es_usuario_premium = request.plan.es_premium
     context = {'inversiones': lista, 'es_usuario_premium': es_usuario_premium}
     return render(request, 'lista_inversiones.html', context)
 
@@ -0,0 +1,80 @@
+# finanzas/views/respuestas.py
+import gzip
+import hashlib
+from decimal import Decimal
+from functools import wraps
+
+import orjson
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+
+from ..services.data_version_service import DataVersionService
+
+try:
+    import brotli  # viene con whitenoise[brotli]
+except ImportError:
+    brotli = None
+
+# Por debajo de esto comprimir cuesta más de lo que ahorra.
+MIN_BYTES_COMPRESION = 1024
+
+
+def _default_json(obj):
+    # Igual que DjangoJSONEncoder: los Decimal viajan como texto para no perder precisión.
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError
+
+
+def respuesta_json(datos, status=200) -> HttpResponse:
+    """JsonResponse con orjson (fechas nativas; Decimal como texto)."""
+    return HttpResponse(orjson.dumps(datos, default=_default_json), status=status, content_type='application/json')
+
+
+def _comprimir(request, respuesta):
+    if len(respuesta.content) < MIN_BYTES_COMPRESION or respuesta.has_header('Content-Encoding'):
+        return respuesta
+    aceptadas = request.headers.get('Accept-Encoding', '')
+    if brotli is not None and 'br' in aceptadas:
+        respuesta.content, respuesta['Content-Encoding'] = brotli.compress(respuesta.content, quality=5), 'br'
+    elif 'gzip' in aceptadas:
+        respuesta.content, respuesta['Content-Encoding'] = gzip.compress(respuesta.content, compresslevel=6, mtime=0), 'gzip'
+    respuesta['Content-Length'] = str(len(respuesta.content))
+    return respuesta
+
+
+def grafica_condicional(vista):
+    """
+    Para los endpoints async de gráficas. El ETag sale de la URL, la versión de datos del
+    usuario y el día (los defaults de año/mes/rango dependen de hoy): si el navegador ya
+    tiene esa versión se responde 304 sin tocar la base. Si Redis no responde no hay ETag
+    y la vista corre normal. Las respuestas grandes se comprimen (brotli o gzip).
+    """
+    @wraps(vista)
+    async def envoltura(request, *args, **kwargs):
+        user = await request.auser()
+        version = await sync_to_async(DataVersionService.actual)(user.pk)
+        etag = None
+        if version is not None:
+            firma = f"{request.get_full_path()}|{version}|{timezone.localdate()}"
+            etag = f'W/"{hashlib.sha1(firma.encode()).hexdigest()[:20]}"'
+            if etag in parse_etags(request.headers.get('If-None-Match', '')):
+                respuesta = HttpResponseNotModified()
+                respuesta['ETag'] = etag
+                patch_cache_control(respuesta, private=True, no_cache=True)
+                patch_vary_headers(respuesta, ('Cookie', 'Accept-Encoding'))
+                return respuesta
+
+        respuesta = await vista(request, *args, **kwargs)
+        if respuesta.status_code != 200:
+            return respuesta
+        if etag:
+            respuesta['ETag'] = etag
+            # El navegador la guarda pero revalida cada vez: en el peor caso cuesta un 304.
+            patch_cache_control(respuesta, private=True, no_cache=True)
+        patch_vary_headers(respuesta, ('Cookie', 'Accept-Encoding'))
+        return _comprimir(request, respuesta)
+    return envoltura
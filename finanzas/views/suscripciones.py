@@ -52,7 +52,7 @@ def gestionar_suscripcion(request):
     """
     Muestra el estado de la suscripción y genera el link de pago si es necesario.
     """
-    suscripcion, created = Suscripcion.objects.get_or_create(usuario=request.user)
+    suscripcion = request.plan.suscripcion
     
     link_pago = None
     if not suscripcion.is_active():
@@ -111,7 +111,8 @@ def mercadopago_webhook(request):
                 if not user:
                     return HttpResponse(status=404) # User not found
 
-                suscripcion_obj = Suscripcion.objects.get(usuario=user)
+                # Las páginas ya no crean la fila; la primera notificación la da de alta.
+                suscripcion_obj, _ = Suscripcion.objects.get_or_create(usuario=user)
 
                 # ¡La magia! Actualizamos nuestro modelo según el estado de Mercado Pago
                 if status == 'authorized':
@@ -7,7 +7,7 @@ from django.utils import timezone
 from django.urls import reverse
 from django.contrib import messages
 from django.contrib.auth import login
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.core.mail import send_mail
 from django.conf import settings
 from django.db.models import Sum, Q, Count
@@ -19,6 +19,7 @@ from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
 
+from asgiref.sync import sync_to_async
 from celery.result import AsyncResult, GroupResult
 from config.celery import app as celery_app
 
@@ -36,7 +37,8 @@ from ..forms import (
 )
 from ..services import (
     TransactionService, MercadoPagoService, StockPriceService, 
-    InvestmentService, RISCService, BillingService
+    InvestmentService, RISCService, BillingService, ScanProgress, FairAdmissionQueue,
+    ReferenceDataService,
 )
 from ..models import (
     registro_transacciones, Suscripcion, TransaccionPendiente, 
@@ -48,6 +50,9 @@ from ..models import (
 
 logger = logging.getLogger(__name__)
 
+# Una conexión SSE se cierra tras este tiempo; EventSource reconecta solo con Last-Event-ID.
+SSE_MAX_SECONDS = 600
+
 @login_required
 def aprobar_todos_tickets(request):
     """
@@ -148,8 +153,7 @@ def crear_transacciones(request):
 
 @login_required
 def lista_transacciones(request):
-    suscripcion, created = Suscripcion.objects.get_or_create(usuario=request.user)
-    es_usuario_premium = suscripcion.is_active()
+    es_usuario_premium = request.plan.es_premium
     current_year = datetime.now().year
     current_month = datetime.now().month
     year = int(request.GET.get('year', current_year))
@@ -198,8 +202,9 @@ def eliminar_transaccion(request, transaccion_id):
 def revisar_tickets(request):
     tickets_pendientes = TransaccionPendiente.objects.filter(propietario=request.user, estado='pendiente')
     # --- NUEVO: Obtenemos las cuentas y deudas del usuario ---
-    cuentas_usuario = Cuenta.objects.filter(propietario=request.user)
-    deudas_usuario = Deuda.objects.filter(propietario=request.user)
+    refs = ReferenceDataService.de_usuario(request.user)
+    cuentas_usuario = list(refs.cuentas.values())
+    deudas_usuario = list(refs.deudas.values())
     
     # Formateamos la fecha de manera segura para mostrarla en el template
     for ticket in tickets_pendientes:
@@ -261,12 +266,79 @@ def get_initial_task_result(request, task_id):
         logger.error(f"Error en get_initial_task_result: {e}")
         return JsonResponse({"status": "FAILURE", "info": str(e)}, status=500)
 
+async def _eventos_escaneo(progress, scan_id: str, user_id: int, meta: dict, last_id: str = '0'):
+    """
+    Mensajes SSE del escaneo desde last_id hasta su evento 'completed' (o SSE_MAX_SECONDS).
+    Si al abrir no había meta, el dueño se valida con el primer evento que llegue.
+    Es async para que, bajo ASGI, cada mensaje salga en cuanto se genera.
+    """
+    owner_checked = bool(meta)
+    inicio = timezone.now()
+    try:
+        yield "retry: 3000\n\n"
+        while (timezone.now() - inicio).total_seconds() < SSE_MAX_SECONDS:
+            eventos = await progress.aread(scan_id, last_id=last_id)
+            if not eventos:
+                yield ": keepalive\n\n"
+                continue
+            if not owner_checked:
+                owner = (await sync_to_async(progress.summary)(scan_id)).get('user_id')
+                if owner and owner != user_id:
+                    return
+                owner_checked = True
+            for entry_id, evento, datos in eventos:
+                last_id = entry_id
+                yield f"id: {entry_id}\nevent: {evento}\ndata: {json.dumps(datos, default=str)}\n\n"
+                if evento == 'completed':
+                    return
+    finally:
+        await progress.aclose()
+
+@login_required
+async def stream_scan_progress(request, scan_id):
+    """
+    Stream SSE con el progreso de un escaneo de Drive (un evento por archivo).
+    Sustituye al sondeo de GroupResult: el navegador abre una sola conexión.
+    """
+    user = await request.auser()
+    progress = ScanProgress()
+    try:
+        meta = await sync_to_async(progress.summary)(scan_id)
+    except Exception as e:
+        logger.error(f"Error en stream_scan_progress: {e}")
+        return JsonResponse({"status": "FAILURE", "info": str(e)}, status=503)
+    # Si el lanzador aún no arranca no hay meta; el stream se crea en cuanto lo haga.
+    if meta and meta['user_id'] != user.id:
+        return JsonResponse({"status": "FORBIDDEN"}, status=403)
+
+    eventos = _eventos_escaneo(progress, scan_id, user.id, meta, request.headers.get('Last-Event-ID') or '0')
+    response = StreamingHttpResponse(eventos, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @login_required
 def get_group_status(request, group_id):
     """
     Consulta el estado de un GroupResult para reportar el progreso.
+    Si el grupo tiene canal de progreso se leen sus contadores en O(1).
     """
     try:
+        resumen = ScanProgress().summary_for_group(group_id)
+        if resumen:
+            if resumen['user_id'] != request.user.id:
+                return JsonResponse({"status": "FORBIDDEN"}, status=403)
+            total, completed = resumen['total'], resumen['finished']
+            if completed >= total:
+                return JsonResponse({"status": "COMPLETED", **resumen})
+            return JsonResponse({
+                "status": "PROGRESS",
+                "total": total,
+                "completed": completed,
+                "failed": resumen['failed'],
+                "progress": int((completed / total) * 100) if total > 0 else 0
+            })
+
         group_result = GroupResult.restore(group_id)
         if not group_result:
              return JsonResponse({"status": "PENDING"})
@@ -306,6 +378,10 @@ def cancelar_procesamiento(request):
         celery_app.control.revoke(task_id, terminate=True)
         logger.info(f"Tarea principal revocada: {task_id}")
 
+        # Las subtareas de este escaneo (id = tarea lanzadora) que aún esperan turno en la cola
+        # justa ni siquiera llegan al broker; las de otros escaneos del usuario siguen.
+        FairAdmissionQueue().discard(request.user.id, task_id)
+
         # Si ya se generó el group_id, revocamos todas las subtareas pendientes
         if group_id:
             group_result = GroupResult.restore(group_id)
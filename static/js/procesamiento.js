@@ -130,6 +130,53 @@ function initTaskProcessor() {
         }
     };
 
+    // Canal SSE: un evento por archivo en lugar de sondear el grupo cada 2.5s.
+    // Resuelve en 'completed'; si el navegador o el servidor no lo soportan, rechaza y se usa el sondeo.
+    let currentSource = null;
+    const streamScanProgress = (taskId) => new Promise((resolve, reject) => {
+        if (!window.EventSource) return reject(new Error("SSEUnavailable"));
+        const source = new EventSource(`/progreso-escaneo/${taskId}/`);
+        currentSource = source;
+        let total = 0;
+        let finished = 0;
+        let received = false;
+
+        const close = () => { source.close(); currentSource = null; };
+        const onFileDone = (e) => {
+            const data = JSON.parse(e.data);
+            finished += 1;
+            const pct = total > 0 ? Math.min(99, 25 + Math.round((finished / total) * 75)) : 25;
+            updateUIProgress(pct, `Procesando... ${finished} de ${total} archivos listos (${data.file_name || ''}).`);
+        };
+
+        source.addEventListener('started', (e) => {
+            received = true;
+            total = JSON.parse(e.data).total;
+            updateUIProgress(25, `Procesando ${total} archivos...`);
+        });
+        source.addEventListener('linked', (e) => { currentGroupId = JSON.parse(e.data).group_id; });
+        source.addEventListener('done', onFileDone);
+        source.addEventListener('failed', onFileDone);
+        source.addEventListener('throttled', onFileDone);
+        source.addEventListener('retrying', (e) => {
+            const data = JSON.parse(e.data);
+            progressText.textContent = `Servicio saturado, reintentando ${data.file_name || ''} en ${Math.round(data.countdown)}s...`;
+        });
+        source.addEventListener('completed', (e) => {
+            received = true;
+            close();
+            const data = JSON.parse(e.data);
+            if (data.status === 'NO_FILES') return reject(new Error(data.message || "No se encontraron nuevos tickets."));
+            if (data.status === 'ERROR') return reject(new Error(`Tarea inicial falló: ${data.message || ''}`));
+            resolve();
+        });
+        source.onerror = () => {
+            if (cancelRequested) { close(); return reject(new Error("UserCancelled")); }
+            // Si nunca llegó un evento, el servidor no ofrece el stream: volvemos al sondeo.
+            if (!received) { close(); reject(new Error("SSEUnavailable")); }
+        };
+    });
+
     startBtn.addEventListener('click', async () => {
         startBtn.disabled = true;
         cancelRequested = false;
@@ -147,10 +194,15 @@ function initTaskProcessor() {
             currentTaskId = initialData.task_id;
 
             updateUIProgress(15, "Buscando tickets...");
-            currentGroupId = await waitForGroupId(currentTaskId);
-
-            updateUIProgress(25, "Procesando tickets...");
-            await monitorGroupProgress(currentGroupId);
+            try {
+                await streamScanProgress(currentTaskId);
+            } catch (streamError) {
+                if (streamError.message !== "SSEUnavailable") throw streamError;
+                currentGroupId = await waitForGroupId(currentTaskId);
+
+                updateUIProgress(25, "Procesando tickets...");
+                await monitorGroupProgress(currentGroupId);
+            }
 
             if (!cancelRequested) {
                 updateUIProgress(100, "¡Proceso completado!", 'bg-green-500');
@@ -178,6 +230,7 @@ function initTaskProcessor() {
             cancelBtn.disabled = true;
             cancelBtn.innerText = "Cancelando...";
             wakeUpEarly();
+            if (currentSource) currentSource.onerror();
 
             let cancelType = 'tickets';
             const startUrl = startBtn.dataset.startUrl || '';